@@ -85,6 +85,15 @@ class Agent(object):
 	def getDump(self):
 		return self._call("getDump")
 
+	def locateVM(self, name):
+		return self._call("locateVM", name)
+
+	def getVMIndex(self):
+		return self._call("getVMIndex")
+
+	def getDuplicateVMs(self):
+		return self._call("getDuplicateVMs")
+
 	def forceElection(self):
 		return self._call("forceElection")
 
@@ -97,6 +106,12 @@ class Agent(object):
 	def panic(self):
 		return self._callMaster("panic")
 
+	def getMetrics(self):
+		return self._callMaster("getMetrics")
+
+	def getFailoverPlans(self):
+		return self._callMaster("getFailoverPlans")
+
 	def grabLock(self, name):
 		return self._callMaster("grabLock",name)
 
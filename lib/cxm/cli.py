@@ -34,7 +34,7 @@ from xen.xm.opts import wrap
 from optparse import OptionParser
 from twisted.internet import reactor, threads, defer
 from twisted.internet.error import ConnectError
-import core, xencluster, node
+import core, xencluster, node, loadbalancer
 from agent import Agent
 
 
@@ -48,7 +48,7 @@ def select_node_by_vm(cluster, vm, options):
 	if options.node:
 		node=cluster.get_node(options.node)
 	else:
-		nodes=cluster.search_vm_started(vm)
+		nodes=cluster.locate_vm(vm)
 		if(len(nodes)>1):
 			print "** ERROR : Multiples instances found on :"
 			print "**  ->  " + ", ".join([n.get_hostname() for n in nodes])
@@ -71,7 +71,7 @@ def cxm_create(cluster, options, vm):
 	vm=os.path.basename(vm)
 
 	# Check if vm is't already started somewhere on the cluster
-	nodes=cluster.search_vm_started(vm)
+	nodes=cluster.locate_vm(vm)
 	if(len(nodes)>0):
 		print "** Nothing to do :"
 		print "** " + vm + " is running on "+", ".join([n.get_hostname() for n in nodes])
@@ -296,7 +296,7 @@ def cxm_search(cluster, options, vm):
 	if not core.cfg['QUIET'] : print "Searching", vm, "..."
 
 	# Search started vm
-	found=cluster.search_vm_started(vm)
+	found=cluster.locate_vm(vm)
 	if(len(found)==0):
 		print " -> VM is not started."
 	else:
@@ -458,6 +458,9 @@ def get_parser():
 	parser.add_option("-c", "--console",
 					  action="store_true", dest="console", default=False,
 					  help="Attach console to the domain as soon as it has started.")
+	parser.add_option("-s", "--strategy", dest="strategy", metavar="name", default=core.cfg['LB_STRATEGY'],
+					  type="choice", choices=sorted(loadbalancer.STRATEGIES.keys()),
+					  help="Loadbalancer's strategy: "+", ".join(sorted(loadbalancer.STRATEGIES.keys())))
 
 	parser.usage = "%prog <subcommand> [args] [options]\n\n"
 	parser.usage += get_help()
@@ -515,7 +518,8 @@ SUBCOMMAND_HELP = {
 		'Live migrate the virtual machine.',
 		'If --force-node is not given, the vm will be searched on the cluster.'),
 	'loadbalance'	: ('', 
-		'Run the loadbalancer to equilibrate load.'),
+		'Run the loadbalancer to equilibrate load.',
+		'The search algorithm can be choosen with --strategy.'),
 	'search'		: ('<fqdn>', 
 		'Search the cluster for the VM. You can use globbing to match vm name.',
 		'’auto’ symlinks founds are also reported.'),
@@ -612,6 +616,7 @@ def run():
 	core.cfg['API_DEBUG']=options.debug
 	core.cfg['QUIET']=options.quiet
 	core.cfg['NOREFRESH']=options.norefresh
+	core.cfg['LB_STRATEGY']=options.strategy
 
 	# Get the subcommand
 	cmd = cxm_lookup_cmd(args[0])
@@ -647,7 +652,9 @@ def run():
 
 	def runCmd(result):
 		# result is a cluster instance
-		d=defer.maybeDeferred(cmd, result, options, *args[1::])
+		d=agent.getVMIndex()
+		d.addCallbacks(result.set_vm_index, lambda _: None) # Without index, all nodes are searched
+		d.addCallback(lambda _: cmd(result, options, *args[1::]))
 		d.addCallback(lambda _: result.disconnect())
 		return d
 
@@ -145,8 +145,8 @@ def ctl_quit(*args):
 	
 	return d
 
-def ctl_format(*args):
-	"""Format heartbeat device with cxm's filesystem."""
+def format_disk(version):
+	"""Format heartbeat device with the given version of cxm's filesystem."""
 	def format():
 		if DiskHeartbeat.is_in_use():
 			nodes=DiskHeartbeat().get_all_ts().keys()
@@ -156,11 +156,19 @@ def ctl_format(*args):
 				print "Aborded by user."
 				raise SystemExit(0)
 
-		DiskHeartbeat.format()
-		print "Device", core.cfg['HB_DISK'], "formatted."
+		DiskHeartbeat.format(version)
+		print "Device", core.cfg['HB_DISK'], "formatted (v%d)." % (version)
 
 	return threads.deferToThread(format)
 
+def ctl_format(*args):
+	"""Format heartbeat device with cxm's filesystem."""
+	return format_disk(1)
+
+def ctl_format_v2(*args):
+	"""Format heartbeat device with cxm's filesystem v2."""
+	return format_disk(2)
+
 def ctl_panic(*args):
 	"""Ask master to engage panic mode."""
 	def success(result):
@@ -208,6 +216,7 @@ commands = {
 	'election': ctl_election,
 	'quit': ctl_quit,
 	'format': ctl_format,
+	'format_v2': ctl_format_v2,
 	'panic': ctl_panic,
 	'recover': ctl_recover,
 	'kill': ctl_kill,
@@ -246,6 +255,9 @@ def get_parser():
 	group.add_option("-f", "--format",
 						action="store_true", dest="format", default=False,
 						help="Format the heartbeat device.")
+	group.add_option("--format-v2",
+						action="store_true", dest="format_v2", default=False,
+						help="Format the heartbeat device with the v2 format, for up to 128 nodes. All nodes must support it.")
 	group.add_option("--force-panic",
 						action="store_true", dest="panic", default=False,
 						help="Switch master into panic mode.")
@@ -0,0 +1,311 @@
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2011-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+# $Id:$
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+
+"""
+This module hold the codecs used to send UDP messages (see messages.py).
+
+Codecs encode the value of a message, ie. the dict {'type': ..., 'data': ...},
+into a datagram. The codec used to send messages is selected by WIRE_FORMAT,
+but decode() understand all formats, so the format can be changed node by node.
+"""
+
+import simplejson as json
+import struct, zlib
+import core
+
+
+# Not in configuration file because need to be consistent over all nodes
+USE_ZLIB=True
+
+class JSONCodec(object):
+
+	"""This class encode messages in JSON, compressed with zlib if USE_ZLIB is True."""
+
+	def encode(self, msg):
+		data=json.dumps(msg, separators=(',',':'))
+
+		if USE_ZLIB:
+			crc=zlib.adler32(data)
+			zip=zlib.compress(data)
+			data=str(crc)+","+zip
+
+		return data
+
+	def decode(self, data):
+		try:
+			if USE_ZLIB:
+				(crc,zip)=data.split(',',1)
+				data=zlib.decompress(zip)
+				if int(crc) != zlib.adler32(data):
+					raise CodecError("Data is corrupted.")
+
+			return json.loads(data)
+		except CodecError:
+			raise
+		except Exception, e:
+			raise CodecError("Bad JSON message: %s" % (e))
+
+
+class _Packer(object):
+
+	"""
+	This class build the payload of a binary message. See BinaryCodec.
+	Fields are packed with a single call to struct.pack(), at the end.
+	"""
+
+	def __init__(self):
+		self.format=[">"]
+		self.values=list()
+		self.names=list()		# Interned names, in order of appearance
+		self.index=dict()		# String -> index in names
+
+	def add(self, format, *values):
+		self.format.append(format)
+		self.values.extend(values)
+
+	def name(self, value):
+		"""Return the index of the given name in the names table."""
+		if isinstance(value, unicode):
+			value=value.encode('utf-8')
+
+		try:
+			return self.index[value]
+		except KeyError:
+			self.index[value]=len(self.names)
+			self.names.append(value)
+			return self.index[value]
+
+	def strings(self, values):
+		"""Append a list of strings, as a single block of NUL-separated strings."""
+		block="\x00".join(values)
+		if isinstance(block, unicode):
+			block=block.encode('utf-8')
+		self.add("I%ds" % (len(block)), len(block), block)
+
+	def getvalue(self):
+		"""Return the names table followed by the fields."""
+		if len(self.names) > 0xffff:
+			raise CodecError("Too many names in message")
+
+		table="\x00".join(self.names)
+		return struct.pack(">HI", len(self.names), len(table)) + table + \
+			struct.pack("".join(self.format), *self.values)
+
+
+class _Unpacker(object):
+
+	"""
+	This class read the payload of a binary message. See BinaryCodec.
+	Fields are read with struct.unpack() on slices, as struct.unpack_from()
+	needs Python 2.5.
+	"""
+
+	def __init__(self, data):
+		(count, size)=struct.unpack(">HI", data[:struct.calcsize(">HI")])
+		self.pos=struct.calcsize(">HI")+size
+		if count > 0:
+			self.names=data[self.pos-size:self.pos].split("\x00")
+		else:
+			self.names=list()
+		if len(self.names) != count:
+			raise CodecError("Bad names table")
+
+		self.data=data
+
+	def get(self, format):
+		"""Return the tuple of values of the given format, read at the current position."""
+		format=">"+format
+		size=struct.calcsize(format)
+		values=struct.unpack(format, self.data[self.pos:self.pos+size])
+		self.pos+=size
+		return values
+
+	def name(self, index):
+		return self.names[index]
+
+	def at_end(self):
+		return self.pos >= len(self.data)
+
+	def strings(self):
+		(size,)=self.get("I")
+		if size == 0:
+			return list()
+
+		if self.pos+size > len(self.data):
+			raise CodecError("Truncated strings list")
+		self.pos+=size
+		return self.data[self.pos-size:self.pos].split("\x00")
+
+
+class BinaryCodec(object):
+
+	"""
+	This class encode messages in a compact binary format.
+
+	A datagram is made of a fixed header (magic, version, flags, message type
+	and crc32 of the payload) followed by the payload. The payload starts with
+	a table of the cluster's and nodes' names, then the fields of the message.
+	Names are given as an index in this table, so a node's name is sent only
+	once per message. Vms lists are length-prefixed blocks of NUL-separated
+	names, as vms names seldom repeat within a message. Slave heartbeats may
+	end with the node's metrics, which are skipped by older nodes.
+	The payload is compressed with zlib if it is bigger than ZLIB_MIN bytes.
+	"""
+
+	MAGIC = "CXB"			# Can't be the start of a JSON message
+	VERSION = 1
+	HEADER = ">3sBBBI"		# magic, version, flags, type, crc32
+	HEADER_SIZE = struct.calcsize(HEADER)
+	F_ZLIB = 0x01			# Payload is compressed
+	ZLIB_MIN = 128			# Minimum size of payload to compress
+
+	TYPES = ['slavehb', 'masterhb', 'voterequest', 'voteresponse']	# See MessageHelper.map
+	STATES = ['normal', 'recovery', 'panic']							# See MasterService.ST_*
+
+	def encode(self, msg):
+		packer=_Packer()
+		data=msg['data']
+		packer.add("H", packer.name(data['cluster']))
+
+		if msg['type'] == 'slavehb':
+			packer.add("q", data['ts'])
+			packer.strings(data['vms'])
+			if 'metrics' in data:
+				# Optional, at the end: ignored by older nodes
+				metrics=data['metrics']
+				packer.add("IIHH", metrics['free_ram'], metrics['available_ram'], metrics['used_irq'], len(metrics['vms']))
+				for (name, values) in metrics['vms'].items():
+					# CPU usage in tenth of percent
+					packer.add("HIH", packer.name(name), values['ram'], min(int(round(values['cpu']*10)), 0xffff))
+		elif msg['type'] == 'masterhb':
+			packer.add("IBBH", data['seq'], data['full'], BinaryCodec.STATES.index(data['state']), len(data['status']))
+			for (name, entry) in data['status'].items():
+				if 'vms' in entry:
+					packer.add("HqiB", packer.name(name), entry['timestamp'], entry['offset'], 1)
+					packer.strings(entry['vms'])
+				else:
+					packer.add("HqiB", packer.name(name), entry['timestamp'], entry['offset'], 0)
+		elif msg['type'] == 'voterequest':
+			packer.add("q", data['election'])
+		elif msg['type'] == 'voteresponse':
+			packer.add("qq", data['ballot'], data['election'])
+		else:
+			raise CodecError("Unknown message type %s" % (msg['type']))
+
+		try:
+			payload=packer.getvalue()
+		except struct.error, e:
+			raise CodecError("Cannot encode message: %s" % (e))
+
+		flags=0
+		if len(payload) > BinaryCodec.ZLIB_MIN:
+			zip=zlib.compress(payload)
+			if len(zip) < len(payload):
+				flags|=BinaryCodec.F_ZLIB
+				payload=zip
+
+		header=struct.pack(BinaryCodec.HEADER, BinaryCodec.MAGIC, BinaryCodec.VERSION, flags,
+			BinaryCodec.TYPES.index(msg['type']), zlib.crc32(payload) & 0xffffffff)
+		return header+payload
+
+	def decode(self, data):
+		try:
+			(magic, version, flags, code, crc)=struct.unpack(BinaryCodec.HEADER, data[:BinaryCodec.HEADER_SIZE])
+		except struct.error, e:
+			raise CodecError("Bad binary header: %s" % (e))
+
+		if magic != BinaryCodec.MAGIC:
+			raise CodecError("Bad magic number")
+		if version != BinaryCodec.VERSION:
+			raise CodecError("Unsupported binary version %d" % (version))
+
+		payload=data[BinaryCodec.HEADER_SIZE:]
+		if zlib.crc32(payload) & 0xffffffff != crc:
+			raise CodecError("Data is corrupted.")
+
+		try:
+			if flags & BinaryCodec.F_ZLIB:
+				payload=zlib.decompress(payload)
+
+			unpacker=_Unpacker(payload)
+			msg={'cluster': unpacker.name(*unpacker.get("H"))}
+
+			msgtype=BinaryCodec.TYPES[code]
+			if msgtype == 'slavehb':
+				(msg['ts'],)=unpacker.get("q")
+				msg['vms']=unpacker.strings()
+				if not unpacker.at_end():
+					(free, available, irq, count)=unpacker.get("IIHH")
+					msg['metrics']={'free_ram': free, 'available_ram': available, 'used_irq': irq, 'vms': dict()}
+					for i in range(count):
+						(name, ram, cpu)=unpacker.get("HIH")
+						msg['metrics']['vms'][unpacker.name(name)]={'ram': ram, 'cpu': cpu/10.0}
+			elif msgtype == 'masterhb':
+				(msg['seq'], full, state, count)=unpacker.get("IBBH")
+				msg['full']=bool(full)
+				msg['state']=BinaryCodec.STATES[state]
+				msg['status']=dict()
+				for i in range(count):
+					(name, timestamp, offset, has_vms)=unpacker.get("HqiB")
+					entry={'timestamp': timestamp, 'offset': offset}
+					if has_vms:
+						entry['vms']=unpacker.strings()
+					msg['status'][unpacker.name(name)]=entry
+			elif msgtype == 'voterequest':
+				(msg['election'],)=unpacker.get("q")
+			else:
+				(msg['ballot'], msg['election'])=unpacker.get("qq")
+		except (IndexError, struct.error, zlib.error), e:
+			raise CodecError("Truncated binary message: %s" % (e))
+
+		return {'type': msgtype, 'data': msg}
+
+
+CODECS = {
+	'json': JSONCodec,
+	'binary': BinaryCodec,
+}
+
+def get_codec():
+	"""Return the codec used to send messages, according to WIRE_FORMAT."""
+	try:
+		return CODECS[core.cfg['WIRE_FORMAT']]()
+	except KeyError:
+		raise CodecError("Unknown wire format %s" % (core.cfg['WIRE_FORMAT']))
+
+def decode(data):
+	"""Return the message encoded in the given datagram, whatever its format."""
+	if data.startswith(BinaryCodec.MAGIC):
+		return BinaryCodec().decode(data)
+	else:
+		return JSONCodec().decode(data)
+
+
+class CodecError(Exception):
+	"""This class is used to raise errors relatives to messages encoding."""
+	pass
+
+
+# vim: ts=4:sw=4:ai
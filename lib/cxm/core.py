@@ -68,17 +68,33 @@ cfg = {
 	'LB_MAX_VM_PER_NODE': 20,
 	'LB_MAX_MIGRATION': 3,
 	'LB_MIN_GAIN': 5,
+	'LB_STRATEGY': "layered",	# See loadbalancer.STRATEGIES
+	'LB_TIME_BUDGET': 30,		# Maximum search time of the loadbalancer, in seconds (0 means no limit)
 	'FENCE_CMD': "cxm_fence",	# Take the node's name as first param
 	'DISABLE_FENCING': False,
 	'CLUSTER_NAME': None,		# (string) Mandatory for cxmd
 	'ALLOWED_NODES': [],
 	'UDP_PORT': 1255,
+	'HB_TRANSPORT': "broadcast",	# How messages are sent to all nodes, see netheartbeat.TRANSPORTS
+	'MCAST_GROUP': "239.255.12.55",	# Multicast group, for HB_TRANSPORT="multicast"
+	'MCAST_TTL': 1,				# Multicast TTL, number of routers crossed
+	'NET_INTERFACE': "eth0",	# Cluster's network interface, for broadcast and multicast
 	'TCP_PORT': 1255,
 	'TIMER': 3,					# Main timer for failover, in seconds (3 is good)
+	'HB_INTERVAL': 1.0,			# Interval between heartbeats, in seconds (down to 0.1)
+	'HB_METRICS_INTERVAL': 10,	# Send node's metrics with slave heartbeats every 10 sec (0 to disable)
+	'FAILURE_DETECTOR': "fixed",	# See failuredetector.DETECTORS
+	'PHI_THRESHOLD': 8.0,		# Suspicion level of the phi accrual detector
 	'UNIX_PORT': "/var/run/cxmd.socket",
 	'HB_DISK': None,			# (string) Mandatory for cxmd
 	'SHUTDOWN_TIMEOUT': 60,
 	'POST_MIGRATION_HOOK': None,	
+	'MIGRATION_MAX_PER_SRC': 2,	# Maximum number of simultaneous migrations from a node
+	'MIGRATION_MAX_PER_DST': 1,	# Maximum number of simultaneous migrations to a node
+	'START_MAX_PER_NODE': 2,	# Maximum number of simultaneous VM starts on a node, during a recovery
+	'PLACEMENT_STRATEGY': "bfd",	# See placement.STRATEGIES
+	'PLACEMENT_VCPU_RATIO': 0.0,	# Maximum number of vcpu per physical cpu when placing VMs (0 means no limit)
+	'WIRE_FORMAT': "json",		# Format of UDP messages, see codec.CODECS
 	}
 
 # Types for configuration entries
@@ -92,17 +108,33 @@ cfg_type = {
 	'LB_MAX_VM_PER_NODE': 	int,
 	'LB_MAX_MIGRATION': 	int,
 	'LB_MIN_GAIN': 			int,
+	'LB_STRATEGY': 			str,
+	'LB_TIME_BUDGET': 		int,
 	'FENCE_CMD': 			str,
 	'DISABLE_FENCING': 		bool,
 	'CLUSTER_NAME': 		str,
 	'ALLOWED_NODES': 		list,
 	'UDP_PORT': 			int,
+	'HB_TRANSPORT':			str,
+	'MCAST_GROUP':			str,
+	'MCAST_TTL':			int,
+	'NET_INTERFACE':		str,
 	'TCP_PORT': 			int,
 	'TIMER': 				int,
+	'HB_INTERVAL':			float,
+	'HB_METRICS_INTERVAL':	int,
+	'FAILURE_DETECTOR':		str,
+	'PHI_THRESHOLD':		float,
 	'UNIX_PORT': 			str,
 	'HB_DISK': 				str,
 	'SHUTDOWN_TIMEOUT':		int,
 	'POST_MIGRATION_HOOK':	str,	
+	'MIGRATION_MAX_PER_SRC':	int,
+	'MIGRATION_MAX_PER_DST':	int,
+	'START_MAX_PER_NODE':	int,
+	'PLACEMENT_STRATEGY':	str,
+	'PLACEMENT_VCPU_RATIO':	float,
+	'WIRE_FORMAT':			str,
 	}
 
 def get_api_version():
@@ -116,6 +148,7 @@ def load_cfg():
 		str:  "a string",
 		bool: "a boolean",
 		int:  "an integer",
+		float: "a number",
 		list: "a list",
 	}
 
@@ -124,9 +157,14 @@ def load_cfg():
 
 		# Check type of configuration entries
 		for key in cfg_type.keys():
+			if cfg_type[key] == float and type(cfg[key]) == int:
+				cfg[key]=float(cfg[key])
 			if cfg[key]:
 				assert type(cfg[key]) == cfg_type[key], "%s should be %s." % (key, type_map[cfg_type[key]])
 
+		assert cfg['HB_INTERVAL'] >= 0.1, "HB_INTERVAL should be at least 0.1 second."
+		assert cfg['START_MAX_PER_NODE'] >= 1, "START_MAX_PER_NODE should be at least 1."
+
 	except Exception,e:
 		log.err("Configuration file error:", e)
 		sys.exit(e)
@@ -23,27 +23,54 @@
 #
 ###########################################################################
 
-import sys, time, os
+import sys, time, os, mmap, struct, zlib
 import core
+import logs as log
 
 
 class DiskHeartbeat(object):
 
+	"""
+	This class manage the heartbeat disk, shared by all nodes.
+
+	Two on-disk formats are supported, detected with the magic number:
+	  - v1: each slot is two 4k-blocks holding the node's name and its
+	    timestamp, as zero-padded ASCII. Up to MAX_SLOT nodes.
+	  - v2: each slot is a binary record (name hash, sequence number, timestamp,
+	    name and checksum) in its own 512-bytes sector, so each node update
+	    its slot with a single atomic sector write. Up to MAX_SLOT_V2 nodes.
+	"""
+
 	BS = 4096			# Block size
 	MAX_SLOT = 16		# Maximum number of slots. File size must be at least (MAX_SLOT+1)*2*BS Bytes
 						# Redhat Cluster Suite has a maximum of 16 nodes.
 	MAGIC = "CXMHBv1-%s-%s" % (BS, MAX_SLOT)	# Magic number for heartbeat disk
 
+	SECTOR = 512		# Size of a v2 slot
+	MAX_SLOT_V2 = 128	# Maximum number of v2 slots. File size must be at least BS+MAX_SLOT_V2*SECTOR Bytes
+	MAGIC_V2 = "CXMHBv2-%s-%s" % (SECTOR, MAX_SLOT_V2)
+	RECORD = ">IQqH256s"	# v2 slot: name hash, sequence number, timestamp, name length, name
+	RECORD_SIZE = struct.calcsize(RECORD)
+
 	def __init__(self):
-		# Just for checking magic number
+		self.last_scan_latency=None		# Duration of the last get_all_ts() read, in seconds
+		self.corrupted_slots=list()		# Corrupted v2 slots found by the last scan
+
+		# Just for checking magic number, and get format version
 		self._open()
 		self._close()
 
 	@staticmethod
-	def format():
+	def format(version=1):
 		f=open(core.cfg['HB_DISK'], "wb",0) # No buffer
 
 		try:
+			if version == 2:
+				# Header and empty slots
+				f.write(DiskHeartbeat.MAGIC_V2 + "\x00"*(DiskHeartbeat.BS-len(DiskHeartbeat.MAGIC_V2)))
+				f.write("\x00"*DiskHeartbeat.MAX_SLOT_V2*DiskHeartbeat.SECTOR)
+				return
+
 			# Erase each slot
 			f.write("\x00"*2*DiskHeartbeat.BS)
 			for i in range(DiskHeartbeat.MAX_SLOT):
@@ -58,6 +85,66 @@ class DiskHeartbeat(object):
 		finally:
 			f.close()
 
+	@staticmethod
+	def _open_direct(flags):
+		"""Return a file descriptor on the heartbeat disk, opened with O_DIRECT if possible."""
+		try:
+			return os.open(core.cfg['HB_DISK'], flags | getattr(os, 'O_DIRECT', 0))
+		except OSError:
+			# Some filesystems (tmpfs...) don't support O_DIRECT
+			return os.open(core.cfg['HB_DISK'], flags)
+
+	@staticmethod
+	def _read(offset, size):
+		"""
+		Return the 'size' bytes of the heartbeat disk at the given offset.
+
+		Each node keeps its HeartbeatWriter opened on the device, so its page cache
+		is never dropped: a buffered read may return old copies of the others' slots.
+		The disk is read with O_DIRECT into a page-aligned buffer (anonymous mmap).
+		"""
+		f=os.fdopen(DiskHeartbeat._open_direct(os.O_RDONLY), "rb", 0)
+		buffer=mmap.mmap(-1, size)
+		try:
+			f.seek(offset)
+			length=f.readinto(buffer) # Shorter only at end of file
+			return buffer[:length]
+		finally:
+			buffer.close()
+			f.close()
+
+	@staticmethod
+	def _hash(name):
+		return zlib.crc32(name) & 0xffffffff
+
+	@staticmethod
+	def pack_record(name, seq, ts):
+		"""Return the v2 slot of the given node, as a full sector."""
+		data=struct.pack(DiskHeartbeat.RECORD, DiskHeartbeat._hash(name), seq, ts, len(name), name)
+		data+=struct.pack(">I", zlib.crc32(data) & 0xffffffff)
+		return data + "\x00"*(DiskHeartbeat.SECTOR-len(data))
+
+	@staticmethod
+	def unpack_record(data):
+		"""
+		Return the tuple (name, seq, ts) of the given v2 slot, or None if the slot is empty.
+		Raise a DiskHeartbeatError if the slot is corrupted.
+		"""
+		size=DiskHeartbeat.RECORD_SIZE
+		if data[:size+4].strip("\x00") == "":
+			return None
+
+		(crc,)=struct.unpack(">I", data[size:size+4])
+		if zlib.crc32(data[:size]) & 0xffffffff != crc:
+			raise DiskHeartbeatError("Bad checksum")
+
+		(hash, seq, ts, length, name)=struct.unpack(DiskHeartbeat.RECORD, data[:size])
+		name=name[:length]
+		if DiskHeartbeat._hash(name) != hash:
+			raise DiskHeartbeatError("Bad name hash")
+
+		return (name, seq, ts)
+
 	@staticmethod
 	def is_in_use():
 		try:
@@ -69,7 +156,12 @@ class DiskHeartbeat(object):
 	
 	def _open(self):
 		self.f=open(core.cfg['HB_DISK'], "r+b",0) # No buffer
-		if self.f.read(DiskHeartbeat.BS).strip("\x00") != DiskHeartbeat.MAGIC:
+		magic=self.f.read(DiskHeartbeat.BS).strip("\x00")
+		if magic == DiskHeartbeat.MAGIC:
+			self.version=1
+		elif magic == DiskHeartbeat.MAGIC_V2:
+			self.version=2
+		else:
 			self.f.close()
 			raise DiskHeartbeatError("%s is not and CXM Heartbeat disk !" % (core.cfg['HB_DISK']))
 
@@ -112,12 +204,52 @@ class DiskHeartbeat(object):
 
 		return found
 
+	def _unpack_records(self, data):
+		"""
+		Return the list of the v2 slots of the given table, see unpack_record().
+		Corrupted slots (torn write ?) are logged and returned as None, and their index kept in corrupted_slots.
+		"""
+		records=list()
+		corrupted=list()
+		for pos in range(0, len(data), DiskHeartbeat.SECTOR):
+			try:
+				records.append(DiskHeartbeat.unpack_record(data[pos:pos+DiskHeartbeat.SECTOR]))
+			except DiskHeartbeatError, e:
+				# Others slots are independent, don't fail the whole scan
+				log.warn("Heartbeat slot %d is corrupted: %s" % (len(records), e))
+				corrupted.append(len(records))
+				records.append(None)
+
+		self.corrupted_slots=corrupted
+		return records
+
+	def _read_records(self):
+		"""Return the list of all v2 slots, see _unpack_records()."""
+		self.f.seek(DiskHeartbeat.BS)
+		return self._unpack_records(self.f.read(DiskHeartbeat.MAX_SLOT_V2*DiskHeartbeat.SECTOR))
+
+	def _find_record(self, name):
+		"""Return the index and the content of this node's v2 slot."""
+		hash=DiskHeartbeat._hash(name)
+		for i, record in enumerate(self._read_records()):
+			if record is not None and DiskHeartbeat._hash(record[0]) == hash and record[0] == name:
+				return (i, record)
+
+		raise DiskHeartbeatError('Slot not found')
+
+	def _write_record(self, index, data):
+		self.f.seek(DiskHeartbeat.BS+index*DiskHeartbeat.SECTOR)
+		self.f.write(data)
+
 	def get_nr_node(self):
 		self._open()
 
 		try:
-			self.f.seek(DiskHeartbeat.BS)
-			nr_node=int(self.f.read(DiskHeartbeat.BS).strip("\x00"))
+			if self.version == 2:
+				nr_node=len([ r for r in self._read_records() if r is not None ])
+			else:
+				self.f.seek(DiskHeartbeat.BS)
+				nr_node=int(self.f.read(DiskHeartbeat.BS).strip("\x00"))
 		finally:
 			self._close()
 
@@ -126,6 +258,24 @@ class DiskHeartbeat(object):
 	def make_slot(self, name):
 		self._open()
 		try:
+			if self.version == 2:
+				if len(name) > 256:
+					raise DiskHeartbeatError("Name %s is too long for slot." % (name))
+
+				records=self._read_records()
+				if name in [ r[0] for r in records if r is not None ]:
+					raise DiskHeartbeatError('Slot already registered')
+
+				# Corrupted slots are reused only when there is no empty one left
+				free=[ i for i, r in enumerate(records) if r is None and i not in self.corrupted_slots ]
+				free+=self.corrupted_slots
+				if len(free) == 0:
+					raise DiskHeartbeatError("Maximum number of node reached !")
+
+				# Reserve the first free slot for this new node
+				self._write_record(free[0], DiskHeartbeat.pack_record(name, 0, 0))
+				return
+
 			if len(name) >= DiskHeartbeat.BS:
 				raise DiskHeartbeatError("Name %s is too long for block size %s." % (name, DiskHeartbeat.BS))
 
@@ -152,6 +302,11 @@ class DiskHeartbeat(object):
 		self._open()
 
 		try:
+			if self.version == 2:
+				(index, record)=self._find_record(name)
+				self._write_record(index, "\x00"*DiskHeartbeat.SECTOR)
+				return
+
 			if not self._seek_slot(name):
 				raise DiskHeartbeatError('Slot not found')
 				
@@ -168,6 +323,11 @@ class DiskHeartbeat(object):
 		self._open()
 
 		try:
+			if self.version == 2:
+				(index, record)=self._find_record(name)
+				self._write_record(index, DiskHeartbeat.pack_record(name, record[1]+1, int(time.time())))
+				return
+
 			if not self._seek_slot(name):
 				raise DiskHeartbeatError('Slot not found')
 
@@ -175,35 +335,171 @@ class DiskHeartbeat(object):
 		finally:
 			self._close()
 
-	def get_ts(self, name):
+	def get_slot_offset(self, name):
+		"""
+		Return the offset of the block written by the given node on each pulse:
+		the timestamp block for v1, the whole slot for v2.
+		"""
 		self._open()
 
 		try:
-			if not self._seek_slot(name):
-				raise DiskHeartbeatError('Slot not found')
-
-			ts=int(self.f.read(DiskHeartbeat.BS).strip("\x00"))
+			if self.version == 2:
+				(index, record)=self._find_record(name)
+				offset=DiskHeartbeat.BS+index*DiskHeartbeat.SECTOR
+			else:
+				if not self._seek_slot(name):
+					raise DiskHeartbeatError('Slot not found')
+
+				offset=self.f.tell()
 		finally:
 			self._close()
 
-		return ts
+		return offset
 
-	def get_all_ts(self):
-		ts=dict()
+	def get_ts(self, name):
 		self._open()
+
 		try:
-			self._rewind()
-			for i in range(DiskHeartbeat.MAX_SLOT):
-				name=self.f.read(DiskHeartbeat.BS).strip("\x00")
-				if(len(name)<=0):
-					self.f.seek(DiskHeartbeat.BS,1) # Next block (jump over timestamp)
-				else:
-					ts[name]=int(self.f.read(DiskHeartbeat.BS).strip("\x00"))
+			if self.version == 2:
+				(index, record)=self._find_record(name)
+				ts=record[2]
+			else:
+				if not self._seek_slot(name):
+					raise DiskHeartbeatError('Slot not found')
+
+				ts=int(self.f.read(DiskHeartbeat.BS).strip("\x00"))
 		finally:
 			self._close()
 
 		return ts
 
+	def get_all_ts(self):
+		"""
+		Return a dict with the timestamp of each registered node.
+
+		The whole table is fetched with a single read, so each scan costs one
+		I/O on the SAN. The time taken by this read is kept in last_scan_latency
+		(in seconds).
+
+		Corrupted v2 slots (torn write ?) are skipped, and their index kept in corrupted_slots.
+		"""
+		if self.version == 2:
+			size=DiskHeartbeat.BS+DiskHeartbeat.MAX_SLOT_V2*DiskHeartbeat.SECTOR
+			magic=DiskHeartbeat.MAGIC_V2
+		else:
+			size=(DiskHeartbeat.MAX_SLOT+1)*2*DiskHeartbeat.BS
+			magic=DiskHeartbeat.MAGIC
+
+		start=time.time()
+		data=DiskHeartbeat._read(0, size)
+		self.last_scan_latency=time.time()-start
+
+		if len(data) != size:
+			raise DiskHeartbeatError("Short read on %s: %d bytes, expected %d." % (core.cfg['HB_DISK'], len(data), size))
+
+		if data[:DiskHeartbeat.BS].strip("\x00") != magic:
+			raise DiskHeartbeatError("%s is not and CXM Heartbeat disk v%d !" % (core.cfg['HB_DISK'], self.version))
+
+		ts=dict()
+		if self.version == 2:
+			for record in self._unpack_records(data[DiskHeartbeat.BS:]):
+				if record is not None:
+					ts[record[0]]=record[2]
+		else:
+			for pos in range(2*DiskHeartbeat.BS, size, 2*DiskHeartbeat.BS):
+				name=data[pos:pos+DiskHeartbeat.BS].strip("\x00")
+				if(len(name)>0):
+					ts[name]=int(data[pos+DiskHeartbeat.BS:pos+2*DiskHeartbeat.BS].strip("\x00"))
+
+		return ts
+
+class HeartbeatWriter(object):
+
+	"""
+	This class write the timestamp of a node in its slot, with a persistent handle.
+
+	The slot's offset is resolved once, then revalidated every REVALIDATE pulses
+	by reading back the slot's name. Each pulse is a single aligned write of one
+	block (v1) or one sector (v2), using O_DIRECT and O_DSYNC where available,
+	so there is no need to flush or fsync.
+	"""
+
+	REVALIDATE = 30		# Check the slot's name every 30 pulses
+
+	def __init__(self, name):
+		self.name=name
+		self.fd=None
+		self.version=None
+		self.offset=None		# Offset of the written block
+		self.seq=0				# Sequence number of the v2 slot
+		self.pulses=0
+		self.buffer=None
+
+	def _open(self):
+		self.fd=DiskHeartbeat._open_direct(os.O_RDWR | getattr(os, 'O_DSYNC', os.O_SYNC))
+
+		disk=DiskHeartbeat()
+		self.version=disk.version
+		self.offset=disk.get_slot_offset(self.name)
+		self.pulses=0
+
+		# Anonymous mmap is page-aligned, as needed by O_DIRECT
+		if self.version == 2:
+			self.buffer=mmap.mmap(-1, DiskHeartbeat.SECTOR)
+			self._check()	# Get current sequence number
+		else:
+			self.buffer=mmap.mmap(-1, DiskHeartbeat.BS)
+
+	def _check(self):
+		"""
+		Return True if the slot at the cached offset still belongs to this node.
+		The slot is read with another handle, as the writing one may use O_DIRECT.
+		"""
+		if self.version == 2:
+			record=DiskHeartbeat.unpack_record(DiskHeartbeat._read(self.offset, DiskHeartbeat.SECTOR))
+			if record is None or record[0] != self.name:
+				return False
+			self.seq=record[1]
+			return True
+
+		return DiskHeartbeat._read(self.offset-DiskHeartbeat.BS, DiskHeartbeat.BS).strip("\x00") == self.name
+
+	def close(self):
+		"""Close the handle. It will be re-opened on next pulse."""
+		if self.fd is not None:
+			try:
+				os.close(self.fd)
+			except OSError:
+				pass
+		self.fd=None
+
+	def pulse(self):
+		"""Write the current timestamp into the node's slot."""
+		try:
+			if self.fd is None:
+				self._open()
+			elif self.pulses % HeartbeatWriter.REVALIDATE == 0 and not self._check():
+				# Slot has moved (disk formatted ?): resolve it again
+				self.close()
+				self._open()
+
+			self.buffer.seek(0)
+			if self.version == 2:
+				self.seq+=1
+				self.buffer.write(DiskHeartbeat.pack_record(self.name, self.seq, int(time.time())))
+			else:
+				self.buffer.write(("%0"+str(DiskHeartbeat.BS)+"d") % int(time.time()))
+			os.lseek(self.fd, self.offset, 0)
+			os.write(self.fd, self.buffer)
+			self.pulses+=1
+		except (OSError, IOError), e:
+			self.close()
+			raise DiskHeartbeatError("Cannot write heartbeat on %s: %s" % (core.cfg['HB_DISK'], e))
+		except:
+			self.close()
+			raise
+
+
 class DiskHeartbeatError(Exception):
 	"""This class is used to raise errors relatives to the disk hearbeat system."""
 	pass
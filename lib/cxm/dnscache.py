@@ -24,12 +24,27 @@
 ###########################################################################
 
 
-import socket, struct, fcntl
-from twisted.internet import reactor, defer
+import socket, struct, fcntl, time
+from twisted.internet import reactor, defer, threads
+from twisted.python.failure import Failure
+import logs as log
+import core
 
 
 class DNSCache(object):
 
+	"""
+	This class is a cache of DNS names and IPs of the cluster's nodes.
+
+	Entries are kept TTL seconds. After that, the cached value is still used,
+	but it is refreshed in background. Reverse lookups (get_by_ip()) never block
+	the reactor: they are run in a thread, and a failed lookup is cached for
+	NEGATIVE_TTL seconds.
+	"""
+
+	TTL = 600			# Refresh entries after 10 minutes
+	NEGATIVE_TTL = 60	# Don't retry a failed reverse lookup within 1 minute
+
 	# This is old-school Singleton pattern, Python's way really sucks !
 	__instance = None
 
@@ -41,10 +56,24 @@ class DNSCache(object):
 			
 	# Singleton pattern: Should be private, but with Python all is public
 	def __init__(self):
-		self.ifname="eth0"
+		self.ifname=core.cfg['NET_INTERFACE']
 		self._resolve = dict()  # IP -> hostname
 		self._reverse = dict()	# hostname -> IP
+		self._expire = dict()	# IP -> expiration date of the entry
+		self._failed = dict()	# IP -> expiration date of the negative entry
+		self._pending = dict()	# IP -> list of deferreds waiting for the reverse lookup
 		self.bcast = None
+		self.ifaddr = None
+		self.stats = {
+			'hits': 0,			# Found in cache
+			'stale_hits': 0,	# Found in cache, but refreshed
+			'negative_hits': 0,	# Lookup failed recently
+			'misses': 0,		# Not in cache, and not resolved yet
+			'lookups': 0,		# Reverse lookups done
+			'failures': 0,		# Reverse lookups failed
+			'max_latency': 0,	# Slowest reverse lookup, in seconds
+			'total_latency': 0,	# Sum of reverse lookups' durations, in seconds
+		}
 
 		self.name=socket.gethostname()
 		self.ip=socket.gethostbyname(self.name)
@@ -53,8 +82,13 @@ class DNSCache(object):
 	def _feedCache(self, ip, name):
 		self._resolve[ip]=name
 		self._reverse[name]=ip
+		self._expire[ip]=time.time()+DNSCache.TTL
+		self._failed.pop(ip, None)
 		return ip # for result of get_by_name()
 
+	def _is_expired(self, ip):
+		return self._expire.get(ip, 0) <= time.time()
+
 	def add(self, name): 
 		d=reactor.resolve(name)
 		d.addCallback(self._feedCache, name)
@@ -62,8 +96,10 @@ class DNSCache(object):
 			
 	def delete(self, name):
 		try:
-			del self._resolve[self._reverse[name]]
+			ip=self._reverse[name]
+			del self._resolve[ip]
 			del self._reverse[name]
+			del self._expire[ip]
 		except KeyError:
 			pass
 		
@@ -72,15 +108,75 @@ class DNSCache(object):
 		self._reverse.clear()
 		self.__init__()
 
+	def resolve_ip(self, ip):
+		"""
+		Do a reverse lookup of the given IP in a thread, and return a deferred
+		fired with the hostname. Concurrent calls for the same IP share the lookup.
+		"""
+		def lookupSucceeded(result, start):
+			self._record_latency(start)
+			name=result[0]
+			self._feedCache(ip, name)
+			return name
+
+		def lookupFailed(reason, start):
+			self._record_latency(start)
+			self.stats['failures']+=1
+			self._failed[ip]=time.time()+DNSCache.NEGATIVE_TTL
+			log.warn("Reverse lookup of %s failed: %s" % (ip, reason.getErrorMessage()))
+			return reason
+
+		def lookupEnded(result):
+			for d in self._pending.pop(ip):
+				if isinstance(result, Failure):
+					d.errback(result)
+				else:
+					d.callback(result)
+
+		d=defer.Deferred()
+		if ip in self._pending:
+			self._pending[ip].append(d)
+			return d
+
+		self._pending[ip]=[d]
+		self.stats['lookups']+=1
+		start=time.time()
+		lookup=threads.deferToThread(socket.gethostbyaddr, ip)
+		lookup.addCallbacks(lookupSucceeded, lookupFailed, callbackArgs=[start], errbackArgs=[start])
+		lookup.addBoth(lookupEnded)
+		return d
+
+	def _record_latency(self, start):
+		latency=time.time()-start
+		self.stats['total_latency']+=latency
+		self.stats['max_latency']=max(self.stats['max_latency'], latency)
+
 	def get_by_ip(self, ip): 
-		""" Warning: this method is not asynchronous and return a string."""
+		"""
+		Warning: this method is not asynchronous and return a string.
+
+		If the IP is not in cache, it is resolved in background and DNSCacheMiss
+		is raised: the caller should drop the request and retry later.
+		"""
 		try:
-			return self._resolve[ip]
+			name=self._resolve[ip]
 		except KeyError:
-			# Cannot do async reverse DNS with twisted 8.xx
-			name=socket.gethostbyaddr(ip)[0]
-			self._feedCache(ip, name)
-			return name
+			if self._failed.get(ip, 0) > time.time():
+				self.stats['negative_hits']+=1
+				raise DNSCacheMiss("reverse lookup of %s has failed" % (ip))
+
+			self.stats['misses']+=1
+			self.resolve_ip(ip).addErrback(lambda _: None)
+			raise DNSCacheMiss("reverse lookup of %s is pending" % (ip))
+
+		if self._is_expired(ip):
+			self.stats['stale_hits']+=1
+			if ip not in self._pending and self._failed.get(ip, 0) <= time.time():
+				self.resolve_ip(ip).addErrback(lambda _: None)
+		else:
+			self.stats['hits']+=1
+
+		return name
 
 	def get_by_name(self, name): 
 		try:
@@ -88,6 +184,18 @@ class DNSCache(object):
 		except KeyError:
 			return self.add(name)
 
+	def get_stats(self):
+		"""Return a dict with the counters of the cache."""
+		stats=dict(self.stats)
+		stats['entries']=len(self._resolve)
+		stats['negative_entries']=len(self._failed)
+		stats['pending']=len(self._pending)
+		if stats['lookups'] > 0:
+			stats['avg_latency']=stats['total_latency']/stats['lookups']
+		else:
+			stats['avg_latency']=0
+		return stats
+
 	def get_bcast(self):
 		if self.bcast is None:
 			try:
@@ -102,6 +210,25 @@ class DNSCache(object):
 		
 		return defer.succeed(self.bcast)
 
+	def get_ifaddr(self):
+		"""Return the IP of the cluster's network interface, used for multicast."""
+		if self.ifaddr is None:
+			try:
+				s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+				self.ifaddr=socket.inet_ntoa(fcntl.ioctl(
+					s.fileno(),
+					0x8915,  # SIOCGIFADDR
+					struct.pack('256s', self.ifname[:15])
+					)[20:24])
+			except IOError:
+				self.ifaddr="0.0.0.0"	# Let the kernel choose
+		
+		return self.ifaddr
+
+
+class DNSCacheMiss(Exception):
+	"""This class is used to tell that a name is not in cache yet."""
+	pass
 
 
 # vim: ts=4:sw=4:ai
@@ -0,0 +1,223 @@
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2010-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+# $Id:$
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+
+"""
+This module run commands on nodes within the reactor, without threads.
+See Node.run_deferred().
+"""
+
+import os
+from zope.interface import implements
+from twisted.internet import protocol, reactor, defer
+from twisted.internet.interfaces import IReadDescriptor
+
+from node import Node, ShellError, SSHError, ShellTimeoutError, SSHTimeoutError
+import logs as log
+
+
+class OutputCollector(object):
+
+	"""
+	This class split a command's output in lines, and keep the end of stderr.
+	Lines are given to the 'lineReceived' callable, or kept until the end.
+	"""
+
+	def __init__(self, lineReceived=None):
+		self.lineReceived=lineReceived
+		self.lines=list()
+		self.buffer=""
+		self.msg=""
+
+	def out(self, data):
+		lines=(self.buffer+data).split('\n')
+		self.buffer=lines.pop()
+		for line in lines:
+			self.line(line+'\n')
+
+	def err(self, data):
+		self.msg=(self.msg+data)[-Node.STDERR_MAX:]
+
+	def line(self, line):
+		if self.lineReceived is None:
+			self.lines.append(line)
+		else:
+			self.lineReceived(line)
+
+	def end(self):
+		"""Flush the last line and return the result of the deferred."""
+		if len(self.buffer) > 0:
+			self.line(self.buffer)
+			self.buffer=""
+
+		if self.lineReceived is None:
+			return self.lines
+		else:
+			return None
+
+
+class ExecProcessProtocol(protocol.ProcessProtocol):
+
+	"""This class run a command on the local node, see spawnCommand()."""
+
+	def __init__(self, nodename, cmd, lineReceived=None, timeout=None):
+		self.nodename=nodename
+		self.cmd=cmd
+		self.output=OutputCollector(lineReceived)
+		self.timeout=timeout
+		self._call=None
+		self.deferred=defer.Deferred()
+
+	def connectionMade(self):
+		self.transport.closeStdin()
+		if self.timeout is not None:
+			self._call=reactor.callLater(self.timeout, self.kill)
+
+	def kill(self):
+		try:
+			self.transport.signalProcess('KILL')
+		except Exception, e:
+			log.debugd("Cannot kill", self.cmd, ":", e)
+
+		# Don't wait for children of the shell still holding the pipes
+		self.transport.loseConnection()
+		self.deferred.errback(ShellTimeoutError(self.nodename, "Timeout after %ss: %s" % (self.timeout, self.cmd)))
+
+	def outReceived(self, data):
+		self.output.out(data)
+
+	def errReceived(self, data):
+		self.output.err(data)
+
+	def processEnded(self, reason):
+		if self._call is not None and self._call.active():
+			self._call.cancel()
+
+		if self.deferred.called:
+			return # Timed out
+
+		if reason.value.exitCode != 0:
+			self.deferred.errback(ShellError(self.nodename, self.output.msg, reason.value.exitCode))
+		else:
+			self.deferred.callback(self.output.end())
+
+
+class ChannelReader(object):
+
+	"""
+	This class run a command on a remote node through a SSH channel, see spawnCommand().
+	The channel is watched by the reactor, like a socket.
+	"""
+
+	implements(IReadDescriptor)
+
+	def __init__(self, nodename, chan, cmd, lineReceived=None, timeout=None):
+		self.nodename=nodename
+		self.chan=chan
+		self.cmd=cmd
+		self.output=OutputCollector(lineReceived)
+		self.timeout=timeout
+		self._call=None
+		self.deferred=defer.Deferred()
+
+	def start(self):
+		self.chan.setblocking(0)
+		reactor.addReader(self)
+		if self.timeout is not None:
+			self._call=reactor.callLater(self.timeout, self.expire)
+
+	def fileno(self):
+		return self.chan.fileno()
+
+	def logPrefix(self):
+		return "ChannelReader"
+
+	def drain(self):
+		"""Read all the data already received on both buffers."""
+		while self.chan.recv_stderr_ready():
+			self.output.err(self.chan.recv_stderr(Node.READ_SIZE))
+		while self.chan.recv_ready():
+			self.output.out(self.chan.recv(Node.READ_SIZE))
+
+	def doRead(self):
+		# Check exit status first: the last data may be received with it
+		exited=self.chan.exit_status_ready() or self.chan.closed
+		self.drain()
+
+		if exited:
+			self.finish()
+
+	def connectionLost(self, reason):
+		self.finish(reason)
+
+	def expire(self):
+		self.finish(SSHTimeoutError(self.nodename, "Timeout after %ss: %s" % (self.timeout, self.cmd)))
+
+	def finish(self, error=None):
+		if self.deferred.called:
+			return
+
+		reactor.removeReader(self)
+		if self._call is not None and self._call.active():
+			self._call.cancel()
+
+		if error is None:
+			exitcode=-1 # Channel closed without exit status
+			if self.chan.exit_status_ready():
+				exitcode=self.chan.recv_exit_status()
+			self.drain()
+			if exitcode != 0:
+				error=SSHError(self.nodename, self.output.msg, exitcode)
+
+		self.chan.close()
+		if error is None:
+			self.deferred.callback(self.output.end())
+		else:
+			self.deferred.errback(error)
+
+
+def spawnCommand(node, cmd, lineReceived=None, timeout=None):
+	"""
+	Run the given command line on the node, as is, and return a deferred.
+	See Node.run_deferred().
+	"""
+	if node.is_local_node():
+		log.debug("[SHL]", node.hostname, "->", cmd)
+		pp=ExecProcessProtocol(node.hostname, cmd, lineReceived, timeout)
+		reactor.spawnProcess(pp, "/bin/sh", ["/bin/sh", "-c", cmd], env=os.environ)
+		return pp.deferred
+	else:
+		log.debug("[SSH]", node.hostname, "->", cmd)
+		try:
+			chan=node.ssh.get_transport().open_session()
+			chan.exec_command(cmd)
+		except Exception, e:
+			return defer.fail(SSHError(node.hostname, str(e), None))
+
+		reader=ChannelReader(node.hostname, chan, cmd, lineReceived, timeout)
+		reader.start()
+		return reader.deferred
+
+
+# vim: ts=4:sw=4:ai
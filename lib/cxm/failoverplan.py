@@ -0,0 +1,133 @@
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2011-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+# $Id:$
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+
+"""
+This module hold the failover plans, computed in background by the active
+master from the cluster's status and the nodes' metrics (see MasterService.getMetrics()).
+
+A plan tell, for the loss of one node, on which surviving node each of its VMs
+should go, as chosen by the placement engine (see placement.place()). With a
+plan, a recovery starts placing VMs at once, without querying the surviving
+nodes (see XenCluster.get_failover_plan()).
+"""
+
+import time
+import core, placement
+
+
+def get_capacities(metrics):
+	"""Return the free capacities of a node from its metrics, for the placement engine."""
+	return {
+		'ram': metrics['free_ram'],
+		'irq': placement.MAX_IRQ-metrics['used_irq'],
+		'vms': core.cfg['LB_MAX_VM_PER_NODE']-len(metrics['vms']),
+	}
+
+
+class FailoverPlanner(object):
+
+	"""
+	This class compute a failover plan for the loss of each node (N-1), and
+	tell if the cluster can survive the loss of any node.
+
+	Plans are dicts with the following keys:
+	  - 'timestamp': date of the oldest metrics used;
+	  - 'vms': the VMs running on the node, with their ram;
+	  - 'capacities': the free capacities of the surviving nodes, before placement;
+	  - 'placement': VM -> surviving node;
+	  - 'unplaced': the VMs that cannot be placed, or whose ram is unknown.
+	"""
+
+	def __init__(self):
+		self._plans=dict()		# Node -> plan for its loss
+		self.feasible=None		# True if the loss of any node can be recovered, None if unknown
+		self.timestamp=0		# Date of the last computation
+
+	def compute(self, status, metrics, now=None):
+		"""
+		Compute the plans for all nodes of the given status (see MasterService.getStatus()).
+		The nodes without metrics don't receive VMs, and the loss of such a node is not planned.
+		Return the new N-1 feasible flag.
+		"""
+		if now is None:
+			now=time.time()
+
+		plans=dict()
+		for (name, values) in status.items():
+			if name not in metrics:
+				continue
+
+			vms=dict()
+			unknown=list()
+			for vm in values['vms']:
+				try:
+					vms[vm]=metrics[name]['vms'][vm]['ram']
+				except KeyError:
+					# Started since the last metrics
+					unknown.append(vm)
+
+			survivors=sorted([ node for node in status.keys() if node != name and node in metrics ])
+			capacities=dict([ (node, get_capacities(metrics[node])) for node in survivors ])
+
+			# Nodes' free irq come from the metrics, but the metrics of VMs only hold their
+			# ram and cpu usage: VMs have no irq demand here, they are placed by ram and count.
+			(selected, unplaced, free)=placement.place([ (vm, {'ram': ram, 'vms': 1}) for vm, ram in vms.items() ],
+				[ (node, capacities[node]) for node in survivors ])
+			plans[name]={
+				'timestamp': min([ metrics[node]['timestamp'] for node in survivors+[name] ]),
+				'vms': vms,
+				'capacities': capacities,
+				'placement': selected,
+				'unplaced': unplaced+unknown,
+			}
+
+		self._plans=plans
+		self.timestamp=now
+		if len(status) <= 1 or len(plans) < len(status):
+			# Alone, or not enough metrics to tell
+			self.feasible=None
+		else:
+			self.feasible=len([ plan for plan in plans.values() if len(plan['unplaced']) > 0 ]) == 0
+
+		return self.feasible
+
+	def remove(self, name):
+		"""Forget the plan for the loss of the given node. Plans for other nodes are outdated until next compute()."""
+		self._plans.pop(name, None)
+
+	def get_plan(self, name):
+		"""Return the plan for the loss of the given node, or None."""
+		return self._plans.get(name)
+
+	def get_plans(self):
+		"""Return the plans of all nodes, as a dict node -> plan."""
+		return self._plans
+
+	def get_infeasible(self):
+		"""Return the list of nodes whose loss cannot be fully recovered."""
+		return [ name for (name, plan) in self._plans.items() if len(plan['unplaced']) > 0 ]
+
+
+# vim: ts=4:sw=4:ai
@@ -0,0 +1,182 @@
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2011-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+# $Id:$
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+
+"""
+This module hold the failure detectors used by the master to check heartbeats.
+
+A detector record the arrival time of each node's heartbeats, and tell if a
+node is suspected to have failed. The detector used is selected by
+FAILURE_DETECTOR, see get_detector().
+"""
+
+import time, math
+from collections import deque
+import core
+
+
+class FixedDetector(object):
+
+	"""This class suspect a node if no heartbeat has been received within a fixed timeout."""
+
+	def __init__(self, timeout):
+		self.timeout=timeout
+		self._last=dict()		# Node -> arrival time of the last heartbeat
+
+	def heartbeat(self, name, now=None):
+		"""Record a heartbeat from the given node, received at 'now'."""
+		if now is None:
+			now=time.time()
+
+		if now > self._last.get(name, 0):
+			self._last[name]=now
+
+	def remove(self, name):
+		self._last.pop(name, None)
+
+	def suspicion(self, name, now=None):
+		"""Return the elapsed time since the last heartbeat, relative to the timeout."""
+		if name not in self._last:
+			return 0.0
+		if now is None:
+			now=time.time()
+
+		return (now-self._last[name])/float(self.timeout)
+
+	def is_suspected(self, name, now=None):
+		"""Return True if the node is suspected. Unknown nodes are never suspected."""
+		return self.suspicion(name, now) >= 1
+
+	def get_stats(self):
+		"""Return a dict with the suspicion level of each node."""
+		now=time.time()
+		return dict([ (name, round(self.suspicion(name, now), 3)) for name in self._last.keys() ])
+
+
+class PhiAccrualDetector(FixedDetector):
+
+	"""
+	This class implement the phi accrual failure detector (Hayashibara et al.).
+
+	The inter-arrival times of the last WINDOW heartbeats of each node are
+	kept, and the time elapsed since the last heartbeat is compared to their
+	normal distribution. The suspicion level is phi = -log10(P), where P is the
+	probability that a heartbeat arrives later than now. So phi=8 means that a
+	wrong suspicion happens once in 10^8 heartbeats. A node is suspected when
+	phi reach the threshold: the detection time follow the observed jitter
+	instead of a worst-case timeout.
+	"""
+
+	WINDOW = 100				# Number of inter-arrival times kept by node
+	MIN_STD_RATIO = 0.25		# Minimum standard deviation, relative to the interval
+	LOST_HEARTBEATS = 1			# Number of lost heartbeats tolerated before suspicion (UDP is not reliable)
+
+	def __init__(self, threshold, interval):
+		FixedDetector.__init__(self, None)
+		self.threshold=threshold
+		self.interval=float(interval)	# Expected interval between heartbeats
+		self._history=dict()	# Node -> [deque of inter-arrival times, sum, sum of squares]
+
+	def heartbeat(self, name, now=None):
+		if now is None:
+			now=time.time()
+
+		try:
+			last=self._last[name]
+		except KeyError:
+			# First heartbeat: start with the expected interval
+			std=self.interval/4
+			self._history[name]=[deque([self.interval-std, self.interval+std]), 2*self.interval,
+				(self.interval-std)**2+(self.interval+std)**2]
+			self._last[name]=now
+			return
+
+		if now <= last:
+			return
+
+		delta=now-last
+		history=self._history[name]
+		if len(history[0]) >= PhiAccrualDetector.WINDOW:
+			old=history[0].popleft()
+			history[1]-=old
+			history[2]-=old**2
+		history[0].append(delta)
+		history[1]+=delta
+		history[2]+=delta**2
+		self._last[name]=now
+
+	def remove(self, name):
+		FixedDetector.remove(self, name)
+		self._history.pop(name, None)
+
+	def phi(self, name, now=None):
+		"""Return the suspicion level of the given node. Unknown nodes have a phi of 0."""
+		if name not in self._last:
+			return 0.0
+		if now is None:
+			now=time.time()
+
+		(intervals, total, squares)=self._history[name]
+		mean=total/len(intervals)
+		variance=max(squares/len(intervals)-mean**2, 0)
+		std=max(math.sqrt(variance), self.interval*PhiAccrualDetector.MIN_STD_RATIO)
+
+		# Logistic approximation of the normal CDF: phi = -log10(e/(1+e)) with e=exp(-x),
+		# written in a way that doesn't overflow for long or short delays.
+		y=(now-self._last[name]-mean-self.interval*PhiAccrualDetector.LOST_HEARTBEATS)/std
+		x=y*(1.5976+0.070566*y*y)
+		if x > 0:
+			return x/math.log(10)+math.log10(1.0+math.exp(-x))
+		else:
+			return math.log10(1.0+math.exp(x))
+
+	def suspicion(self, name, now=None):
+		return self.phi(name, now)
+
+	def is_suspected(self, name, now=None):
+		return self.phi(name, now) >= self.threshold
+
+
+DETECTORS = ['fixed', 'phi']
+
+def get_detector(timeout, interval):
+	"""
+	Return a new failure detector, according to FAILURE_DETECTOR.
+	'timeout' is used by the fixed detector, and 'interval', the expected
+	interval between heartbeats, by the phi accrual detector.
+	"""
+	if core.cfg['FAILURE_DETECTOR'] == "fixed":
+		return FixedDetector(timeout)
+	elif core.cfg['FAILURE_DETECTOR'] == "phi":
+		return PhiAccrualDetector(core.cfg['PHI_THRESHOLD'], interval)
+	else:
+		raise FailureDetectorError("Unknown failure detector %s" % (core.cfg['FAILURE_DETECTOR']))
+
+
+class FailureDetectorError(Exception):
+	"""This class is used to raise errors relatives to failure detectors."""
+	pass
+
+
+# vim: ts=4:sw=4:ai
@@ -25,8 +25,9 @@
 
 
 from twisted.application.service import Service
-from twisted.internet import defer, task
+from twisted.internet import defer, task, threads
 from dnscache import DNSCache
+import core
 import logs as log
 from messages import *
 from netheartbeat import *
@@ -37,9 +38,25 @@ class SlaveHearbeatService(Service):
 
 	def __init__(self, master):
 		self._master=master
+		self._metrics=None		# Last metrics collected, not sent yet
+		self._pulse=None		# Deferred of the last disk pulse
 
 	def forgeSlaveHeartbeat(self):
-		return MessageSlaveHB().forge(self._master.getLocalNode())
+		# Metrics are sent at a lower frequency, once per collect (see collectMetrics())
+		metrics=self._metrics
+		self._metrics=None
+
+		return MessageSlaveHB().forge(self._master.getLocalNode(), metrics)
+
+	def collectMetrics(self):
+		def collected(metrics):
+			self._metrics=metrics
+
+		# Out of the reactor thread, XenAPI and xend may be slow
+		d=threads.deferToThread(lambda: self._master.getLocalNode().metrics.get_summary())
+		d.addCallback(collected)
+		d.addErrback(lambda reason: log.warn("Cannot get metrics for heartbeat: %s" % (reason.getErrorMessage())))
+		return d
 
 	def startService(self):
 		def heartbeatFailed(reason):
@@ -51,17 +68,40 @@ class SlaveHearbeatService(Service):
 		log.info("Starting slave heartbeats...")
 		self._hb = NetHeartbeat(self.forgeSlaveHeartbeat, self._master.getActiveMaster())
 		self._hb.start()
-		self._call = task.LoopingCall(self._master.disk.write_ts, DNSCache.getInstance().name)
-		d=self._call.start(1)
+		self._writer = HeartbeatWriter(DNSCache.getInstance().name)
+		self._call = task.LoopingCall(self.diskPulse)
+		d=self._call.start(core.cfg['HB_INTERVAL'])
 		d.addErrback(heartbeatFailed)
+
+		self._metricsCall = task.LoopingCall(self.collectMetrics)
+		if core.cfg['HB_METRICS_INTERVAL'] > 0:
+			self._metricsCall.start(core.cfg['HB_METRICS_INTERVAL']).addErrback(log.err)
 		return d
 	
+	def diskPulse(self):
+		# Out of the reactor thread, a slow SAN must not delay network heartbeats
+		self._pulse=threads.deferToThread(self._writer.pulse)
+		return self._pulse
+
 	def stopService(self):
 		if self.running:
 			Service.stopService(self)
 			log.info("Stopping slave heartbeats...")
 			if self._call.running:
 				self._call.stop()
+			if self._metricsCall.running:
+				self._metricsCall.stop()
+			self._metrics=None
+
+			# Don't close the handle under a running pulse
+			def close(result):
+				threads.deferToThread(self._writer.close)
+				return result
+
+			if self._pulse is None:
+				close(None)
+			else:
+				self._pulse.addBoth(close)
 			return self._hb.stop()
 		else:
 			return defer.succeed(None)
@@ -73,17 +113,39 @@ class SlaveHearbeatService(Service):
 
 class MasterHeartbeatService(Service):
 
+	FULL_INTERVAL = 10	# Send a full status every 10 heartbeats, deltas otherwise
+
 	def __init__(self, master):
 		self._master=master
+		self._seq=0				# Sequence number of the last heartbeat
+		self._sent=None			# Vms lists sent so far, by node
+		self._resync=False		# True if a slave has requested a full status
 
 	def forgeMasterHeartbeat(self):
-		return MessageMasterHB().forge(self._master.getStatus(), self._master.getState())
+		self._seq+=1
+
+		if self._resync or self._seq % MasterHeartbeatService.FULL_INTERVAL == 1:
+			self._resync=False
+			sent=None
+		else:
+			sent=self._sent
+
+		status=self._master.getStatus()
+		msg=MessageMasterHB().forge(status, self._master.getState(), self._seq, sent)
+		self._sent=dict([ (name, values['vms']) for name, values in status.items() ])
+		return msg
+
+	def requestResync(self):
+		"""Send a full status on next heartbeat."""
+		self._resync=True
 	
 	def startService(self):
 		Service.startService(self)
 
 		log.info("Starting master heartbeat...")
-		self._hb = NetHeartbeat(self.forgeMasterHeartbeat)
+		self._seq=0
+		self._sent=None
+		self._hb = NetHeartbeat(self.forgeMasterHeartbeat, getMembers=self._master.getNodesList)
 		self._hb.start()
 
 	def stopService(self):
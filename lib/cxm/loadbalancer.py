@@ -24,11 +24,16 @@
 ###########################################################################
 
 
-import math
-from copy import deepcopy, copy
+import math, random, time
+from copy import copy
 import core
 import logs as log
 
+try:
+	import numpy
+except ImportError:
+	numpy = None	# Use the pure python scorer
+
 
 class LoadBalancer:
 	"""
@@ -39,6 +44,8 @@ class LoadBalancer:
 	algorithm (can be see like an approximate algo)
 	The goal is to seek for the first better solution that satisfy all constraints.
 
+	Others strategies can be used with get_solution(), see STRATEGIES.
+
 	Network IO and disk IO are not considered because bottlenecks are generally not on the 
 	node but on uplink LAN or SAN switches, whereas RAM is considered to optimize balooning.
 
@@ -65,8 +72,24 @@ class LoadBalancer:
 		self.solutions = {}		# Hold the solutions' tree (a bit flattened, yep)
 		self.root = Solution(current_state)  # Current solution, root of the solutions' tree
 
+		self.zobrist = {}		# Random keys of each (vm, node) placement, see get_key()
+		self.random = random.Random(0)
+		self.tabu_keys = set()	# Keys of already found solutions' state
+		self.tabu_scores = set()	# Scores of already found solutions, see Solution.__eq__()
+		self.rejected_keys = set()	# Keys of states that don't respect constraints
+		self.vectorized = numpy is not None	# Score candidates with a VectorScorer, if available
+		self.scorer = None
+		self.deadline = None	# Time limit of the search, see get_solution()
+
 		# Set the initial state : layer 0
 		self.solutions[0] = [self.root]
+		self.root.key = 0
+		self.placement = {}		# Node of each vm in the current state
+		for node, vms in self.root.state.items():
+			for vm in vms:
+				self.root.key ^= self.get_key(vm, node)
+				self.placement[vm] = node
+		self.tabu_keys.add(self.root.key)
 
 
 	def set_metrics(self, vm_metrics, node_metrics):
@@ -91,11 +114,91 @@ class LoadBalancer:
 		
 		# Finalize initialisation
 		self.root.compute_score(self.vm_metrics)
+		self.tabu_scores.add(self.root.score)
 
 		log.debug(" [LB]", "vm_metrics=", vm_metrics)
 		log.debug(" [LB]", "node_metrics=", node_metrics)
 		log.debug(" [LB]", "current_state=", self.root)
 
+	def get_solution(self, strategy=None, budget=None):
+		"""
+		Get a better solution with the given strategy, within the given time budget.
+
+		strategy is a key of STRATEGIES, LB_STRATEGY by default.
+		budget is the maximum search time in seconds, LB_TIME_BUDGET by default (0 means
+		no limit). When the time is over, the best solution found so far is used.
+
+		Return the choosen solution, or None if there's no solution.
+		"""
+		if strategy is None:
+			strategy = core.cfg['LB_STRATEGY']
+		if budget is None:
+			budget = core.cfg['LB_TIME_BUDGET']
+
+		try:
+			solver = STRATEGIES[strategy](self)
+		except KeyError:
+			raise LoadBalancerError("Unknown strategy: %s" % (strategy))
+
+		if budget > 0:
+			self.deadline = time.time() + budget
+		else:
+			self.deadline = None
+
+		log.debug(" [LB]", "Using strategy", strategy, "with a budget of", budget, "seconds")
+		return solver.solve()
+
+	def is_timeout(self):
+		"""Return True if the time budget of the search is over."""
+		return self.deadline is not None and time.time() > self.deadline
+
+	def is_gain_ok(self, solution):
+		"""Return True if the given solution is better than the current state of at least LB_MIN_GAIN%."""
+		if solution is None or not solution.score < self.root.score:
+			return False
+
+		# Compute the gain (in percetage) of this solution
+		gain = ((self.root.score-solution.score)*100)/self.root.score
+		return gain >= core.cfg['LB_MIN_GAIN']
+
+	def get_plan(self, solution):
+		"""
+		Compute a migration plan from the current state to the state of the given solution.
+
+		Each vm is migrated only once, in an order such as each intermediate state 
+		respect constraints on the destination node.
+
+		Return a new solution with this plan as path, or None if there's no such order.
+		"""
+		pending = [ (vm, self.placement[vm], node) for node in solution.nodes
+			for vm in solution.state[node] if self.placement[vm] != node ]
+
+		current = self.root
+		while len(pending) > 0:
+			for (vm, source, destination) in pending:
+				candidate = current.derive(vm, source, destination, self.vm_metrics)
+				if candidate.is_node_constraints_ok(destination, self.node_metrics):
+					break
+			else:
+				return None # Dead end, each migration need another one before
+
+			pending.remove((vm, source, destination))
+			current = candidate
+
+		return current
+
+	def get_key(self, vm, node):
+		"""
+		Return the random key of the placement of 'vm' on 'node'.
+
+		The key of a state is the XOR of the keys of all its placements (Zobrist hashing), so
+		it's updated in constant time by a migration, whatever the order of the vms.
+		"""
+		try:
+			return self.zobrist[(vm, node)]
+		except KeyError:
+			key = self.zobrist[(vm, node)] = self.random.getrandbits(64)
+			return key
 
 	def create_layer(self, root, layer):
 		"""Create a new layer with all possible solutions.
@@ -107,38 +210,88 @@ class LoadBalancer:
 			Layer n means solutions with n migrations
 		"""
 
-		# Tabu list: already found solutions
-		tabu = [ item for sublist in self.solutions.values() for item in sublist ]
-		
+		# Check constraints of the root once, then only the destination of each migration
+		if root.valid is None:
+			root.valid = root.is_constraints_ok(self.vm_metrics, self.node_metrics)
+
+		# Solutions found from this root are made tabu only at the end, as
+		# permutations are not possible in the same layer.
+		found = []
+
+		# Score all candidates at once, if possible
+		if self.vectorized:
+			if self.scorer is None:
+				self.scorer = VectorScorer(self.root.nodes, self.vm_metrics, self.node_metrics)
+			candidates = self.scorer.score_moves(root, root.valid, self.tabu_scores)
+		else:
+			candidates = self.get_moves(root)
+
+		for (vm, node, target, score, valid) in candidates:
+			# Don't keep existing solutions, nor known bad ones
+			key = root.key ^ self.get_key(vm, node) ^ self.get_key(vm, target)
+			if key in self.tabu_keys or key in self.rejected_keys:
+				continue
+
+			# Create a possible solution
+			if score is None:
+				solution = root.derive(vm, node, target, self.vm_metrics)
+				score = solution.score
+			else:
+				solution = None
+
+			# Don't keep permutable solutions.
+			if score in self.tabu_scores:
+				continue
+
+			# Add this solution to the pool if constraints are respected
+			if valid is None:
+				if root.valid:
+					valid = solution.is_node_constraints_ok(target, self.node_metrics)
+				else:
+					valid = solution.is_constraints_ok(self.vm_metrics, self.node_metrics)
+
+			if not valid:
+				self.rejected_keys.add(key)
+				continue
+
+			if solution is None:
+				solution = root.derive(vm, node, target, self.vm_metrics)
+			solution.key = key
+			solution.valid = True
+
+			found.append(solution)
+			try:
+				if solution.score < self.solutions[layer][0].score:
+					# Put the best solution on top of the list
+					self.solutions[layer].insert(0,solution)
+				else:
+					self.solutions[layer].append(solution)
+			except KeyError:
+				# Set the first solution of this layer
+				self.solutions[layer]=[solution]
+
+		# Update tabu lists
+		for solution in found:
+			self.tabu_keys.add(solution.key)
+			self.tabu_scores.add(solution.score)
+
+	def get_moves(self, root):
+		"""
+		Return the list of all possible migrations from the root solution.
+
+		Items are tuples (vm, source, destination, score, valid), where score and valid
+		are None as they are not computed. See VectorScorer.score_moves().
+		"""
+		moves = []
 		for node in root.state.keys():
 			target_nodes = root.state.keys()
 			target_nodes.remove(node) # In-place migration useless
 			
 			for vm in root.state[node]:
 				for target in target_nodes:
-					# Create a possible solution
-					solution = Solution(root.state)
-					solution.set_path(root.path)
-					solution.migrate(vm, node, target)
-					solution.compute_score(self.vm_metrics)
-
-					# Don't keep existing or permutable solutions.
-					#   No tabu search in current layer's solutions because permutations
-					#   are not possible in the same layer.
-					if solution in tabu:
-						continue
-
-					# Add this solution to the pool if constraints are respected
-					if solution.is_constraints_ok(self.vm_metrics, self.node_metrics):
-						try:
-							if solution.score < self.solutions[layer][0].score:
-								# Put the best solution on top of the list
-								self.solutions[layer].insert(0,solution)
-							else:
-								self.solutions[layer].append(solution)
-						except KeyError:
-							# Set the first solution of this layer
-							self.solutions[layer]=[solution]
+					moves.append((vm, node, target, None, None))
+
+		return moves
 					
 	def get_efficient_solution(self):
 		"""Get a better solution at the minimal cost.
@@ -149,6 +302,8 @@ class LoadBalancer:
 		while layer <= core.cfg['LB_MAX_MIGRATION']:
 			# Create current layer's solutions from previous layer
 			for previous_solution in self.solutions[layer-1]:
+				if self.is_timeout():
+					break
 				self.create_layer(previous_solution, layer)
 
 			try:
@@ -169,6 +324,10 @@ class LoadBalancer:
 				if gain >= core.cfg['LB_MIN_GAIN']:
 					log.debug(" [LB]", "Pickup this one, migration plan:", best_solution.path)
 					return best_solution
+
+			if self.is_timeout():
+				log.debug(" [LB]", "Time is over, giving up.")
+				return None
 			
 			layer+=1 # No better solution found in this layer, going a step further.
 
@@ -191,6 +350,8 @@ class LoadBalancer:
 		for layer in range(1, core.cfg['LB_MAX_MIGRATION']):
 			# Create current layer's solutions from previous layer
 			for previous_solution in self.solutions[layer-1]:
+				if self.is_timeout():
+					break
 				self.create_layer(previous_solution, layer)
 
 			# Give up if no more solutions
@@ -204,6 +365,9 @@ class LoadBalancer:
 			if self.solutions[layer][0].score < best_solution.score:
 				best_solution=self.solutions[layer][0]
 
+			if self.is_timeout():
+				break
+
 		# Compare initial solution to the best solution
 		if best_solution.score < self.root.score:
 			log.debug(" [LB]", "Found", best_solution)
@@ -216,6 +380,124 @@ class LoadBalancer:
            
 		return None # No better solution found at all, giving up.
 
+class VectorScorer:
+	"""
+	This class compute the score and the constraints of all migrations from a solution at once,
+	with numpy arrays. Results are exactly the same as the ones of Solution.compute_score()
+	and Solution.is_constraints_ok(): sums are done in the same order.
+	"""
+
+	def __init__(self, nodes, vm_metrics, node_metrics):
+		"""
+		Instanciate a new VectorScorer.
+
+		nodes is the list of nodes, in the order used to compute scores (see Solution.nodes).
+		vm_metrics and node_metrics are the loadbalancer's metrics, see LoadBalancer.set_metrics().
+		"""
+		self.nodes = nodes
+		self.index = dict([ (node, i) for i, node in enumerate(nodes) ])
+		self.vm_metrics = vm_metrics
+		self.node_ram = numpy.array([ node_metrics[node]['ram'] for node in nodes ], dtype=float)
+
+	def get_skip_sums(self, values):
+		"""
+		Return the sums of the given values without each of them.
+
+		values is an array of (ram, cpu) rows. Returned array's row i is the sum of all rows
+		but the i-th one, added one after the other like sum() does.
+		"""
+		size = len(values)
+
+		# Row i is : sum of values[:i], then values[i+1:], then zeros
+		idx = numpy.arange(size)[:, None] + numpy.arange(size)[None, :]
+		terms = numpy.where((idx < size)[:, :, None], values[numpy.minimum(idx, size-1)], 0.0)
+		terms[:, 0] = numpy.vstack((numpy.zeros((1, 2)), numpy.cumsum(values, axis=0)[:-1]))
+
+		# Cumsum is sequential, so the last column is the ordered sum
+		return numpy.cumsum(terms, axis=1)[:, -1]
+
+	def score_moves(self, root, root_valid, tabu_scores):
+		"""
+		Compute all possible migrations from the root solution.
+
+		If root_valid is True, the root solution respect the constraints and only the
+		destination node is checked. compute_score() should have been called on root.
+
+		Return a list of tuples (vm, source, destination, score, valid), in the same order
+		as LoadBalancer.get_moves(). Migrations that don't respect constraints, or with a
+		score in the set tabu_scores, are omitted.
+		"""
+		order = root.state.keys()
+		nb_targets = len(order) - 1
+		sums = numpy.array([ root.sums[node] for node in self.nodes ], dtype=float)
+		counts = numpy.array([ len(root.state[node]) for node in self.nodes ])
+
+		# Flatten vms, with their source node and the sums of this node without them
+		vms = []
+		sources = []
+		values = []
+		skip_sums = []
+		for node in order:
+			if len(root.state[node]) == 0:
+				continue
+
+			node_values = numpy.array([ (self.vm_metrics[vm]['ram'], self.vm_metrics[vm]['cpu'])
+				for vm in root.state[node] ], dtype=float)
+			vms.extend([ (vm, node) for vm in root.state[node] ])
+			sources.extend([ self.index[node] ] * len(root.state[node]))
+			values.append(node_values)
+			skip_sums.append(self.get_skip_sums(node_values))
+
+		if len(vms) == 0 or nb_targets == 0:
+			return []
+
+		# Targets of each source node, in the order of the root's state
+		order_index = [ self.index[node] for node in order ]
+		targets = numpy.array([ [ i for i in order_index if i != src ] for src in range(len(self.nodes)) ])
+
+		# One row per candidate: vm removed from source, added to destination
+		src = numpy.repeat(numpy.array(sources), nb_targets)
+		dst = targets[numpy.array(sources)].ravel()
+		rows = numpy.arange(len(src))
+
+		new_sums = numpy.tile(sums, (len(src), 1, 1))
+		new_sums[rows, src] = numpy.repeat(numpy.concatenate(skip_sums), nb_targets, axis=0)
+		new_sums[rows, dst] = sums[dst] + numpy.repeat(numpy.concatenate(values), nb_targets, axis=0)
+
+		# Check constraints, see Solution.is_constraints_ok()
+		if root_valid:
+			valid = ((counts[dst] + 1 <= core.cfg['LB_MAX_VM_PER_NODE']) &
+				(new_sums[rows, dst, 0] <= self.node_ram[dst]))
+		else:
+			new_counts = numpy.tile(counts, (len(src), 1))
+			new_counts[rows, src] -= 1
+			new_counts[rows, dst] += 1
+			valid = ((new_counts <= core.cfg['LB_MAX_VM_PER_NODE']).all(axis=1) &
+				(new_sums[:, :, 0] <= self.node_ram).all(axis=1))
+
+		rows = numpy.flatnonzero(valid)
+		new_sums = new_sums[rows]
+
+		# Compute scores, see Solution.compute_score()
+		totals = numpy.cumsum(new_sums, axis=1)[:, -1]
+		spreads = (new_sums.max(axis=1) - new_sums.min(axis=1)) * 100
+		deltas = numpy.zeros(totals.shape)
+		nonzero = totals != 0
+		deltas[nonzero] = spreads[nonzero] / totals[nonzero]
+		# (not square(), math.pow() may round differently)
+		scores = numpy.sqrt(numpy.power(deltas[:, 0], 2.0) + numpy.power(deltas[:, 1], 2.0))
+
+		moves = []
+		for row, score in zip(rows.tolist(), scores.tolist()):
+			if score in tabu_scores:
+				continue
+
+			vm, node = vms[row // nb_targets]
+			moves.append((vm, node, self.nodes[dst[row]], score, True))
+
+		return moves
+
+
 class Solution:
 	"""This class represent a solution for the loadbalancer, ie. a state of the cluster and a path to reach it.
 
@@ -233,10 +515,40 @@ class Solution:
 				}
 
 		"""
-		# TODO: optimize ram usage with only 2 level deepcopy
-		self.state = deepcopy(state) 	# State of this solution (which vm is on which node)
+		# Lists are never modified in place, so they can be shared with derived solutions
+		self.state = dict([ (node, list(vms)) for node, vms in state.items() ]) 	# State of this solution (which vm is on which node)
 		self.score = None  				# Should be a float for precision
 		self.path = [] 					# Complete path (details of migrations) from the start solution to this solution
+		self.nodes = sorted(state.keys())	# Nodes' order used to compute the score
+		self.sums = None				# RAM/CPU sums of each node, set by compute_score()
+		self.key = None					# Hash of the state, set by the LoadBalancer
+		self.valid = None				# Result of the constraints' check, set by the LoadBalancer
+
+	def derive(self, vm_name, source, destination, metrics):
+		"""
+		Return a new solution, with the vm named 'vm_name' migrated from 'source' to 'destination'.
+
+		This is the same as creating a new Solution from this one, then calling migrate() and
+		compute_score(), but only the two modified nodes are copied and computed.
+		compute_score() should have been called on this solution.
+		"""
+		solution = Solution({})
+		solution.nodes = self.nodes
+		solution.state = copy(self.state)
+		solution.path = copy(self.path)
+		solution.migrate(vm_name, source, destination)
+
+		solution.sums = copy(self.sums)
+		for node in (source, destination):
+			solution.sums[node] = solution.compute_node_sums(node, metrics)
+
+		solution.score = solution.compute_score_from_sums()
+		return solution
+
+	def compute_node_sums(self, node, metrics):
+		"""Return a tuple with the RAM and CPU sums of each vm on the given node."""
+		return (sum([ metrics[vm]['ram'] for vm in self.state[node] ]),
+			sum([ metrics[vm]['cpu'] for vm in self.state[node] ]))
 
 	def compute_score(self,metrics):
 		"""Compute the score of this solution, from the given metrics.
@@ -252,8 +564,13 @@ class Solution:
 				}
 		"""
 		# Compute RAM/CPU sums of each vm, on each node
-		RAMs = [ sum([ metrics[vm]['ram'] for vm in self.state[node] ]) for node in self.state ]
-		CPUs = [ sum([ metrics[vm]['cpu'] for vm in self.state[node] ]) for node in self.state ]
+		self.sums = dict([ (node, self.compute_node_sums(node, metrics)) for node in self.state ])
+		self.score = self.compute_score_from_sums()
+
+	def compute_score_from_sums(self):
+		"""Return the score of this solution, from the RAM/CPU sums of each node. See compute_score()."""
+		RAMs = [ self.sums[node][0] for node in self.nodes ]
+		CPUs = [ self.sums[node][1] for node in self.nodes ]
 
 		# Compute load deviation between the node with the highest load and the node with the lower load.
 		# delta_* are percentages relatives to the current cluster (total) load.
@@ -282,7 +599,7 @@ class Solution:
 		#        ________________________
 		# AB = \/ ( Xb-Xa )² + ( Yb-Ya )²
 		#
-		self.score=math.sqrt(math.pow(delta_RAMs,2)+math.pow(delta_CPUs,2))
+		return math.sqrt(math.pow(delta_RAMs,2)+math.pow(delta_CPUs,2))
 	
 	def set_path(self,path):
 		"""Set the current path to this solution."""
@@ -307,8 +624,12 @@ class Solution:
 		"""
 
 		self.path.append({'vm':vm_name, 'src':source, 'dst':destination})
-		self.state[source].remove(vm_name)
-		self.state[destination].append(vm_name)
+
+		# Lists may be shared with others solutions, don't modify them in place
+		vms = list(self.state[source])
+		vms.remove(vm_name)
+		self.state[source] = vms
+		self.state[destination] = self.state[destination] + [vm_name]
 		
 	def is_constraints_ok(self, vm_metrics, node_metrics):
 		"""
@@ -344,6 +665,20 @@ class Solution:
 		
 		return True
 
+	def is_node_constraints_ok(self, node, node_metrics):
+		"""
+		Check if the builtin constraints are respected on the given node only. See is_constraints_ok().
+		compute_score() should have been called on this solution.
+
+		Return a boolean.
+		"""
+		# Constraint 1: Maximum number of vm per node
+		if len(self.state[node]) > core.cfg['LB_MAX_VM_PER_NODE']:
+			return False
+
+		# Constraint 2: Sum of vm's ram is not greater than node's ram
+		return self.sums[node][0] <= node_metrics[node]['ram']
+
 	def __eq__(self, other):
 		"""Compare Solution's instances by score."""
 		if not isinstance(other, Solution):
@@ -355,4 +690,243 @@ class Solution:
 	def __repr__(self):
 		return "<Solution: state=%s,score=%s>" % (self.state, self.score)
 
+class Strategy:
+	"""
+	This is the base class of loadbalancer's strategies.
+
+	A strategy search for a better solution than the current state of the given LoadBalancer,
+	respecting constraints, LB_MAX_MIGRATION, LB_MIN_GAIN and the time budget (see
+	LoadBalancer.is_timeout()). Strategies are registered in STRATEGIES.
+
+	Each strategy implement solve(), which return the choosen solution, or None if
+	there's no solution.
+	"""
+
+	def __init__(self, lb):
+		"""Instanciate a new strategy, working on the given LoadBalancer."""
+		self.lb = lb
+
+
+class LayeredStrategy(Strategy):
+	"""
+	This strategy is the loadbalancer's layered algorithm, see LoadBalancer.get_efficient_solution().
+	It stop at the first layer with a solution good enough, so plans are as short as possible.
+	"""
+
+	def solve(self):
+		"""Return the choosen solution, or None if there's no solution."""
+		return self.lb.get_efficient_solution()
+
+
+class GreedyStrategy(Strategy):
+	"""
+	This strategy apply the best migration, one after the other, while the score is improved.
+	When no single migration improve the score, a local search try to swap two vms.
+
+	It's fast and scale well, but could be trapped in a local minimum.
+	"""
+
+	def solve(self):
+		"""Return the choosen solution, or None if there's no solution."""
+		lb = self.lb
+		current = lb.root
+
+		while not lb.is_timeout():
+			candidate = self.get_best_move(current)
+			if candidate is None or not candidate.score < current.score:
+				candidate = self.get_best_swap(current)
+				if candidate is None or not candidate.score < current.score:
+					break # Local minimum
+
+			current = candidate
+
+		if current is lb.root or not current.is_constraints_ok(lb.vm_metrics, lb.node_metrics):
+			return None
+
+		solution = lb.get_plan(current)
+		if not lb.is_gain_ok(solution):
+			return None
+
+		log.debug(" [LB]", "Pickup this one, migration plan:", solution.path)
+		return solution
+
+	def count_moved(self, solution):
+		"""Return the number of vms that are not on their initial node in the given solution."""
+		return len([ vm for node in solution.nodes for vm in solution.state[node]
+			if self.lb.placement[vm] != node ])
+
+	def get_moved_delta(self, vm, source, destination):
+		"""Return the change of count_moved() when 'vm' is migrated from 'source' to 'destination'."""
+		initial = self.lb.placement[vm]
+		return int(destination != initial) - int(source != initial)
+
+	def get_best_move(self, current):
+		"""Return the best solution reachable from current with one migration, or None."""
+		lb = self.lb
+		best = None
+		moved = self.count_moved(current)
+
+		for (vm, source, destination, score, valid) in lb.get_moves(current):
+			# Don't exceed the maximum number of migrations
+			if moved + self.get_moved_delta(vm, source, destination) > core.cfg['LB_MAX_MIGRATION']:
+				continue
+
+			candidate = current.derive(vm, source, destination, lb.vm_metrics)
+			if best is not None and not candidate.score < best.score:
+				continue
+
+			if candidate.is_node_constraints_ok(destination, lb.node_metrics):
+				best = candidate
+
+		return best
+
+	def get_best_swap(self, current):
+		"""Return the best solution reachable from current by exchanging two vms, or None."""
+		lb = self.lb
+		best = None
+		moved = self.count_moved(current)
+		nodes = current.nodes
+
+		for i in range(len(nodes)):
+			for j in range(i+1, len(nodes)):
+				for vm1 in current.state[nodes[i]]:
+					for vm2 in current.state[nodes[j]]:
+						if lb.is_timeout():
+							return best
+
+						# Don't exceed the maximum number of migrations
+						delta = self.get_moved_delta(vm1, nodes[i], nodes[j]) + self.get_moved_delta(vm2, nodes[j], nodes[i])
+						if moved + delta > core.cfg['LB_MAX_MIGRATION']:
+							continue
+
+						candidate = self.swap(current, vm1, nodes[i], vm2, nodes[j])
+						if candidate is not None and (best is None or candidate.score < best.score):
+							best = candidate
+
+		return best
+
+	def swap(self, current, vm1, node1, vm2, node2):
+		"""Return the solution with vm1 and vm2 exchanged, or None if constraints are not respected."""
+		lb = self.lb
+
+		# Try both orders, the first migration may need room freed by the second one
+		for (a, src, b, dst) in ((vm1, node1, vm2, node2), (vm2, node2, vm1, node1)):
+			first = current.derive(a, src, dst, lb.vm_metrics)
+			if not first.is_node_constraints_ok(dst, lb.node_metrics):
+				continue
+
+			second = first.derive(b, dst, src, lb.vm_metrics)
+			if second.is_node_constraints_ok(src, lb.node_metrics):
+				return second
+
+		return None
+
+
+class AnnealingStrategy(GreedyStrategy):
+	"""
+	This strategy is a simulated annealing: random migrations are applied, worse states are
+	accepted with a probability decreasing with the time, so it can escape local minimums.
+
+	It use all the time budget (or MAX_ITERATIONS without budget).
+	"""
+
+	MAX_ITERATIONS = 20000		# Number of iterations without time budget
+	TEMPERATURE = 0.1			# Initial temperature, relative to the current score
+	COOLING = 0.001				# Final temperature, relative to the initial one
+
+	def __init__(self, lb, seed=None):
+		"""Instanciate a new strategy, working on the given LoadBalancer."""
+		Strategy.__init__(self, lb)
+		self.random = random.Random(seed)
+
+	def get_temperature(self, start, iteration):
+		"""Return the temperature, decreasing from TEMPERATURE to TEMPERATURE*COOLING."""
+		if self.lb.deadline is None:
+			progress = float(iteration) / self.MAX_ITERATIONS
+		else:
+			progress = (time.time() - start) / max(self.lb.deadline - start, 0.001)
+
+		initial = max(self.lb.root.score, 1) * self.TEMPERATURE
+		return initial * math.pow(self.COOLING, min(progress, 1))
+
+	def solve(self):
+		"""Return the choosen solution, or None if there's no solution."""
+		lb = self.lb
+		vms = lb.placement.keys()
+		vms.sort()
+		if len(vms) == 0 or len(lb.root.nodes) < 2:
+			return None
+
+		current = lb.root
+		location = dict(lb.placement)	# Node of each vm in the current solution
+		moved = 0
+		best = None
+		start = time.time()
+		iteration = 0
+		temperature = self.get_temperature(start, iteration)
+
+		while True:
+			iteration += 1
+			if lb.deadline is None and iteration > self.MAX_ITERATIONS:
+				break
+
+			# Check time and cool down, from time to time
+			if iteration % 100 == 0:
+				if lb.is_timeout():
+					break
+				temperature = self.get_temperature(start, iteration)
+
+			# Pick a random migration
+			vm = self.random.choice(vms)
+			source = location[vm]
+			destination = self.random.choice(current.nodes)
+			if destination == source:
+				continue
+
+			# Don't exceed the maximum number of migrations
+			candidate_moved = moved + self.get_moved_delta(vm, source, destination)
+			if candidate_moved > core.cfg['LB_MAX_MIGRATION']:
+				continue
+
+			candidate = current.derive(vm, source, destination, lb.vm_metrics)
+			if not candidate.is_node_constraints_ok(destination, lb.node_metrics):
+				continue
+
+			# Metropolis criterion
+			delta = candidate.score - current.score
+			if delta > 0 and self.random.random() >= math.exp(-delta / temperature):
+				continue
+
+			candidate.path = []	# Path is computed at the end, see get_plan()
+			current = candidate
+			location[vm] = destination
+			moved = candidate_moved
+
+			# Keep the best solution with a valid migration plan
+			if (best is None or current.score < best.score) and current.score < lb.root.score:
+				if current.is_constraints_ok(lb.vm_metrics, lb.node_metrics):
+					solution = lb.get_plan(current)
+					if solution is not None:
+						best = solution
+
+		if not lb.is_gain_ok(best):
+			return None
+
+		log.debug(" [LB]", "Pickup this one, migration plan:", best.path)
+		return best
+
+
+# Loadbalancer's strategies, indexed by name
+STRATEGIES = {
+	'layered': LayeredStrategy,
+	'greedy': GreedyStrategy,
+	'annealing': AnnealingStrategy,
+}
+
+
+class LoadBalancerError(Exception):
+	"""This class is used to raise errors relatives to the loadbalancer."""
+	pass
+
+
 # vim: ts=4:sw=4:ai
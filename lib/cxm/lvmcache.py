@@ -0,0 +1,116 @@
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2011-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+# $Id:$
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+
+"""This module hold the LvmCache class."""
+
+import threading, time
+import logs as log
+
+
+class LvmCache(object):
+
+	"""
+	This class is a per-node cache of the LVM state: the volume group, the
+	attributes and the size of each logical volume, indexed by path.
+
+	The whole state is read with a single scan (see COMMAND), shared by all
+	accessors (Node.get_vgs(), Node.get_lvs_attr(), Metrics.get_lvs_size()...),
+	as LVM scans are slow and take global locks.
+
+	The state is scanned again when:
+	  - it's older than LIFETIME seconds;
+	  - a fresh value is requested (nocache);
+	  - invalidate() is called, eg. after a lvchange or a LVM refresh.
+	"""
+
+	COMMAND = "lvs -o vg_name,lv_name,lv_attr,lv_size --noheading --units k --nosuffix"
+	LIFETIME = 5	# State is outdated after 5 seconds
+
+	def __init__(self, node):
+		"""Instanciate an empty cache for the given node."""
+		self.node=node
+		self._lvs=None				# Path -> {'vg', 'attr', 'size'}, None if not scanned
+		self._timestamp=0			# Date of the last scan
+		self._lock=threading.RLock()
+
+	def __repr__(self):
+		return "<LvmCache Instance : "+ self.node.hostname +">"
+
+	def invalidate(self):
+		"""Forget the state: LVM will be scanned again on next access."""
+		self._lock.acquire()
+		try:
+			self._lvs=None
+		finally:
+			self._lock.release()
+
+	def feed(self, lines):
+		"""Replace the state with the given output lines of COMMAND (see Node.get_snapshot())."""
+		lvs=dict()
+		for line in lines:
+			(vg, lv, attr, size)=line.strip().split()
+			lvs["/dev/"+vg+"/"+lv]={'vg': vg, 'attr': attr, 'size': float(size)}
+
+		self._lock.acquire()
+		try:
+			self._lvs=lvs
+			self._timestamp=time.time()
+		finally:
+			self._lock.release()
+		log.debug("[LVM]", self.node.hostname, "lvs=", lvs)
+
+	def get(self, nocache=False):
+		"""Return a dict with the VG ('vg'), attributes ('attr') and size in kB ('size') of each LV, indexed by path."""
+		self._lock.acquire()
+		try:
+			if nocache or self._lvs is None or self._timestamp+self.LIFETIME <= time.time():
+				self.feed(self.node.run_iter(self.COMMAND))
+			return self._lvs
+		finally:
+			self._lock.release()
+
+	def get_attrs(self, nocache=False):
+		"""Return a dict with the attributes of each LV, indexed by path."""
+		return dict([ (path, infos['attr']) for path, infos in self.get(nocache).items() ])
+
+	def get_vgs(self, lvs):
+		"""
+		Return the list of VGs of the given LVs.
+		LVM is scanned again if some LVs are unknown, as they may have been created since
+		the last scan. LVs still unknown are ignored.
+		"""
+		state=self.get()
+		if len([ lv for lv in lvs if lv not in state ]) > 0:
+			state=self.get(True)
+
+		return sorted(set([ state[lv]['vg'] for lv in lvs if lv in state ]))
+
+	def get_sizes(self, lvs):
+		"""Return a dict with the size in kB of each of the given LVs. Unknown LVs are ignored."""
+		state=self.get()
+		return dict([ (lv, state[lv]['size']) for lv in lvs if lv in state ])
+
+
+# vim: ts=4:sw=4:ai
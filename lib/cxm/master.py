@@ -42,6 +42,10 @@ from xencluster import XenCluster, InstantiationError
 from rpc import RPCService, NodeRefusedError, RPCRefusedError
 from diskheartbeat import DiskHeartbeat
 from agent import Agent
+from nodepool import NodePool
+import failuredetector
+from vmindex import VMIndex
+from failoverplan import FailoverPlanner
 
 
 class MasterService(Service):
@@ -64,14 +68,22 @@ class MasterService(Service):
 	TM_WATCHDOG	= core.cfg['TIMER']	# Check for failure every 3 sec
 	TM_MASTER	= TM_WATCHDOG*2		# Re-elect master if no response wihtin 6 sec
 	TM_SLAVE	= TM_WATCHDOG*3		# Trigger failover if no response within 9 sec (master + tally + rounding)
+	TM_DISK		= 1					# Disk timestamps have a resolution of 1 sec
+	TM_PLAN		= 5					# Update failover plans every 5 sec
 
 	def __init__(self):
 		self.role			= MasterService.RL_ALONE		# Current role of this node
 		self.state			= MasterService.ST_NORMAL		# Current cluster error status
 		self.master			= None							# Name of the active master
 		self.masterLastSeen	= 0								# Timestamp for master failover
+		self.masterSeq		= None							# (master, sequence number) of the last master heartbeat applied
+		self.resyncPending	= False							# True while asking master for a full status
 		self.status			= dict()						# Whole cluster status
+		self.vmIndex		= VMIndex()						# Running VM -> nodes, from status
+		self.metrics		= dict()						# Node's metrics from slave heartbeats (active master only)
+		self.planner		= FailoverPlanner()				# Failover plans from metrics (active master only)
 		self.localNode		= Node(DNSCache.getInstance().name)
+		self.pool			= NodePool()					# Warm connections used for recovery
 		self.disk			= DiskHeartbeat()
 		self.s_slaveHb		= SlaveHearbeatService(self)
 		self.s_masterHb		= MasterHeartbeatService(self)
@@ -80,6 +92,11 @@ class MasterService(Service):
 		# Watchdogs for failover
 		self.l_slaveDog		= task.LoopingCall(self.checkMasterHeartbeat)
 		self.l_masterDog	= task.LoopingCall(self.checkSlaveHeartbeats)
+		self.l_planner		= task.LoopingCall(self.updateFailoverPlans)
+		self.masterDetector	= failuredetector.get_detector(MasterService.TM_MASTER, core.cfg['HB_INTERVAL'])
+		self.netDetector	= None							# Failure detectors for slaves, see _startMaster()
+		self.diskDetector	= None
+		self.diskLastTs		= dict()						# Last disk timestamp seen of each slave
 
 		# Election Stuff
 		self.ballotBox 			= None		# All received votes
@@ -94,7 +111,10 @@ class MasterService(Service):
 		# Print welcome message
 		log.info("Starting cxmd version", meta.version)
 
-		self._messagePort=reactor.listenUDP(core.cfg['UDP_PORT'], UDPListener(self.dispatchMessage))
+		# Slave heartbeats read running vms from XenAPI events instead of polling
+		self.localNode.watch_events()
+
+		self._messagePort=openListener(self.dispatchMessage)
 		reactor.callLater(2, self.joinCluster)
 
 	def stopService(self):
@@ -177,6 +197,15 @@ class MasterService(Service):
 	def getNodesList(self):
 		return self.status.keys()
 
+	def getMetrics(self):
+		return self.metrics
+
+	def getFailoverPlans(self):
+		return {'feasible': self.planner.feasible, 'timestamp': self.planner.timestamp, 'plans': self.planner.get_plans()}
+
+	def getPool(self):
+		return self.pool
+
 	def isActive(self):
 		return self.role == MasterService.RL_ACTIVE
 
@@ -216,8 +245,13 @@ class MasterService(Service):
 			log.warn("Received slave heartbeat from unknown node %s." % (msg.node))
 			return
 
-		now=int(time.time())
-		self.status[msg.node]={'timestamp': now, 'offset': now-msg.ts, 'vms': msg.vms}
+		now=time.time()
+		self.netDetector.heartbeat(msg.node, now)
+		self.status[msg.node]={'timestamp': int(now), 'offset': int(now)-msg.ts, 'vms': msg.vms}
+		self.vmIndex.update(msg.node, msg.vms)
+		if msg.metrics is not None:
+			msg.metrics['timestamp']=int(now)
+			self.metrics[msg.node]=msg.metrics
 
 	def updateMasterStatus(self, msg):
 
@@ -255,9 +289,52 @@ class MasterService(Service):
 			log.emerg("SYSTEM FAILURE: Panic mode has been engaged by master.")
 
 		# Keep a backup of the active master's state and status
-		self.status=msg.status
 		self.state=msg.state
-		self.masterLastSeen=int(time.time())
+		self.masterLastSeen=time.time()
+		self.masterDetector.heartbeat(msg.node, self.masterLastSeen)
+
+		# A delta can only be applied on the previous heartbeat's status
+		try:
+			if not msg.full and self.masterSeq != (msg.node, msg.seq-1):
+				raise MessageError("heartbeat #%d is missing" % (msg.seq-1))
+			self.status=msg.apply(self.status)
+			self.masterSeq=(msg.node, msg.seq)
+			self.vmIndex.sync(self.status)
+		except MessageError, e:
+			log.debugd("Cannot apply master heartbeat:", e)
+			self.masterSeq=None
+			self.requestResync()
+
+	def requestResync(self):
+		"""Ask the active master to send a full status on next heartbeat."""
+		def masterConnected(obj):
+			d = obj.callRemote("resync")
+			d.addErrback(log.err)
+			d.addBoth(lambda _: rpcConnector.disconnect())
+			return d
+
+		def resyncDone(result):
+			self.resyncPending=False
+
+		# Only one request at a time, full status is sent periodically anyway
+		if self.resyncPending or self.role != MasterService.RL_PASSIVE:
+			return
+
+		log.info("Lost master heartbeat, asking %s for a full status." % (self.master))
+		self.resyncPending=True
+		rpcFactory = pb.PBClientFactory()
+		rpcConnector = reactor.connectTCP(self.master, core.cfg['TCP_PORT'], rpcFactory)
+		d = rpcFactory.getRootObject()
+		d.addCallback(masterConnected)
+		d.addErrback(log.err)
+		d.addBoth(resyncDone)
+
+	def resyncSlaves(self):
+		if self.role != MasterService.RL_ACTIVE:
+			log.warn("I'm not master. Cannot send full status.")
+			raise RPCRefusedError("Not master")
+
+		self.s_masterHb.requestResync()
 
 	def voteForNewMaster(self, msg):
 		# Elections accepted even if in panic mode
@@ -300,7 +377,7 @@ class MasterService(Service):
 
 		# Send our vote
 		d = Deferred()
-		port = reactor.listenUDP(0, UDPSender(d, lambda: MessageVoteResponse().forge(self.currentElection)))
+		port = openSender(UDPSender(d, lambda: MessageVoteResponse().forge(self.currentElection), getMembers=self.getNodesList))
 		d.addCallback(sendVote)
 		d.addErrback(log.err)
 
@@ -369,7 +446,7 @@ class MasterService(Service):
 
 		def startSlaveWatchdog():
 			if not self.l_slaveDog.running:
-				d=self.l_slaveDog.start(MasterService.TM_WATCHDOG)
+				d=self.l_slaveDog.start(self.getWatchdogInterval())
 				d.addErrback(slaveWatchdogFailed)
 				d.addErrback(log.err)
 
@@ -395,6 +472,9 @@ class MasterService(Service):
 		self.s_masterHb.stopService().addErrback(log.err)
 		if self.l_masterDog.running:
 			self.l_masterDog.stop()
+		if self.l_planner.running:
+			self.l_planner.stop()
+		self.pool.stop()
 		# TODO stop LB service
 
 	def _startMaster(self):
@@ -404,13 +484,21 @@ class MasterService(Service):
 
 		def startMasterWatchdog():
 			if not self.l_masterDog.running:
-				d=self.l_masterDog.start(MasterService.TM_WATCHDOG)
+				d=self.l_masterDog.start(self.getWatchdogInterval())
 				d.addErrback(masterWatchdogFailed)
 				d.addErrback(log.err)
 
 		# Start master heartbeat
 		self.s_masterHb.startService()
 
+		# Start failure detection from the last known timestamps of the previous master
+		self.netDetector=failuredetector.get_detector(MasterService.TM_SLAVE, core.cfg['HB_INTERVAL'])
+		self.diskDetector=failuredetector.get_detector(MasterService.TM_SLAVE, max(core.cfg['HB_INTERVAL'], MasterService.TM_DISK))
+		self.diskLastTs=dict()
+		for name, values in self.status.items():
+			if values['timestamp'] != 0:
+				self.netDetector.heartbeat(name, values['timestamp'])
+
 		# Check state of previous master
 		if self.state == MasterService.ST_RECOVERY:
 			log.warn("Previous master was recovering something: re-enabling failover.")
@@ -419,6 +507,15 @@ class MasterService(Service):
 
 		# Start master's watchdog for slaves failover
 		reactor.callLater(2, startMasterWatchdog)
+
+		# Keep connections to all nodes ready for recovery
+		self.pool.start(self.getNodesList)
+
+		# Plan recoveries in advance
+		if core.cfg['HB_METRICS_INTERVAL'] > 0 and not self.l_planner.running:
+			self.planner=FailoverPlanner()
+			d=self.l_planner.start(MasterService.TM_PLAN, now=False)
+			d.addErrback(log.err)
 		# TODO start LB service
 
 
@@ -465,6 +562,14 @@ class MasterService(Service):
 		except:
 			pass
 
+		for detector in [self.netDetector, self.diskDetector]:
+			if detector is not None:
+				detector.remove(name)
+		self.diskLastTs.pop(name, None)
+		self.vmIndex.remove(name)
+		self.metrics.pop(name, None)
+		self.planner.remove(name)
+
 		try:
 			self.disk.erase_slot(name)
 		except DiskHeartbeatError, e:
@@ -473,6 +578,7 @@ class MasterService(Service):
 			log.err("Diskheartbeat failure: %s." % (e))
 			self.panic()
 
+		self.pool.discard(name)
 		DNSCache.getInstance().delete(name)
 		log.info("Node %s has been unregistered." % (name))
 
@@ -498,7 +604,7 @@ class MasterService(Service):
 		log.info("Asking a new election for cluster %s." % (core.cfg['CLUSTER_NAME']))
 
 		d = Deferred()
-		port = reactor.listenUDP(0, UDPSender(d, lambda: MessageVoteRequest().forge()))
+		port = openSender(UDPSender(d, lambda: MessageVoteRequest().forge(), getMembers=self.getNodesList))
 		d.addCallback(lambda result: result.sendMessage())
 		d.addCallback(lambda _: port.stopListening())
 
@@ -633,6 +739,31 @@ class MasterService(Service):
 	# Failover stuff
 	###########################################################################
 
+	def getWatchdogInterval(self):
+		"""Return the period of failure checks. The phi detector is checked at heartbeat pace."""
+		if core.cfg['FAILURE_DETECTOR'] == "phi":
+			return core.cfg['HB_INTERVAL']
+		else:
+			return MasterService.TM_WATCHDOG
+
+	def updateFailoverPlans(self):
+		# Plans are only used by the active master
+		if self.role != MasterService.RL_ACTIVE:
+			return
+
+		def computed(feasible, wasFeasible):
+			if feasible is False:
+				if wasFeasible is not False:
+					log.warn("Cluster cannot recover from the loss of", ", ".join(self.planner.get_infeasible()))
+			elif wasFeasible is False and feasible:
+				log.info("Cluster can recover from the loss of any node.")
+
+		# The placement engine may take a while with PLACEMENT_STRATEGY="exact"
+		d=threads.deferToThread(self.planner.compute, dict(self.status), dict(self.metrics))
+		d.addCallback(computed, self.planner.feasible)
+		d.addErrback(lambda reason: log.err("Failover planning failed:", reason.getErrorMessage()))
+		return d
+
 	def checkMasterHeartbeat(self):
 		# Master failover is still possible even if in panic mode
 
@@ -640,8 +771,8 @@ class MasterService(Service):
 		if self.role != MasterService.RL_PASSIVE:
 			return 
 
-		# Usecase #7: master lost
-		if self.masterLastSeen+MasterService.TM_MASTER <= int(time.time()):
+		# Usecase #7: master lost (TM_MASTER is also the upper bound, as a new master is unknown to the detector)
+		if self.masterLastSeen+MasterService.TM_MASTER <= time.time() or self.masterDetector.is_suspected(self.master):
 			log.warn("Broadcast heartbeat lost, master has disappeared.")
 			return self.triggerElection()
 
@@ -664,13 +795,14 @@ class MasterService(Service):
 			return
 
 		# Check net heartbeat
+		now=time.time()
 		netFailed=Set()
 		for name, values in self.status.items():
 			if values['timestamp'] == 0:
 				# Do nothing if first heartbeat has not been received yet
 				continue
 
-			if values['timestamp']+MasterService.TM_SLAVE <= int(time.time()):
+			if self.netDetector.is_suspected(name, now):
 				log.warn("Net heartbeat lost for %s." % (name))
 				netFailed.add(name)
 
@@ -680,6 +812,13 @@ class MasterService(Service):
 		except Exception, e:
 			log.err("Diskheartbeat read failed: %s." % (e))
 			raise
+
+		# Nodes with a corrupted slot are only checked by net heartbeat, until their next disk pulse
+		unreadable=Set(self.status.keys())-Set(tsDisk.keys())
+		if len(unreadable) > 0 and len(unreadable) <= len(self.disk.corrupted_slots):
+			log.warn("Disk heartbeat unreadable for %s." % (", ".join(unreadable)))
+			for name in unreadable:
+				tsDisk[name]=0
 			
 		# Compare node lists from net and disk hearbeat
 		# Use Set's symmetric_difference
@@ -695,9 +834,17 @@ class MasterService(Service):
 				# Do nothing if first heartbeat has not been received yet
 				continue
 
-			# Timestamp from diskheartbeat is taken from each node, not relative to the master's time
-			# so we compute the absolute delta, with the time drift between nodes
-			if abs(int(time.time()) - timestamp - self.status[name]['offset']) >= MasterService.TM_SLAVE:
+			# Timestamp from diskheartbeat is taken from each node, not relative to the master's time.
+			# The detector is fed with the local time when a new timestamp is seen: the time drift
+			# between nodes is only used for the first one, as it's computed from each net heartbeat
+			# with a 1 second resolution, and this noise would distort inter-arrival times.
+			if timestamp != self.diskLastTs.get(name):
+				if name in self.diskLastTs:
+					self.diskDetector.heartbeat(name, now)
+				else:
+					self.diskDetector.heartbeat(name, min(timestamp + self.status[name]['offset'], now))
+				self.diskLastTs[name]=timestamp
+			if self.diskDetector.is_suspected(name, now):
 				log.warn("Disk heartbeat lost for %s." % (name))
 				diskFailed.add(name)
 
@@ -771,11 +918,18 @@ class MasterService(Service):
 				running.remove(name)
 			
 			# Re-instanciate cluster without nodes in error
-			d=XenCluster.getDeferInstance(running)
+			d=XenCluster.getDeferInstance(running, self.pool)
 			d.addCallbacks(startRecover)
 			return d
 
 		def startRecover(result):
+			# Plan with the data from heartbeats, without querying all nodes
+			result.set_vm_index(self.vmIndex.get_index())
+			result.set_metrics(self.getMetrics())
+			if len(netFailed|diskFailed) == 1:
+				# Plans are made for the loss of one node
+				result.set_failover_plans(self.planner.get_plans())
+
 			ds=list()
 			for name in netFailed|diskFailed:
 				bothFailed=name in netFailed and name in diskFailed
@@ -793,7 +947,11 @@ class MasterService(Service):
 			self.state=MasterService.ST_RECOVERY
 			log.info("Starting recovery process...")
 
-			d=XenCluster.getDeferInstance(self.getNodesList())
+			# Pooled connections to failed nodes are probably dead: re-open them
+			for name in netFailed|diskFailed:
+				self.pool.discard(name)
+
+			d=XenCluster.getDeferInstance(self.getNodesList(), self.pool)
 			d.addCallbacks(startRecover, instantiationFailed)
 			d.addErrback(recoverFailed)
 			d.addErrback(log.err)
@@ -26,7 +26,7 @@
 
 from pprint import pprint
 import time, random
-from dnscache import DNSCache
+from dnscache import DNSCache, DNSCacheMiss
 import core
 
 
@@ -35,13 +35,17 @@ class Message(object):
 		if host is None:
 			self.node=DNSCache.getInstance().name
 		else:
-			self.node=DNSCache.getInstance().get_by_ip(host)
+			try:
+				self.node=DNSCache.getInstance().get_by_ip(host)
+			except DNSCacheMiss, e:
+				# Sender will be known on next message
+				raise IDontCareException("Message from %s dropped: %s" % (host, e))
 
 	def type(self):
-		for (key, value) in MessageHelper.map.iteritems():
-			if type(self) == value:
-				return key
-		raise MessageError("Wrong type !")
+		try:
+			return MessageHelper.types[type(self)]
+		except KeyError:
+			raise MessageError("Wrong type !")
 
 	def parse(self, data):
 		self.cluster=data['cluster']
@@ -65,27 +69,42 @@ class MessageSlaveHB(Message):
 		super(MessageSlaveHB,self).parse(data)
 		self.ts=data['ts']
 		self.vms=data['vms']
+		self.metrics=data.get('metrics')	# Only sent from time to time, see Metrics.get_summary()
 
 		# Check variable type
 		if type(self.vms) != list:
 			raise MessageError("vms must be a list")
+		if self.metrics is not None and type(self.metrics) != dict:
+			raise MessageError("metrics must be a dict")
 
 		return self
 	
-	def forge(self, node):
+	def forge(self, node, metrics=None):
 		super(MessageSlaveHB,self).forge()
 		self.ts=int(time.time())
-		self.vms=node.get_vms_names(True) # Every second: no cache
+		self.vms=node.get_vms_names(True) # Every second: no cache, unless watched
+		self.metrics=metrics
 		return self
 
 	def value(self):
 		msg = {'ts': self.ts, 'vms': self.vms}
+		if self.metrics is not None:
+			msg['metrics']=self.metrics
 		return super(MessageSlaveHB,self).value(msg)
 
 	def __repr__(self):
 		return str("<MessageSlaveHB from "+ self.node +" : "+str(self.ts)+">")
 
 class MessageMasterHB(Message):
+
+	"""
+	This class is the master's heartbeat, holding the whole cluster's status.
+
+	Each heartbeat has a sequence number. It is either a full snapshot of the
+	status, or a delta: timestamps and offsets of all nodes, but only the vms
+	lists that have changed since the previous heartbeat. A delta can only be
+	applied on the status of the previous heartbeat, see apply().
+	"""
 	
 	def __init__(self, host=None):
 		super(MessageMasterHB,self).__init__(host)
@@ -94,11 +113,19 @@ class MessageMasterHB(Message):
 		super(MessageMasterHB,self).parse(data)
 		self.status=data['status']
 		self.state=data['state']
+		self.seq=int(data.get('seq', 0))			# Older masters only send full status
+		self.full=bool(data.get('full', True))
 
 		# Check variable type
 		if type(self.status) != dict:
 			raise MessageError("Status must be a dict")
 
+		for entry in self.status.values():
+			if type(entry) != dict:
+				raise MessageError("Status entries must be dict")
+			if self.full and 'vms' not in entry:
+				raise MessageError("Full status must have vms lists")
+
 		from master import MasterService
 		if self.state not in [MasterService.ST_NORMAL, MasterService.ST_PANIC,
 			MasterService.ST_RECOVERY]:
@@ -106,19 +133,58 @@ class MessageMasterHB(Message):
 			
 		return self
 		
-	def forge(self, status, state):
+	def forge(self, status, state, seq=0, sent=None):
+		"""
+		Forge a full heartbeat of the given status if 'sent' is None.
+		Otherwise, forge a delta against 'sent', the dict of vms lists (by node)
+		of the previous heartbeat.
+		"""
 		super(MessageMasterHB,self).forge()
 
-		self.status=status
+		self.seq=seq
+		self.full=sent is None
 		self.state=state
+
+		if self.full:
+			self.status=status
+		else:
+			self.status=dict()
+			for name, values in status.items():
+				entry={'timestamp': values['timestamp'], 'offset': values['offset']}
+				if name not in sent or sent[name] != values['vms']:
+					entry['vms']=values['vms']
+				self.status[name]=entry
+
 		return self
 
+	def apply(self, status):
+		"""
+		Return the new status, given the status of the previous heartbeat.
+		Raise a MessageError if a vms list is missing.
+		"""
+		if self.full:
+			return self.status
+
+		new=dict()
+		for name, entry in self.status.items():
+			try:
+				vms=entry['vms']
+			except KeyError:
+				try:
+					vms=status[name]['vms']
+				except KeyError:
+					raise MessageError("Missing vms list for %s" % (name))
+
+			new[name]={'timestamp': entry['timestamp'], 'offset': entry['offset'], 'vms': vms}
+
+		return new
+
 	def value(self):
-		msg = {'status': self.status, 'state': self.state}
+		msg = {'status': self.status, 'state': self.state, 'seq': self.seq, 'full': self.full}
 		return super(MessageMasterHB,self).value(msg)
 
 	def __repr__(self):
-		return str("<MessageMasterHB from "+ self.node +" : "+str(self.status)+">")
+		return str("<MessageMasterHB from "+ self.node +" #"+str(self.seq)+" : "+str(self.status)+">")
 
 class MessageVoteRequest(Message):
 	
@@ -179,6 +245,7 @@ class MessageHelper(object):
 		"voterequest" : MessageVoteRequest,
 		"voteresponse" : MessageVoteResponse,
 	}
+	types = dict([ (value, key) for (key, value) in map.items() ])	# Reverse map for Message.type()
 
 	@staticmethod
 	def get(msg, host):
@@ -64,15 +64,10 @@ class Metrics:
 		Return a dict with complete dom records from API.
 		Only usefull for internal use.
 
-		Result will be cached for 5 seconds, unless 'nocache' is True.
+		Records are shared with the node (see RecordStore), and fetched
+		again if older than 5 seconds or if 'nocache' is True.
 		"""
-
-		def _get_dom_records():
-			dom_recs = self.server.xenapi.VM.get_all_records()
-			log.debug("[API]", self.node.get_hostname(), "dom_recs=", dom_recs)
-			return dom_recs
-
-		return self._cache.cache(5, nocache, _get_dom_records)
+		return self.node.get_vm_records(nocache)
 
 	def get_host_record(self, nocache=False):
 		"""
@@ -179,18 +174,17 @@ class Metrics:
 		Unit: Requests
 		"""
 		def _get_vms_disk_io():
-			dom_recs = self.get_dom_records(nocache)
+			dom_recs = [ dom_rec for dom_rec in self.get_dom_records(nocache).values() 
+				if dom_rec['power_state'] != "Halted" ] # Discard non instantiated vm
 
-			io=dict()
-			for dom_rec in dom_recs.values():
-				if dom_rec['power_state'] == "Halted":
-					continue # Discard non instantiated vm
+			# Fetch counters of all vms at once
+			vbd=self.node.get_counters([], [ dom_rec['domid'] for dom_rec in dom_recs ]).get('vbd', dict())
 
+			io=dict()
+			for dom_rec in dom_recs:
 				# We use *_req and report Requests instead of Bytes because *_sect values are not self-consistent
-				io_read=[ int(val) for val in \
-					self.node.run("cat /sys/bus/xen-backend/devices/vbd-" + dom_rec['domid'] + "-*/statistics/rd_req 2>/dev/null || true").readlines() ]
-				io_write=[ int(val) for val in \
-					self.node.run("cat /sys/bus/xen-backend/devices/vbd-" + dom_rec['domid'] + "-*/statistics/wr_req 2>/dev/null || true").readlines() ]
+				io_read=[ int(val) for val in vbd[dom_rec['domid']]['rd_req'] ]
+				io_write=[ int(val) for val in vbd[dom_rec['domid']]['wr_req'] ]
 				io[dom_rec['name_label']]={ 'Read': sum(io_read), 'Write': sum(io_write) }
 			return io
 
@@ -235,14 +229,14 @@ class Metrics:
 	def get_vms_net_io(self, nocache=False):
 		"""
 		Return a dict with network IO stats for all runing VMs. Unit: Bytes
-		Result will be cached for 5 seconds, unless 'nocache' is True.
+		Result is derived from the node's shared records (see RecordStore),
+		fetched again if older than 5 seconds or if 'nocache' is True.
 		"""
 
 		def _get_vms_net_io():
 			dom_recs = self.get_dom_records(nocache)
 
-			vif_metrics_recs = self.server.xenapi.VIF_metrics.get_all_records()
-			log.debug("[API]", self.node.get_hostname(), "vif_metrics_recs=", vif_metrics_recs)
+			vif_metrics_recs = self.node.records.get('VIF_metrics')
 
 			vifs_doms_metrics=dict()
 			for dom_rec in dom_recs.values():
@@ -259,15 +253,31 @@ class Metrics:
 
 			return vifs_doms_metrics
 
-		return self._cache.cache(5, nocache, _get_vms_net_io)
+		return self.node.records.view('vms_net_io', nocache, _get_vms_net_io)
+
+	def get_host_counters(self, nocache=False):
+		"""
+		Return a dict with the raw kernel counters of the host, see Node.get_counters().
+		All counters are fetched at once, and cached for 5 seconds, unless 'nocache' is True.
+		Only usefull for internal use.
+		"""
+
+		def _get_host_counters():
+			return self.node.get_counters()
+
+		return self._cache.cache(5, nocache, _get_host_counters)
 
-	def get_host_net_io(self):
-		"""Return a dict with network IO stats for the host. Unit: Bytes"""
-		bridges=self.node.get_bridges()
-		vlans=self.node.get_vlans()
+	def get_host_net_io(self, nocache=False):
+		"""
+		Return a dict with network IO stats for the host. Unit: Bytes
+		Result will be cached for 5 seconds, unless 'nocache' is True.
+		"""
+		counters=self.get_host_counters(nocache)
+		bridges=self.node._parse_bridges(counters['bridges'])
+		vlans=self.node._parse_vlans(counters['vlans'])
 		io= { 'bridges': dict(), 'vlans': dict() }
 
-		for line in self.node.run('cat /proc/net/dev').readlines():
+		for line in counters['net_dev']:
 			stats=line.replace(':',' ').strip().split()
 			if stats[0] in bridges:
 				io['bridges'][stats[0]]= {'Rx': stats[1], 'Tx': stats[9]}
@@ -275,15 +285,18 @@ class Metrics:
 				io['vlans'][stats[0]]= {'Rx': stats[1], 'Tx': stats[9]}
 		return io
 
-	def get_host_pvs_io(self):
-		"""Return a dict with PVs' bandwidth stats for the host. Unit: Bytes"""
+	def get_host_pvs_io(self, nocache=False):
+		"""
+		Return a dict with PVs' bandwidth stats for the host. Unit: Bytes
+		Result will be cached for 5 seconds, unless 'nocache' is True.
+		"""
 		io=dict()
 		sector_size=512 # This is a world constant (for now)
 
 		# Get list of unique pvs from vgs_map
 		devices=list(set([ y for x in self.node.get_vgs_map().values() for y in x ]))
 
-		for line in self.node.run('cat /proc/diskstats').readlines():
+		for line in self.get_host_counters(nocache)['diskstats']:
 			stats=line.strip().split()
 			if stats[2] in devices:
 				"""
@@ -358,11 +371,7 @@ class Metrics:
 		Return the number of used irq on this node. Unit: integer
 		Result will be cached for 5 seconds, unless 'nocache' is True.
 		"""
-
-		def _get_used_irq():
-			return int(self.node.run('grep Dynamic /proc/interrupts | wc -l').read())
-
-		return self._cache.cache(5, nocache, _get_used_irq)
+		return len(self.get_host_counters(nocache)['interrupts'])
 
 	def get_free_ram(self, nocache=False):
 		"""Return the amount of free ram of this node. Unit: MB"""
@@ -413,6 +422,25 @@ class Metrics:
 
 		return self._cache.cache(5, nocache, _get_available_ram)
 
+	def get_summary(self, nocache=False):
+		"""
+		Return a compact dict of this node's metrics, sent with slave heartbeats:
+		free and available RAM (MB), number of used IRQ, and the RAM (MB) and CPU
+		usage (percentage) of each running VM.
+		"""
+		cpu=self.get_vms_cpu_usage(nocache)
+
+		vms=dict()
+		for vm in self.node.get_vms(nocache):
+			vms[vm.name]={'ram': vm.get_ram(), 'cpu': cpu.get(vm.name, 0)}
+
+		return {
+			'free_ram': self.get_free_ram(nocache),
+			'available_ram': self.get_available_ram(nocache),
+			'used_irq': self.get_used_irq(nocache),
+			'vms': vms,
+		}
+
 	def get_load(self):
 		"""Return the load of this node.
 
@@ -431,20 +459,12 @@ class Metrics:
 		return (irq_load<ram_load and ram_load or irq_load)
 
 	def get_lvs_size(self, lvs):
-		"""Return a dict containnig size of each specified LVs. Unit: kB"""
+		"""Return a dict containnig size of each specified LVs, from the node's LVM cache (see LvmCache). Unit: kB"""
 
 		if len(lvs)<=0:
 			return dict() # empty return if no LV given 
 
-		size=dict()
-		for line in self.node.run("lvs -o vg_name,lv_name,lv_size --noheading --units k --nosuffix " + " ".join(lvs)).readlines():
-			infos=line.strip().split()
-			lv_name="/dev/" + infos[0] + "/" + infos[1]
-
-			if lv_name in lvs:  # In case of output error, don't feed with scrappy data
-				size[lv_name]=float(infos[2])
-
-		return size
+		return self.node.lvm.get_sizes(lvs)
 
 # vim: ts=4:sw=4:ai
 
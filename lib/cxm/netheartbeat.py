@@ -23,26 +23,37 @@
 #
 ###########################################################################
 
-import simplejson as json
 from twisted.internet.protocol import DatagramProtocol
 from twisted.internet import reactor, task, defer
 from twisted.internet.defer import Deferred
-import socket, zlib
+import socket
 import logs as log
 
 from dnscache import DNSCache
 from agent import Agent
+import codec
 import core
 
 
-# Not in configuration file because need to be consistent over all nodes
-USE_ZLIB=True
+# Transports of messages sent to all nodes, see HB_TRANSPORT
+TRANSPORTS = ['broadcast', 'multicast', 'unicast']
 
 class UDPSender(DatagramProtocol):
-	def __init__(self, onStart, getMsg, dest=None):
+
+	"""
+	This class send a message to the given node, or to all nodes if dest is None.
+	Messages to all nodes are sent according to HB_TRANSPORT: broadcast on the
+	subnet, to the multicast group MCAST_GROUP, or unicast to each node given
+	by getMembers() (ALLOWED_NODES if there is none).
+	The port must be opened with openSender().
+	"""
+
+	def __init__(self, onStart, getMsg, dest=None, getMembers=None):
 		self.d_onStart = onStart		# Deferred fired when protocol is up
 		self.c_getMsg = getMsg		# Callback called every sendMessage()
+		self.c_getMembers = getMembers	# Callback giving the nodes' list, for unicast
 		self.dest = dest
+		self.codec = codec.get_codec()
 
 	def startProtocol(self):
 		def setIp(result):
@@ -52,57 +63,97 @@ class UDPSender(DatagramProtocol):
 		# Set IP TOS field to Minimize-Delay
 		self.transport.socket.setsockopt(socket.IPPROTO_IP, socket.IP_TOS, 0x10)
 
-		if self.dest is None:
+		if self.dest is not None:
+			d=DNSCache.getInstance().get_by_name(self.dest)
+		elif core.cfg['HB_TRANSPORT'] == "multicast":
+			self.transport.setTTL(core.cfg['MCAST_TTL'])
+			d=self.transport.setOutgoingInterface(DNSCache.getInstance().get_ifaddr())
+			d.addCallback(lambda _: core.cfg['MCAST_GROUP'])
+		elif core.cfg['HB_TRANSPORT'] == "unicast":
+			d=defer.succeed(None)	# See sendMessage()
+		else:
 			# Enable broadcast
 			self.transport.socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, True)
 			d=DNSCache.getInstance().get_bcast()
-		else:
-			d=DNSCache.getInstance().get_by_name(self.dest)
 		
 		d.addCallback(setIp)
 		d.addErrback(log.err)
 
-	def sendMessage(self):
-		data=json.dumps(self.c_getMsg().value(), separators=(',',':'))
+	def getMembers(self):
+		members=list()
+		if self.c_getMembers is not None:
+			members=self.c_getMembers()
+		if len(members) == 0:
+			members=core.cfg['ALLOWED_NODES']
+		return members
 
-		if USE_ZLIB:
-			crc=zlib.adler32(data)
-			zip=zlib.compress(data)
-			data=str(crc)+","+zip
+	def sendMessage(self):
+		def send(ip):
+			self.transport.write(data,(ip,core.cfg['UDP_PORT']))
 
-		self.transport.write(data,(self._ip,core.cfg['UDP_PORT']))
+		data=self.codec.encode(self.c_getMsg().value())
+		if self._ip is not None:
+			send(self._ip)
+		else:
+			# Unicast fan-out, names are already in cache after the first message
+			for name in self.getMembers():
+				d=DNSCache.getInstance().get_by_name(name)
+				d.addCallback(send)
+				d.addErrback(log.err)
 
 class UDPListener(DatagramProtocol):
     def __init__(self, onReceive):
         self.c_onReceive = onReceive 
 
+    def startProtocol(self):
+		if core.cfg['HB_TRANSPORT'] == "multicast":
+			d=self.transport.joinGroup(core.cfg['MCAST_GROUP'], DNSCache.getInstance().get_ifaddr())
+			d.addErrback(log.err)
+
     def datagramReceived(self, data, (host, port)):
 		try:
-			if USE_ZLIB:
-				(crc,zip)=data.split(',',1)
-				data=zlib.decompress(zip)
-				if int(crc) != zlib.adler32(data):
-					raise Exception("Data from %s is corrupted." % (host))
-
-			msg=json.loads(data)
+			# Accept all formats, for rolling upgrades of WIRE_FORMAT
+			msg=codec.decode(data)
 		except Exception, e:
-			log.warn("Error parsing message: %s" % (e))
+			log.warn("Error parsing message from %s: %s" % (host, e))
 		else:
 			self.c_onReceive(msg,host)
 
+def checkTransport():
+	if core.cfg['HB_TRANSPORT'] not in TRANSPORTS:
+		raise TransportError("Unknown transport %s" % (core.cfg['HB_TRANSPORT']))
+
+def openSender(proto):
+	"""Open a port for the given UDPSender, according to HB_TRANSPORT, and return it."""
+	checkTransport()
+	if core.cfg['HB_TRANSPORT'] == "multicast":
+		return reactor.listenMulticast(0, proto)
+	else:
+		return reactor.listenUDP(0, proto)
+
+def openListener(onReceive):
+	"""Start listening for cluster's messages, according to HB_TRANSPORT, and return the port."""
+	checkTransport()
+	if core.cfg['HB_TRANSPORT'] == "multicast":
+		return reactor.listenMulticast(core.cfg['UDP_PORT'], UDPListener(onReceive), listenMultiple=True)
+	else:
+		return reactor.listenUDP(core.cfg['UDP_PORT'], UDPListener(onReceive))
+
+
 class NetHeartbeat(object):
 
 	MAX_RETRY = 2  # Maximum number of retry before panic mode
 
-	def __init__(self, getMsg, dest = None):
+	def __init__(self, getMsg, dest = None, getMembers = None):
 		self.c_getMsg = getMsg
+		self.c_getMembers = getMembers
 		self.dest = dest
 
 	def start(self):
 		self.retry=0
 		d = Deferred()
 		d.addCallback(self._run)
-		self._port = reactor.listenUDP(0, UDPSender(d, self.c_getMsg, self.dest))
+		self._port = openSender(UDPSender(d, self.c_getMsg, self.dest, self.c_getMembers))
 
 	def forcePulse(self):
 		try:
@@ -115,7 +166,7 @@ class NetHeartbeat(object):
 	def _run(self, result):
 		self._proto = result
 		self._call = task.LoopingCall(self._proto.sendMessage)
-		self._call.start(1).addErrback(self._sendError)
+		self._call.start(core.cfg['HB_INTERVAL']).addErrback(self._sendError)
 
 	def _sendError(self, reason):
 		# Log all stacktrace to view the origin of this error
@@ -143,4 +194,9 @@ class NetHeartbeat(object):
 			return defer.succeed(None)
 
 
+class TransportError(Exception):
+	"""This class is used to raise errors relatives to the transport of messages."""
+	pass
+
+
 # vim: ts=4:sw=4:ai
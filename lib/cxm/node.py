@@ -25,22 +25,55 @@
 
 """This module hold the Node class."""
 
-import paramiko, re, time, popen2, socket, StringIO, sys, os
+import paramiko, re, time, subprocess, select, signal, socket, StringIO, sys, os, glob, threading, xmlrpclib
 from xen.xm import XenAPI
 from xen.xm import main
-from xen.util.xmlrpcclient import ServerProxy
+from xen.util.xmlrpcclient import ServerProxy, UnixTransport
 from sets import Set
 
 from metrics import Metrics
+from vmwatcher import VMWatcher
+from recordstore import RecordStore
+from lvmcache import LvmCache
 from vm import VM
 import logs as log
 import core, datacache
 
+# xen.xm.main use module globals for the server to talk to, so xm commands of
+# concurrent threads (see StartScheduler) have to be serialized.
+_xm_lock=threading.Lock()
+
+
+def _timeout_transport(base, timeout):
+	"""Return an instance of the given xmlrpclib transport class, with a timeout on its sockets."""
+
+	class TimeoutTransport(base):
+		def make_connection(self, host):
+			conn=base.make_connection(self, host)
+			http=getattr(conn, '_conn', conn) # httplib.HTTP wraps a HTTPConnection
+			if not getattr(http, 'cxm_timeout', False):
+				connect=http.connect
+				def timed_connect():
+					connect()
+					http.sock.settimeout(timeout)
+				http.connect=timed_connect
+				http.cxm_timeout=True
+			return conn
+
+	return TimeoutTransport()
+
 
 class Node:
 	
 	"""This class is used to perform action on a node within the xen cluster."""
 
+	BATCH_MARKER = "@@cxm-batch:"	# Delimiter of commands' output in run_batch()
+	SNAPSHOT_ITEMS = ('bridges', 'autostart', 'cfg', 'lvs', 'vms', 'ram')	# See get_snapshot()
+	COUNTERS_ITEMS = ('bridges', 'vlans', 'net_dev', 'diskstats', 'interrupts')	# See get_counters()
+	READ_SIZE = 65536		# Read commands' output by chunks of 64k
+	STDERR_MAX = 65536		# Keep only the last 64k of commands' stderr
+	POLL_DELAY = 0.1		# Max delay between two checks of a SSH channel's status
+
 	def __init__(self,hostname):
 		"""Instanciate a Node object.
 
@@ -50,7 +83,7 @@ class Node:
 		log.info("Connecting to", hostname, "...")
 		self.hostname=hostname
 
-		# Open SSH channel (localhost use popen2)
+		# Open SSH channel (localhost use subprocess)
 		if not self.is_local_node():
 			self.ssh = paramiko.SSHClient()
 			self.ssh.load_system_host_keys()
@@ -58,14 +91,7 @@ class Node:
 			self.ssh.connect(hostname,22,'root', timeout=2)
 
 		# Open Xen-API Session 
-		if self.is_local_node():
-			# Use unix socket on localhost
-			self.server = XenAPI.Session("httpu:///var/run/xend/xen-api.sock")
-			log.debug("[API]","Using unix socket.")
-		else:
-			self.server = XenAPI.Session("http://"+hostname+":9363")
-			log.debug("[API]","Using tcp socket.")
-		self.server.login_with_password("root", "")
+		self.server = self.open_session()
 
 		# Prepare connection with legacy API
 		self.__legacy_server=None
@@ -77,13 +103,75 @@ class Node:
 		self._cache=datacache.DataCache()
 		self._last_refresh=0
 
+		# Shared XenAPI records, see RecordStore
+		self.records=RecordStore(self)
+
+		# Shared LVM state, see LvmCache
+		self.lvm=LvmCache(self)
+
+		# Event-driven VM records, see watch_events()
+		self.watcher=None
+
 	@staticmethod
 	def getLocalInstance():
 		"""Instanciate and return the Node object representing the local machine."""
 		return Node(socket.gethostname())
 
+	def open_session(self, timeout=None):
+		"""
+		Open and return a new logged-in Xen-API session to the node.
+		If a timeout is given (in seconds), calls of the session raise socket.timeout when xend doesn't answer in time.
+		"""
+		if self.is_local_node():
+			# Use unix socket on localhost
+			if timeout is None:
+				server = XenAPI.Session("httpu:///var/run/xend/xen-api.sock")
+			else:
+				server = XenAPI.Session("http:///var/run/xend/xen-api.sock", _timeout_transport(UnixTransport, timeout))
+			log.debug("[API]","Using unix socket.")
+		else:
+			if timeout is None:
+				server = XenAPI.Session("http://"+self.hostname+":9363")
+			else:
+				server = XenAPI.Session("http://"+self.hostname+":9363", _timeout_transport(xmlrpclib.Transport, timeout))
+			log.debug("[API]","Using tcp socket.")
+		server.login_with_password("root", "")
+		return server
+
+	def watch_events(self):
+		"""
+		Keep VM records up-to-date with XenAPI events, instead of polling them.
+		Once the watcher is synced, get_vms(), get_vms_names() and metrics read
+		their records from it, whatever the 'nocache' value.
+		"""
+		if self.watcher is None:
+			self.watcher=VMWatcher(self)
+		self.watcher.start()
+
+	def get_vm_records(self, nocache=False):
+		"""
+		Return a dict with all VM records, like VM.get_all_records().
+		Records are shared with others accessors, see RecordStore.
+		"""
+		return self.records.get('VM', nocache)
+
+	def get_vm_metrics_records(self, nocache=False):
+		"""
+		Return a dict with all VM_metrics records, like VM_metrics.get_all_records().
+		Records are shared with others accessors, see RecordStore.
+		"""
+		return self.records.get('VM_metrics', nocache)
+
+	def is_watched(self):
+		"""Return True if VM records are kept up-to-date by the event watcher."""
+		return self.watcher is not None and self.watcher.is_ready()
+
 	def disconnect(self):
 		"""Close all connections."""
+		# Stop event watcher
+		if self.watcher is not None:
+			self.watcher.stop()
+
 		# Close SSH
 		try:
 			self.ssh.close()
@@ -96,6 +184,25 @@ class Node:
 		except:
 			pass
 
+	def is_alive(self):
+		"""
+		Return True if SSH and XenAPI connections are still usable.
+		This also act as a keepalive for both connections.
+		"""
+		try:
+			if not self.is_local_node():
+				transport=self.ssh.get_transport()
+				if transport is None or not transport.is_active():
+					return False
+				transport.send_ignore()
+
+			self.server.xenapi.session.get_this_host(self.server.getSession())
+		except Exception, e:
+			log.debug("[NODE]", self.hostname, "connection check failed:", e)
+			return False
+
+		return True
+
 	def get_legacy_server(self):
 		"""Return the legacy API socket."""
 		if self.__legacy_server is None:
@@ -116,73 +223,365 @@ class Node:
 	def __repr__(self):
 		return "<Node Instance: "+ self.hostname +">"
 
-	def run(self,cmd):
-		"""Execute command on this node via SSH (or via shell if this is the local node)."""
-# Does'nt work with LVM commands
-#		if(self.is_local_node()):
-#			p = subprocess.Popen(cmd,shell=True,stdout=subprocess.PIPE,stderr=subprocess.PIPE)
-#			msg=p.stderr.read()
-#			if(len(msg)>0):
-#				raise ClusterNodeError(self.hostname,ClusterNodeError.SHELL_ERROR,msg)
-#			return p.stdout
-#		else:
-		
-# Deadlock bug if cmd's output is bigger than 65k
-#       if(self.is_local_node()):
-#           if core.cfg['DEBUG'] : print "DEBUG SHELL: "+ self.get_hostname() +" -> "+cmd
-#           stdout, stdin, stderr = popen2.popen3(cmd,9300000)
-#           msg=stderr.read()
-#           if(len(msg)>0):
-#               raise ClusterNodeError(self.hostname,ClusterNodeError.SHELL_ERROR,msg)
+	def run(self, cmd, timeout=None):
+		"""
+		Execute command on this node via SSH (or via shell if this is the local node).
+		Return a file-like object with the whole stdout.
+
+		If 'timeout' (in seconds) is given, the command is killed when expired and
+		a ShellTimeoutError is raised. See run_iter() to not buffer the whole output.
+		"""
+		return self._run(self._fix_path(cmd), timeout)
+
+	def run_iter(self, cmd, timeout=None):
+		"""
+		Execute command on this node, like run(), but return an iterator on stdout's
+		lines, yielded as soon as they are received. 
+
+		Stdout and stderr are drained at the same time, so big outputs cannot deadlock,
+		and only the last STDERR_MAX bytes of stderr are kept for the error message.
+		A ShellError (or a SSHError) is raised at the end of the iteration if the command failed.
+
+		If the iteration is stopped before the end, the iterator's close() kills the command
+		(it's also called when the iterator is garbage-collected).
+		"""
+		return self._iter(self._fix_path(cmd), timeout)
 
+	def run_deferred(self, cmd, lineReceived=None, timeout=None):
+		"""
+		Execute command on this node, like run(), without blocking the reactor nor a thread.
+		Have to be called from the reactor thread.
+
+		Return a deferred fired with the list of stdout's lines, or with None if a
+		'lineReceived' callable is given: it will be called with each line as soon as
+		it is received.
+		"""
+		# Import here to avoid circular import
+		from execprotocol import spawnCommand
+
+		return spawnCommand(self, self._fix_path(cmd), lineReceived, timeout)
+
+	def _fix_path(self, cmd):
+		"""Return the given command prefixed with the PATH from configuration, if any."""
 		if(core.cfg['PATH']):
 			cmd=core.cfg['PATH'] + "/" + cmd
 
+		return cmd
+
+	def _run(self, cmd, timeout=None):
+		"""Execute the given command line as is. See run()."""
+		stdout=StringIO.StringIO()
+		for line in self._iter(cmd, timeout):
+			stdout.write(line)
+		stdout.seek(0)
+
+		return stdout
+
+	def _iter(self, cmd, timeout=None):
+		"""Execute the given command line as is. See run_iter()."""
 		if(self.is_local_node()):
-			log.debug("[SHL]", self.hostname, "->", cmd)
+			return self._iter_local(cmd, timeout)
+		else:
+			return self._iter_ssh(cmd, timeout)
 
-			# Create buffers
-			stdout=StringIO.StringIO()
-			stderr=StringIO.StringIO()
+	def _iter_local(self, cmd, timeout):
+		log.debug("[SHL]", self.hostname, "->", cmd)
 
-			proc=popen2.Popen3(cmd, True) # Run cmd
+		# close_fds is needed by LVM commands, which complain about leaked descriptors
+		# The command has its own process group, to be killed with all its children
+		proc=subprocess.Popen(cmd, shell=True, close_fds=True, preexec_fn=os.setpgrp,
+			stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
-			# Load output in the buffers and rewind them
-			try:
-				stdout.write(proc.fromchild.read())
-			except IOError:
-				pass # Discard broken pipe for backgrounded commands
-			stdout.seek(0)
+		def kill():
+			if proc.poll() is None:
+				try:
+					os.killpg(proc.pid, signal.SIGKILL)
+				except OSError:
+					pass # Already dead
+				proc.wait()
+
+		return CommandOutput(self._lines_local(proc, cmd, timeout, kill), kill)
+
+	def _lines_local(self, proc, cmd, timeout, kill):
+		stdout=proc.stdout.fileno()
+		stderr=proc.stderr.fileno()
+		pipes=[stdout, stderr]
+		deadline=None
+		if timeout is not None:
+			deadline=time.time()+timeout
+
+		buffer=""
+		msg=""
+		try:
+			while len(pipes) > 0:
+				wait=None
+				if deadline is not None:
+					wait=deadline-time.time()
+					if wait <= 0:
+						raise ShellTimeoutError(self.hostname, "Timeout after %ss: %s" % (timeout, cmd))
+
+				for fd in select.select(pipes, [], [], wait)[0]:
+					data=os.read(fd, Node.READ_SIZE)
+					if len(data) == 0:
+						pipes.remove(fd) # EOF
+					elif fd == stderr:
+						msg=(msg+data)[-Node.STDERR_MAX:]
+					else:
+						# Yield complete lines only
+						lines=(buffer+data).split('\n')
+						buffer=lines.pop()
+						for line in lines:
+							yield line+'\n'
+		except:
+			# Timeout, or iteration stopped by the caller (Python >= 2.5)
+			kill()
+			raise
+
+		if len(buffer) > 0:
+			yield buffer
+
+		exitcode=proc.wait()
+		if exitcode != 0:
+			raise ShellError(self.hostname, msg, exitcode)
 
+	def _iter_ssh(self, cmd, timeout):
+		log.debug("[SSH]", self.hostname, "->", cmd)
+
+		# Each command use its own channel, many channels can share the transport at the same time
+		chan=self.ssh.get_transport().open_session()
+		chan.exec_command(cmd)
+
+		return CommandOutput(self._lines_ssh(chan, cmd, timeout), chan.close)
+
+	def _lines_ssh(self, chan, cmd, timeout):
+		deadline=None
+		if timeout is not None:
+			deadline=time.time()+timeout
+
+		buffer=""
+		msg=""
+		try:
+			while True:
+				# Check exit status first: the last data may be received with it,
+				# and are in the buffers once the exit status is known.
+				exited=chan.exit_status_ready()
+
+				# Drain both buffers, stderr first to keep the window open
+				while chan.recv_stderr_ready():
+					msg=(msg+chan.recv_stderr(Node.READ_SIZE))[-Node.STDERR_MAX:]
+
+				if chan.recv_ready():
+					data=chan.recv(Node.READ_SIZE)
+					lines=(buffer+data).split('\n')
+					buffer=lines.pop()
+					for line in lines:
+						yield line+'\n'
+					continue
+
+				if exited:
+					break
+
+				wait=Node.POLL_DELAY
+				if deadline is not None:
+					if time.time() >= deadline:
+						raise SSHTimeoutError(self.hostname, "Timeout after %ss: %s" % (timeout, cmd))
+					wait=min(wait, deadline-time.time())
+
+				# Channel's fileno is readable when data are received
+				select.select([chan], [], [], wait)
+		except:
+			chan.close()
+			raise
+
+		if len(buffer) > 0:
+			yield buffer
+
+		exitcode=chan.recv_exit_status()
+		chan.close()
+		if exitcode != 0:
+			raise SSHError(self.hostname, msg, exitcode)
+
+	def run_batch(self, cmds):
+		"""
+		Execute many commands on this node with a single shell (or SSH) exec.
+
+		'cmds' is a list of (key, command) tuples. Commands are run in the given order
+		and the batch stops at the first failure, raising a ShellError (or a SSHError).
+		Return a dict with the list of output lines of each command, indexed by key.
+		If the output of a command doesn't end with a newline, its last line is kept
+		without newline, as with run().
+		"""
+		script=list()
+		for key, cmd in cmds:
+			script.append("echo '%s%s'" % (Node.BATCH_MARKER, key))
+			script.append("{ %s; }" % (self._fix_path(cmd)))
+
+		output=dict()
+		key=None
+		for line in self._run(" && ".join(script)).readlines():
+			pos=line.find(Node.BATCH_MARKER)
+			if pos >= 0:
+				if pos > 0 and key is not None:
+					# Marker glued to the last line of the previous command
+					output[key].append(line[:pos])
+				key=line[pos+len(Node.BATCH_MARKER):].strip()
+				output[key]=list()
+			elif key is not None:
+				output[key].append(line)
+
+		return output
+
+	def get_snapshot(self, items=None):
+		"""
+		Return a dict with a snapshot of this node's state.
+		All shell probes are done with a single exec, see run_batch().
+
+		'items' is the list of wanted entries, all by default :
+		  - bridges: list of bridges (see get_bridges())
+		  - autostart: list of autostart links
+		  - cfg: list of possible vm names (see get_possible_vm_names())
+		  - lvs: dict with the attributes of each logical volume (see get_lvs_attr()),
+		    the LVM cache is fed at the same time (see LvmCache)
+		  - vms: list of running vm names (see get_vms_names())
+		  - ram: dict with the free, used and total ram (see Metrics.get_ram_infos())
+		"""
+		if items is None:
+			items=Node.SNAPSHOT_ITEMS
+
+		probes=list()
+		if 'bridges' in items:
+			probes.append(('bridges', "find /sys/class/net/ -maxdepth 2 -name bridge"))
+		if 'autostart' in items:
+			probes.append(('autostart', "ls /etc/xen/auto/"))
+		if 'cfg' in items:
+			probes.append(('cfg', "ls %s/* || true" % (core.cfg['VMCONF_DIR'])))
+		if 'lvs' in items:
+			probes.append(('lvs', LvmCache.COMMAND))
+
+		snapshot=dict()
+		if len(probes)>0:
+			output=self.run_batch(probes)
+
+			if 'bridges' in output:
+				snapshot['bridges']=self._parse_bridges(output['bridges'])
+			if 'autostart' in output:
+				snapshot['autostart']=[ link.strip() for link in output['autostart'] ]
+			if 'cfg' in output:
+				snapshot['cfg']=self._parse_vm_names(output['cfg'])
+			if 'lvs' in output:
+				self.lvm.feed(output['lvs'])
+				snapshot['lvs']=self.lvm.get_attrs()
+
+		if 'vms' in items:
+			snapshot['vms']=self.get_vms_names(True)
+		if 'ram' in items:
+			snapshot['ram']=self.get_metrics().get_ram_infos(True)
+
+		log.debug("[NODE]", self.hostname, "snapshot=", snapshot)
+		return snapshot
+
+	def get_counters(self, items=None, domids=[]):
+		"""
+		Return a dict with the raw lines of kernel counters of this node.
+		On the local node, files are read in-process without forking any
+		process. Otherwise, all counters are fetched with a single exec, see run_batch().
+
+		'items' is the list of wanted entries, all by default :
+		  - bridges: /sys/class/net/<bridge>/bridge paths (see get_bridges())
+		  - vlans: content of /proc/net/vlan/config, without headers
+		  - net_dev: content of /proc/net/dev
+		  - diskstats: content of /proc/diskstats
+		  - interrupts: lines of /proc/interrupts with dynamic irqs
+		If 'domids' is given, the 'vbd' entry is a dict with the rd_req and wr_req
+		lines of all block devices of each given domain.
+		"""
+		if items is None:
+			items=Node.COUNTERS_ITEMS
+
+		if self.is_local_fs():
+			return self._get_local_counters(items, domids)
+
+		probes=list()
+		if 'bridges' in items:
+			probes.append(('bridges', "find /sys/class/net/ -maxdepth 2 -name bridge"))
+		if 'vlans' in items:
+			probes.append(('vlans', "cat /proc/net/vlan/config | tail -n +3"))
+		if 'net_dev' in items:
+			probes.append(('net_dev', "cat /proc/net/dev"))
+		if 'diskstats' in items:
+			probes.append(('diskstats', "cat /proc/diskstats"))
+		if 'interrupts' in items:
+			probes.append(('interrupts', "grep Dynamic /proc/interrupts || true"))
+		for domid in domids:
+			for stat in ('rd_req', 'wr_req'):
+				probes.append(("vbd-%s-%s" % (domid, stat), 
+					"cat /sys/bus/xen-backend/devices/vbd-%s-*/statistics/%s 2>/dev/null || true" % (domid, stat)))
+
+		counters=dict()
+		if len(probes)>0:
+			output=self.run_batch(probes)
+			for item in items:
+				if item in output:
+					counters[item]=output[item]
+
+		if len(domids)>0:
+			counters['vbd']=dict()
+			for domid in domids:
+				counters['vbd'][domid]={
+					'rd_req': output["vbd-%s-rd_req" % (domid)],
+					'wr_req': output["vbd-%s-wr_req" % (domid)],
+				}
+
+		return counters
+
+	def _get_local_counters(self, items, domids):
+		"""Local version of get_counters(), reading files in-process."""
+		def read(path):
+			f=open(path)
+			try:
+				return f.readlines()
+			finally:
+				f.close()
+
+		counters=dict()
+		if 'bridges' in items:
+			counters['bridges']=glob.glob("/sys/class/net/*/bridge")
+		if 'vlans' in items:
 			try:
-				stderr.write(proc.childerr.read())
+				counters['vlans']=read("/proc/net/vlan/config")[2:]
 			except IOError:
-				pass
-			stderr.seek(0)
-
-			exitcode=proc.wait()
-			if exitcode != 0:
-				msg=stderr.read()
-				raise ShellError(self.hostname,msg, exitcode >> 8)
-		else:
-			log.debug("[SSH]", self.hostname, "->", cmd)
-			stdin, stdout, stderr = self.ssh.exec_command(cmd)
-			# Lock bug workaround : Check exit status before trying to read stderr
-			# Because sometimes, when stdout is big (maybe >65k ?), strderr.read() hand on
-			# a thread's deadlock if stderr is readed before stdout...
-			exitcode=stderr.channel.recv_exit_status()
-			if exitcode != 0:
-				stderr.channel.settimeout(3)
-				try:
-					msg=stderr.read()
-					raise SSHError(self.hostname, msg, exitcode)
-				except socket.timeout:
-					raise SSHError(self.hostname, "Timeout reading stderr !", exitcode)
-		return stdout
+				counters['vlans']=list() # 8021q module not loaded
+		if 'net_dev' in items:
+			counters['net_dev']=read("/proc/net/dev")
+		if 'diskstats' in items:
+			counters['diskstats']=read("/proc/diskstats")
+		if 'interrupts' in items:
+			counters['interrupts']=[ line for line in read("/proc/interrupts") if "Dynamic" in line ]
+
+		if len(domids)>0:
+			counters['vbd']=dict()
+			for domid in domids:
+				counters['vbd'][domid]=dict()
+				for stat in ('rd_req', 'wr_req'):
+					counters['vbd'][domid][stat]=list()
+					for path in glob.glob("/sys/bus/xen-backend/devices/vbd-%s-*/statistics/%s" % (domid, stat)):
+						try:
+							counters['vbd'][domid][stat].extend(read(path))
+						except IOError:
+							pass # Device removed during the read
+
+		return counters
 
 	def is_local_node(self):
 		"""Return True if this node is the local node."""
 		return socket.gethostname()==self.hostname
+
+	def is_local_fs(self):
+		"""
+		Return True if system files of this node can be read in-process.
+		This is not the case when a PATH is set, as external binaries are overrided.
+		"""
+		return self.is_local_node() and not core.cfg['PATH']
 		
 	def is_vm_started(self, vmname):
 		"""Return True if the specified vm is started on this node."""
@@ -213,17 +612,17 @@ class Node:
 		# brctl show | perl -ne 'next if(/bridge/); print "$1\n" if(/^(\w+)\s/)'
 		# ou
 		# find /sys/class/net/ -maxdepth 2 -name bridge  |  awk -F/ '{ print $5 }'
-		bridges=list()
-		for line in self.run("find /sys/class/net/ -maxdepth 2 -name bridge").readlines():
-			bridges.append(line.split('/')[4])
-		return bridges
+		return self._parse_bridges(self.get_counters(['bridges'])['bridges'])
+
+	def _parse_bridges(self, lines):
+		return [ line.split('/')[4] for line in lines ]
 
 	def get_vlans(self):
 		"""Return the list of vlans configured on this node."""
-		vlans=list()
-		for line in self.run("cat /proc/net/vlan/config | tail -n +3").readlines():
-			vlans.append(line.split()[0])
-		return vlans
+		return self._parse_vlans(self.get_counters(['vlans'])['vlans'])
+
+	def _parse_vlans(self, lines):
+		return [ line.split()[0] for line in lines ]
 
 	def get_vm_started(self, nocache=False):
 		"""
@@ -234,12 +633,8 @@ class Node:
 		return len(self.get_vms_names(nocache))
 
 	def get_vgs(self,lvs):
-		"""Return the list of volumes groups associated with the given logicals volumes."""
-		vgs=list()
-		for line in self.run("lvdisplay -c " + " ".join(lvs)).readlines():
-			vgs.append(line.split(':')[1])
-
-		return list(set(vgs))	# Delete duplicate entries
+		"""Return the list of volumes groups associated with the given logicals volumes (see LvmCache)."""
+		return self.lvm.get_vgs(lvs)
 	
 	def get_vgs_map(self, nocache=False):
 		"""
@@ -268,20 +663,29 @@ class Node:
 		if not core.cfg['NOREFRESH']:
 			if self._last_refresh+GRACE_TIME < int(time.time()):
 				self.run("lvchange --refresh " + " ".join(vgs))
+				self.lvm.invalidate()
 				self._last_refresh=int(time.time())
 
-	def deactivate_lv(self,vmname):
+	def deactivate_lv(self,vmname,lvs=None,vgs=None):
 		"""Deactivate the logicals volumes of the specified VM on this node.
 
+		'lvs' and 'vgs' are the optional LVs of the VM and their VGs, to avoid
+		reading the VM's configuration and querying LVM again (see XenCluster.activate_vm()).
 		Raise a RunningVmError if the VM is running.
 		"""
 		if(self.is_vm_started(vmname)):
 			raise RunningVmError(self.hostname,vmname) 
 		else:
-			lvs=VM(vmname).get_lvs()
+			if lvs is None:
+				lvs=VM(vmname).get_lvs()
 			if lvs:
-				self.refresh_lvm(self.get_vgs(lvs))
-				self.run("lvchange -aln " + " ".join(lvs))
+				if vgs is None:
+					vgs=self.get_vgs(lvs)
+				self.refresh_lvm(vgs)
+				try:
+					self.run("lvchange -aln " + " ".join(lvs))
+				finally:
+					self.lvm.invalidate()
 
 	def deactivate_all_lv(self):
 		"""Deactivate all the logicals volumes used by stopped VM on this node."""
@@ -289,12 +693,21 @@ class Node:
 			if not self.is_vm_started(vm):
 				self.deactivate_lv(vm)
 
-	def activate_lv(self,vmname):
-		"""Activate the logicals volumes of the specified VM on this node."""
-		lvs=VM(vmname).get_lvs()
+	def activate_lv(self,vmname,lvs=None,vgs=None):
+		"""Activate the logicals volumes of the specified VM on this node.
+
+		'lvs' and 'vgs' are optional, see deactivate_lv().
+		"""
+		if lvs is None:
+			lvs=VM(vmname).get_lvs()
 		if lvs:
-			self.refresh_lvm(self.get_vgs(lvs))
-			self.run("lvchange -aly " + " ".join(lvs))
+			if vgs is None:
+				vgs=self.get_vgs(lvs)
+			self.refresh_lvm(vgs)
+			try:
+				self.run("lvchange -aly " + " ".join(lvs))
+			finally:
+				self.lvm.invalidate()
 		
 	def start(self, vmname):
 		"""Start the specified VM on this node.
@@ -305,9 +718,15 @@ class Node:
 		args = [core.cfg['VMCONF_DIR'] + vmname]
 
 		# Use Legacy XMLRPC because Xen-API is sometimes buggy
-		main.server=self.get_legacy_server()
-		main.serverType=main.SERVER_LEGACY_XMLRPC
-		main.xm_importcommand("create" , args)
+		server=self.get_legacy_server()
+		_xm_lock.acquire()
+		try:
+			main.server=server
+			main.serverType=main.SERVER_LEGACY_XMLRPC
+			main.xm_importcommand("create" , args)
+		finally:
+			_xm_lock.release()
+		self.records.invalidate()
 
 		# Stupid bug : does'nt work with a bridge named xenbr2010 ...
 		#args.append('--skipdtd') # Because file /usr/share/xen/create.dtd is missing
@@ -343,6 +762,8 @@ class Node:
 		except IndexError:
 			raise NotRunningVmError(self.get_hostname(),vmname)
 		self.server.xenapi.VM.migrate(vm,dest_node.get_hostname(),True,{'port':0,'node':-1,'ssl':None})
+		self.records.invalidate()
+		dest_node.records.invalidate()
 
 	def enable_vm_autostart(self, vmname):
 		"""Create the autostart link for the specified vm."""
@@ -367,6 +788,7 @@ class Node:
 			self.server.xenapi.VM.hard_shutdown(vm)
 		else:
 			self.server.xenapi.VM.clean_shutdown(vm)
+		self.records.invalidate()
 
 		# Wait until VM is down
 		time.sleep(1)
@@ -413,15 +835,14 @@ class Node:
 	def get_vms(self, nocache=False):
 		"""
 		Return the list of VM instance for each running vm.
-		Result will be cached for 5 seconds, unless 'nocache' is True.
+		Result is derived from shared records (see RecordStore), fetched
+		again if older than 5 seconds or if 'nocache' is True.
 		"""
 
 		def _get_vms():
 			vms=list()
-			dom_recs = self.server.xenapi.VM.get_all_records()
-			dom_metrics_recs = self.server.xenapi.VM_metrics.get_all_records()
-			log.debug("[API]", self.hostname, "dom_recs=", dom_recs)
-			log.debug("[API]", self.hostname, "dom_metrics_recs=", dom_metrics_recs)
+			dom_recs = self.get_vm_records()
+			dom_metrics_recs = self.get_vm_metrics_records()
 
 			for dom_rec in dom_recs.values():
 				if dom_rec['name_label'] == "Domain-0":
@@ -438,18 +859,18 @@ class Node:
 
 			return vms
 
-		return self._cache.cache(5, nocache, _get_vms)
+		return self.records.view('vms', nocache, _get_vms)
 
 	def get_vms_names(self, nocache=False):
 		"""
 		Return the list of running vm.
-		Result will be cached for 5 seconds, unless 'nocache' is True.
+		Result is derived from shared records (see RecordStore), fetched
+		again if older than 5 seconds or if 'nocache' is True.
 		"""
 
 		def _get_vms_names():
 			vms_names=list()
-			dom_recs = self.server.xenapi.VM.get_all_records()
-			log.debug("[API]", self.hostname, "dom_recs=", dom_recs)
+			dom_recs = self.get_vm_records()
 
 			for dom_rec in dom_recs.values():
 				if dom_rec['name_label'] == "Domain-0":
@@ -464,7 +885,7 @@ class Node:
 
 			return vms_names
 
-		return self._cache.cache(5, nocache, _get_vms_names)
+		return self.records.view('vms_names', nocache, _get_vms_names)
 
 	def get_possible_vm_names(self, name=""): 
 		"""
@@ -473,59 +894,65 @@ class Node:
 		If there is no match, return an empty list.
 		"""
 
-		names=list()
-		for file in self.run("ls %s/%s* || true" % (core.cfg['VMCONF_DIR'], name)).readlines():
-			name=os.path.basename(file.strip()).rsplit(".cfg",1)[0]
-			names.append(name)
+		return self._parse_vm_names(self.run("ls %s/%s* || true" % (core.cfg['VMCONF_DIR'], name)).readlines())
+
+	def _parse_vm_names(self, lines):
+		return [ os.path.basename(file.strip()).rsplit(".cfg",1)[0] for file in lines ]
 
-		return names
+	def get_lvs_attr(self, nocache=False):
+		"""
+		Return a dict with the attributes of each logical volume on this node, indexed by path.
+		Result is read from the LVM cache (see LvmCache), unless 'nocache' is True.
+		"""
+		return self.lvm.get_attrs(nocache)
 
-	def check_missing_lvs(self):
+	def check_missing_lvs(self, snapshot=None):
 		"""
 		Perform a check on logicals volumes used by VMs. 
 		Return False if some are missing.
+
+		'snapshot' is an optional node's snapshot with 'cfg' and 'lvs' entries (see get_snapshot()).
 		"""
 		log.info("Checking for missing LV...")
 		safe=True
-		
+
+		if snapshot is None:
+			snapshot={ 'cfg': self.get_possible_vm_names(), 'lvs': self.get_lvs_attr() }
+
 		# Get all LVs used by VMs
 		used_lvs = list()
-		for vm in self.get_possible_vm_names():
+		for vm in snapshot['cfg']:
 			used_lvs.extend(VM(vm).get_lvs())
 
-		# Get all existent LVs
-		existent_lvs = list()
-		for line in self.run("lvs -o vg_name,name --noheading").readlines():
-			(vg, lv)=line.strip().split()
-			existent_lvs.append("/dev/"+vg+"/"+lv)
-		
 		# Compute missing LVs 
-		missing_lvs = list(Set(used_lvs) - Set(existent_lvs))
+		missing_lvs = list(Set(used_lvs) - Set(snapshot['lvs'].keys()))
 		if len(missing_lvs):
 			log.info(" ** WARNING : Found missing LV :\n\t", "\n\t".join(missing_lvs))
 			safe=False
 
 		return safe
 
-	def check_activated_lvs(self):
+	def check_activated_lvs(self, snapshot=None):
 		"""
 		Perform a sanity check of the LVM activation on this node.
 		Return False if there is some inconsistencies.
+
+		'snapshot' is an optional node's snapshot with 'cfg', 'lvs' and 'vms' entries (see get_snapshot()).
 		"""
 		log.info("Checking LV activation on", self.get_hostname(), "...")
 		safe=True
 
+		if snapshot is None:
+			snapshot={ 'cfg': self.get_possible_vm_names(), 'lvs': self.get_lvs_attr(),
+				'vms': [ vm.name for vm in self.get_vms() ] }
+
 		# Get all active LVs on the node
 		regex = re.compile('.{4}a.')
-		active_lvs = list()
-		for line in self.run("lvs -o vg_name,name,attr --noheading").readlines():
-			(vg, lv, attr)=line.strip().split()
-			if regex.search(attr) != None:
-				active_lvs.append("/dev/"+vg+"/"+lv)
+		active_lvs = [ lv for lv, attr in snapshot['lvs'].items() if regex.search(attr) != None ]
 
 		# Get all LVs used by VMs
 		used_lvs = list()
-		for vm in self.get_possible_vm_names():
+		for vm in snapshot['cfg']:
 			used_lvs.extend(VM(vm).get_lvs())
 
 		# Compute the intersection of the two lists (active and used LVs)
@@ -533,7 +960,7 @@ class Node:
 		log.debug("[NODE]", self.hostname, "active_and_used_lvs=", active_and_used_lvs)
 
 		# Get all LVs of running VM
-		running_lvs = [ lv for vm in self.get_vms() for lv in vm.get_lvs() ]
+		running_lvs = [ lv for vm in snapshot['vms'] for lv in VM(vm).get_lvs() ]
 		log.debug("[NODE]", self.hostname, "running_lvs=", running_lvs)
 
 		# Compute activated LVs without running vm
@@ -550,17 +977,25 @@ class Node:
 
 		return safe
 
-	def check_autostart(self):
-		"""Perform a sanity check of the autostart links."""
+	def check_autostart(self, snapshot=None):
+		"""
+		Perform a sanity check of the autostart links.
+
+		'snapshot' is an optional node's snapshot with 'autostart' and 'vms' entries (see get_snapshot()).
+		"""
 		log.info("Checking autostart links on", self.get_hostname(), "...")
 		safe=True
 
+		if snapshot is None:
+			snapshot={ 'autostart': [ link.strip() for link in self.run("ls /etc/xen/auto/").readlines() ],
+				'vms': [ vm.name for vm in self.get_vms() ] }
+
 		# Get all autostart links on the node
-		links = [ link.strip() for link in self.run("ls /etc/xen/auto/").readlines() ]
+		links = snapshot['autostart']
 		log.debug("[NODE]", self.hostname, "links=", links)
 
 		# Get all running VM
-		running_vms = [ vm.name for vm in self.get_vms() ]
+		running_vms = snapshot['vms']
 		log.debug("[NODE]", self.hostname, "running_vms=", running_vms)
 
 		# Compute running vm without autostart link
@@ -615,6 +1050,41 @@ class Node:
 	metrics = property(get_metrics)
 
 
+class CommandOutput(object):
+
+	"""
+	This class is the iterator on a command's output lines returned by Node.run_iter().
+
+	Python 2.4's generators cannot be closed, so the command is killed by close()
+	if the caller stops the iteration before the end.
+	"""
+
+	def __init__(self, lines, kill):
+		self._lines=lines
+		self._kill=kill		# Callable killing the command, None once finished
+
+	def __iter__(self):
+		return self
+
+	def next(self):
+		try:
+			return self._lines.next()
+		except:
+			# End of output, or error: the command is already finished
+			self._kill=None
+			raise
+
+	def close(self):
+		"""Kill the command if it's still running."""
+		kill=self._kill
+		self._kill=None
+		if kill is not None:
+			kill()
+
+	def __del__(self):
+		self.close()
+
+
 class ClusterNodeError(Exception):
 	"""This class is the main class for all errors relatives to the node."""
 
@@ -637,6 +1107,16 @@ class SSHError(ShellError):
 	"""This class is used to raise error when SSH exec fail."""
 	pass
 
+class ShellTimeoutError(ShellError):
+	"""This class is used to raise error when local exec is too long."""
+
+	def __init__(self, nodename, value):
+		ShellError.__init__(self, nodename, value, None)
+
+class SSHTimeoutError(ShellTimeoutError, SSHError):
+	"""This class is used to raise error when SSH exec is too long."""
+	pass
+
 class RunningVmError(ClusterNodeError):
 	"""This class is used when a VM is running and should'nt."""
 
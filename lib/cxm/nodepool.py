@@ -0,0 +1,195 @@
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2011-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+# $Id:$
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+
+"""This module hold the NodePool class."""
+
+from twisted.internet import threads, defer, task
+from node import Node
+import logs as log
+
+
+class NodePool(object):
+
+	"""
+	This class keep a pool of connected Node objects, so SSH handshakes and
+	XenAPI logins are not paid each time a XenCluster is instantiated.
+
+	All methods have to be called from the reactor thread.
+	"""
+
+	TM_KEEPALIVE = 30	# Check connections every 30 seconds
+
+	def __init__(self):
+		self._nodes=dict()			# hostname -> connected Node
+		self._pending=dict()		# hostname -> list of Deferred waiting for the connection
+		self._getMembers=None		# Callback returning the list of hostnames to keep warm
+		self._generation=0			# Incremented by clear(), see _connect()
+		self._discarded=dict()		# hostname -> number of discard(), see _connect()
+		self._keepalive=task.LoopingCall(self.keepalive)
+
+	def start(self, getMembers):
+		"""
+		Start the keepalive loop.
+
+		'getMembers' is a callable returning the list of hostnames that should be
+		kept connected. Others nodes are dropped from the pool.
+		"""
+		self._getMembers=getMembers
+		if not self._keepalive.running:
+			d=self._keepalive.start(NodePool.TM_KEEPALIVE)
+			d.addErrback(log.err)
+
+	def stop(self):
+		"""Stop the keepalive loop and close all pooled connections."""
+		if self._keepalive.running:
+			self._keepalive.stop()
+		self.clear()
+
+	def get(self, hostname):
+		"""
+		Return a deferred fired with the connected Node of the given hostname.
+		If there is no pooled connection, a new one is opened and kept in the pool.
+		"""
+		if hostname in self._nodes:
+			return defer.succeed(self._nodes[hostname])
+
+		d=defer.Deferred()
+		if hostname in self._pending:
+			# Connection already in progress, just wait for it
+			self._pending[hostname].append(d)
+		else:
+			self._pending[hostname]=[d]
+			self._connect(hostname)
+
+		return d
+
+	def get_hostnames(self):
+		"""Return the list of pooled hostnames."""
+		return self._nodes.keys()
+
+	def discard(self, hostname):
+		"""
+		Drop and disconnect the pooled Node of the given hostname, if any.
+		A connection in progress is closed as soon as it's opened, and its
+		waiters fail with a NodePoolError.
+		"""
+		self._discarded[hostname]=self._discarded.get(hostname, 0)+1
+		self._abort(hostname)
+		try:
+			node=self._nodes.pop(hostname)
+		except KeyError:
+			return
+
+		log.debugd("Dropping pooled connection to", hostname)
+		threads.deferToThread(node.disconnect).addErrback(log.err)
+
+	def clear(self):
+		"""Drop all pooled connections, and the connections in progress."""
+		self._generation+=1
+		for hostname in self._pending.keys():
+			self._abort(hostname)
+		for hostname in self._nodes.keys():
+			self.discard(hostname)
+
+	def _abort(self, hostname):
+		"""Fail the waiters of the connection in progress to the given hostname, if any."""
+		for d in self._pending.pop(hostname, []):
+			d.errback(NodePoolError("Connection to %s has been discarded" % (hostname)))
+
+	def _epoch(self, hostname):
+		return (self._generation, self._discarded.get(hostname, 0))
+
+	def _connect(self, hostname):
+		def connected(node, epoch):
+			if epoch != self._epoch(hostname):
+				# Pool cleared or node discarded meanwhile, waiters have been aborted
+				log.debugd("Closing outdated pooled connection to", hostname)
+				threads.deferToThread(node.disconnect).addErrback(log.err)
+				return
+
+			node.watch_events()
+			self._nodes[hostname]=node
+			for d in self._pending.pop(hostname):
+				d.callback(node)
+
+		def failed(reason, epoch):
+			if epoch != self._epoch(hostname):
+				return # Waiters have been aborted
+
+			for d in self._pending.pop(hostname):
+				d.errback(reason)
+
+		log.debugd("Opening pooled connection to", hostname)
+		epoch=self._epoch(hostname)
+		d=threads.deferToThread(Node, hostname)
+		d.addCallbacks(connected, failed, callbackArgs=(epoch,), errbackArgs=(epoch,))
+
+	def keepalive(self):
+		"""
+		Check all pooled connections, drop dead ones and open missing ones.
+
+		Return a deferred fired when all checks are done.
+		"""
+		def checked(alive, hostname, node):
+			# Pool may have changed during the check
+			if not alive and self._nodes.get(hostname) is node:
+				log.warn("Pooled connection to %s is dead, reconnecting." % (hostname))
+				self.discard(hostname)
+				return self.get(hostname)
+
+		def connectFailed(reason, hostname):
+			log.debugd("Cannot open pooled connection to", hostname, ":", reason.getErrorMessage())
+
+		if self._getMembers is None:
+			return defer.succeed(None)
+
+		members=self._getMembers()
+
+		# Drop nodes that have left the cluster
+		for hostname in self._nodes.keys():
+			if hostname not in members:
+				self.discard(hostname)
+
+		ds=list()
+		for hostname in members:
+			if hostname in self._nodes:
+				node=self._nodes[hostname]
+				d=threads.deferToThread(node.is_alive)
+				d.addCallback(checked, hostname, node)
+			else:
+				d=self.get(hostname)
+
+			d.addErrback(connectFailed, hostname)
+			ds.append(d)
+
+		return defer.DeferredList(ds)
+
+
+class NodePoolError(Exception):
+	"""This class is used to raise errors relatives to the pool of nodes."""
+	pass
+
+
+# vim: ts=4:sw=4:ai
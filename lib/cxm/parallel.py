@@ -0,0 +1,72 @@
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2010-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+# $Id:$
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+
+"""This module hold helpers to run blocking calls concurrently."""
+
+import threading
+
+
+def map_threads(func, items, max_workers=None):
+	"""
+	Call func(item) for each item of the given list, each call in its own thread,
+	and wait for all of them to finish.
+
+	This is meant for blocking code that is not running in the reactor (as
+	XenCluster's methods), otherwise use threads.deferToThread() and a DeferredList.
+
+	'max_workers' limit the number of simultaneous calls, there is no limit by default.
+	Return a list of (success, result) tuples, in the same order than items, like a
+	DeferredList: result is the returned value if success is True, or the raised
+	exception if success is False.
+	"""
+	results=[ None ] * len(items)
+	if max_workers is None:
+		max_workers=len(items)
+	slots=threading.Semaphore(max(max_workers, 1))
+
+	def worker(index, item):
+		try:
+			try:
+				results[index]=(True, func(item))
+			except Exception, e:
+				results[index]=(False, e)
+		finally:
+			slots.release()
+
+	workers=list()
+	for index, item in enumerate(items):
+		slots.acquire()
+		thread=threading.Thread(target=worker, args=(index, item))
+		thread.setDaemon(True)
+		thread.start()
+		workers.append(thread)
+
+	for thread in workers:
+		thread.join()
+
+	return results
+
+
+# vim: ts=4:sw=4:ai
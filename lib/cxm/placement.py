@@ -0,0 +1,283 @@
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2011-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+# $Id:$
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+
+"""
+This module hold the placement engine, used to choose the nodes of VMs to be
+started or migrated (see XenCluster.start_vms() and XenCluster.emergency_eject()).
+
+This is a multi-dimensional bin-packing problem: each VM has a demand and each
+node a free capacity in the dimensions given by DIMENSIONS. A VM fits on a node
+if its demand is lower than the free capacity in every dimension given by both.
+
+Example of usage :
+
+(placement, unplaced, free)=place(
+	[ ('vm1', {'ram': 1024, 'irq': 4, 'vms': 1}), ('vm2', {'ram': 512, 'irq': 3, 'vms': 1}) ],
+	[ ('node1', {'ram': 2048, 'irq': 100, 'vms': 10}), ('node2', {'ram': 512, 'irq': 100, 'vms': 10}) ])
+print placement['vm1']
+"""
+
+import core
+import logs as log
+
+MAX_IRQ = 1024			# Defined by RedHat patch (bz #442736) since 2.6.18
+
+DIMENSIONS = ['ram', 'irq', 'vms', 'vcpu']
+STRATEGIES = ['bfd', 'ffd', 'exact']
+
+EXACT_MAX_VMS = 12		# Bigger instances are solved with 'bfd'
+EXACT_MAX_STEPS = 200000	# Search budget of the exact solver, the best solution found is kept
+
+
+def fits(demand, free):
+	"""Return True if the given demand fits in the given free capacities."""
+	for dim, value in demand.items():
+		if dim in free and free[dim] < value:
+			return False
+	return True
+
+def consume(demand, free):
+	"""Remove the given demand from the given free capacities."""
+	for dim, value in demand.items():
+		if dim in free:
+			free[dim]-=value
+
+def _scales(nodes):
+	"""Return the scale of each dimension: the biggest free capacity of nodes."""
+	scales=dict()
+	for name, free in nodes:
+		for dim, value in free.items():
+			scales[dim]=max(scales.get(dim, 0), value)
+	return scales
+
+def _size(demand, scales):
+	"""
+	Return the size of a demand, relative to the scales: a tuple with the
+	share of its dominant dimension, then the sum of its shares.
+	"""
+	shares=list()
+	for dim, value in demand.items():
+		if dim in scales:
+			if scales[dim] > 0:
+				shares.append(float(value)/scales[dim])
+			elif value > 0:
+				shares.append(float('inf')) # Fits nowhere
+
+	if len(shares) == 0:
+		return (0.0, 0.0)
+	return (max(shares), sum(shares))
+
+def _residual(demand, free, scales):
+	"""Return the free space left by a demand on a node, summed over the dimensions of the demand."""
+	residual=0.0
+	for dim, value in demand.items():
+		if dim in free and scales.get(dim, 0) > 0:
+			residual+=float(free[dim]-value)/scales[dim]
+	return residual
+
+def _sort(vms, scales, priorities):
+	"""Return the VMs sorted by decreasing priority, then by decreasing size."""
+	return sorted(vms, key=lambda x: (priorities.get(x[0], 0), _size(x[1], scales)), reverse=True)
+
+
+def best_fit_decreasing(vms, nodes, priorities=dict()):
+	"""
+	Place each VM, by decreasing size, on the node where it leaves the least free space.
+	See place() for parameters and result.
+	"""
+	scales=_scales(nodes)
+	free=dict([ (name, dict(values)) for name, values in nodes ])
+
+	placement=dict()
+	unplaced=list()
+	for name, demand in _sort(vms, scales, priorities):
+		selected=None
+		best=None
+		for node, values in nodes:
+			if fits(demand, free[node]):
+				residual=_residual(demand, free[node], scales)
+				if best is None or residual < best:
+					selected=node
+					best=residual
+
+		if selected is None:
+			unplaced.append(name)
+		else:
+			consume(demand, free[selected])
+			placement[name]=selected
+
+	return (placement, unplaced, free)
+
+def first_fit_decreasing(vms, nodes, priorities=dict()):
+	"""
+	Place each VM, by decreasing size, on the first node where it fits, in the given order of nodes.
+	See place() for parameters and result.
+	"""
+	scales=_scales(nodes)
+	free=dict([ (name, dict(values)) for name, values in nodes ])
+
+	placement=dict()
+	unplaced=list()
+	for name, demand in _sort(vms, scales, priorities):
+		for node, values in nodes:
+			if fits(demand, free[node]):
+				consume(demand, free[node])
+				placement[name]=node
+				break
+		else:
+			unplaced.append(name)
+
+	return (placement, unplaced, free)
+
+
+class _BudgetExceeded(Exception):
+	pass
+
+def exact(vms, nodes, priorities=dict()):
+	"""
+	Return the best placement with a branch and bound search, starting with the solution of best_fit_decreasing().
+
+	The best placement has the most VMs of the highest priority, then of the next ones,
+	then the most ram. The search stops after EXACT_MAX_STEPS steps, with the best
+	placement found so far. See place() for parameters and result.
+	"""
+	scales=_scales(nodes)
+	items=_sort(vms, scales, priorities)
+	levels=sorted(set([ priorities.get(name, 0) for name, demand in items ]), reverse=True)
+
+	def value(name, demand):
+		"""Return the score vector of a placed VM."""
+		vector=[0]*(len(levels)+1)
+		vector[levels.index(priorities.get(name, 0))]=1
+		vector[-1]=demand.get('ram', 0)
+		return vector
+
+	def score(placement):
+		total=[0]*(len(levels)+1)
+		for name, demand in items:
+			if name in placement:
+				total=[ a+b for a, b in zip(total, value(name, demand)) ]
+		return tuple(total)
+
+	# Upper bound: all the next VMs are placed
+	remaining=[ [0]*(len(levels)+1) ]
+	for name, demand in reversed(items):
+		remaining.insert(0, [ a+b for a, b in zip(remaining[0], value(name, demand)) ])
+
+	(placement, unplaced, free)=best_fit_decreasing(vms, nodes, priorities)
+	best={'score': score(placement), 'placement': placement}
+
+	free=dict([ (name, dict(values)) for name, values in nodes ])
+	current={'score': [0]*(len(levels)+1), 'placement': dict(), 'steps': 0}
+
+	def search(i):
+		current['steps']+=1
+		if current['steps'] > EXACT_MAX_STEPS:
+			raise _BudgetExceeded()
+
+		if tuple([ a+b for a, b in zip(current['score'], remaining[i]) ]) <= best['score']:
+			return # Cannot do better
+
+		if i == len(items):
+			best['score']=tuple(current['score'])
+			best['placement']=dict(current['placement'])
+			return
+
+		(name, demand)=items[i]
+		vector=value(name, demand)
+
+		# Best fit first, and only one of the nodes with the same free capacities
+		candidates=[ node for node, values in nodes if fits(demand, free[node]) ]
+		candidates.sort(key=lambda node: _residual(demand, free[node], scales))
+		tried=list()
+		for node in candidates:
+			if free[node] in tried:
+				continue
+			tried.append(dict(free[node]))
+
+			consume(demand, free[node])
+			current['placement'][name]=node
+			current['score']=[ a+b for a, b in zip(current['score'], vector) ]
+			try:
+				search(i+1)
+			finally:
+				current['score']=[ a-b for a, b in zip(current['score'], vector) ]
+				del current['placement'][name]
+				consume(dict([ (dim, -v) for dim, v in demand.items() ]), free[node])
+
+		# Without this VM
+		search(i+1)
+
+	try:
+		search(0)
+	except _BudgetExceeded:
+		log.debug("[PLC]", "Exact search stopped after", EXACT_MAX_STEPS, "steps")
+
+	placement=best['placement']
+	free=dict([ (name, dict(values)) for name, values in nodes ])
+	for name, demand in items:
+		if name in placement:
+			consume(demand, free[placement[name]])
+	unplaced=[ name for name, demand in items if name not in placement ]
+
+	return (placement, unplaced, free)
+
+
+def place(vms, nodes, strategy=None, priorities=dict()):
+	"""
+	Choose the node of each VM.
+
+	vms - (list) Tuples (VM name, dict of demands)
+	nodes - (list) Tuples (node name, dict of free capacities), the order is used by 'ffd'
+	strategy - (string) One of STRATEGIES, PLACEMENT_STRATEGY by default.
+	           'exact' is only used up to EXACT_MAX_VMS VMs, 'bfd' otherwise.
+	priorities - (dict) Optional priority of VMs (see VM.get_priority()): VMs are placed
+	             by decreasing priority, then by decreasing size.
+
+	Return a tuple (placement, unplaced, free), with a dict VM -> node, the list of VMs that
+	don't fit anywhere, and the free capacities of nodes after placement.
+	Raise a PlacementError if the strategy is unknown.
+	"""
+	if strategy is None:
+		strategy=core.cfg['PLACEMENT_STRATEGY']
+
+	if strategy == "bfd":
+		return best_fit_decreasing(vms, nodes, priorities)
+	elif strategy == "ffd":
+		return first_fit_decreasing(vms, nodes, priorities)
+	elif strategy == "exact":
+		if len(vms) > EXACT_MAX_VMS:
+			return best_fit_decreasing(vms, nodes, priorities)
+		return exact(vms, nodes, priorities)
+	else:
+		raise PlacementError("Unknown placement strategy %s" % (strategy))
+
+
+class PlacementError(Exception):
+	"""This class is used to raise errors relatives to VMs placement."""
+	pass
+
+
+# vim: ts=4:sw=4:ai
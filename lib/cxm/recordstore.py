@@ -0,0 +1,139 @@
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2010-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+# $Id:$
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+
+"""This module hold the RecordStore class."""
+
+import threading, time
+import logs as log
+
+
+class RecordStore(object):
+
+	"""
+	This class is a per-node store of XenAPI records (VM, VM_metrics, VIF_metrics...).
+
+	Records are grouped in generations: each class of records is fetched at
+	most once per generation, and views derived from records (list of vms,
+	net io...) are computed at most once per generation too.
+
+	A new generation is started when:
+	  - the current one is older than LIFETIME seconds;
+	  - a fresh value is requested (nocache) and the current generation is
+	    older than MIN_AGE seconds, so a burst of nocache requests share a
+	    single fetch;
+	  - invalidate() is called, eg. after a vm is started or migrated.
+
+	If the node's records are watched by XenAPI events (see Node.watch_events()),
+	VM and VM_metrics records are always read from the watcher.
+	"""
+
+	LIFETIME = 5	# Records are outdated after 5 seconds
+	MIN_AGE = 1		# Fresh requests reuse records younger than 1 second
+
+	def __init__(self, node):
+		"""Instanciate an empty store for the given node."""
+		self.node=node
+		self.generation=0			# Current generation number
+		self._started=0				# Timestamp of the current generation
+		self._records=dict()		# XenAPI class -> records of the current generation
+		self._views=dict()			# View name -> derived value of the current generation
+		self._lock=threading.RLock()
+
+	def __repr__(self):
+		return "<RecordStore Instance : "+ self.node.hostname +" gen "+ str(self.generation) +">"
+
+	def invalidate(self):
+		"""Start a new generation: records will be fetched again on next access."""
+		self._lock.acquire()
+		try:
+			self.generation+=1
+			self._started=time.time()
+			self._records.clear()
+			self._views.clear()
+		finally:
+			self._lock.release()
+
+	def update(self, nocache=False):
+		"""
+		Start a new generation if the current one is outdated, or if 'nocache'
+		is True and the current one is not fresh enough.
+		Return the current generation number.
+		"""
+		self._lock.acquire()
+		try:
+			age=time.time()-self._started
+			if age >= self.LIFETIME or (nocache and age >= self.MIN_AGE):
+				self.invalidate()
+			return self.generation
+		finally:
+			self._lock.release()
+
+	def get(self, cls, nocache=False):
+		"""
+		Return a dict with all records of the given XenAPI class (eg. 'VM'),
+		like <cls>.get_all_records().
+		"""
+		if cls in ('VM', 'VM_metrics') and self.node.is_watched():
+			if cls == 'VM':
+				return self.node.watcher.get_vm_records()
+			else:
+				return self.node.watcher.get_vm_metrics_records()
+
+		self._lock.acquire()
+		try:
+			self.update(nocache)
+			try:
+				return self._records[cls]
+			except KeyError:
+				records=getattr(self.node.server.xenapi, cls).get_all_records()
+				log.debug("[API]", self.node.hostname, cls, "records=", records)
+				self._records[cls]=records
+				return records
+		finally:
+			self._lock.release()
+
+	def view(self, name, nocache, callback, *args, **kw):
+		"""
+		Return the value of the view 'name', computed by the callback from the
+		records of the current generation.
+		Views are not kept when records are watched, as they may change at any time.
+		"""
+		if self.node.is_watched():
+			return callback(*args, **kw)
+
+		self._lock.acquire()
+		try:
+			self.update(nocache)
+			try:
+				return self._views[name]
+			except KeyError:
+				value=callback(*args, **kw)
+				self._views[name]=value
+				return value
+		finally:
+			self._lock.release()
+
+
+# vim: ts=4:sw=4:ai
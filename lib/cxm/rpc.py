@@ -31,6 +31,7 @@ import logs as log
 from twisted.spread import pb
 import os
 import core
+from dnscache import DNSCache
 
 
 class RemoteRPC(pb.Root):
@@ -50,6 +51,17 @@ class RemoteRPC(pb.Root):
 	def remote_panic(self):
 		return self._master.panic()
 
+	def remote_resync(self):
+		return self._master.resyncSlaves()
+
+	def remote_getMetrics(self):
+		"""Return the nodes' metrics received with slave heartbeats."""
+		return self._master.getMetrics()
+
+	def remote_getFailoverPlans(self):
+		"""Return the failover plans of the nodes, and the N-1 feasible flag."""
+		return self._master.getFailoverPlans()
+
 	def remote_grabLock(self, name):
 		"""
 		This RPC is a centralised lock system.
@@ -101,6 +113,18 @@ class LocalRPC(pb.Root):
 	def remote_ping(self):
 		return defer.succeed("PONG") 
 
+	def remote_locateVM(self, name):
+		"""Return the list of nodes where the given VM is running, according to heartbeats."""
+		return self._master.vmIndex.locate(name)
+
+	def remote_getVMIndex(self):
+		"""Return a dict of the nodes where each VM is running, according to heartbeats."""
+		return self._master.vmIndex.get_index()
+
+	def remote_getDuplicateVMs(self):
+		"""Return a dict of the VMs running on more than one node, with the list of nodes."""
+		return self._master.vmIndex.get_duplicates()
+
 	def remote_getState(self):
 		status = dict()
 		status['state']=self._master.state
@@ -113,8 +137,16 @@ class LocalRPC(pb.Root):
 	def remote_getDump(self):
 		dump = dict()
 		dump['masterLastSeen']=self._master.masterLastSeen
+		dump['diskScanLatency']=self._master.disk.last_scan_latency
 		dump['status']=self._master.getStatus()
 		dump['ballotBox']=self._master.ballotBox
+		dump['nodePool']=self._master.getPool().get_hostnames()
+		dump['dnsCache']=DNSCache.getInstance().get_stats()
+		dump['suspicion']=dict()
+		for (channel, detector) in [('master', self._master.masterDetector),
+				('net', self._master.netDetector), ('disk', self._master.diskDetector)]:
+			if detector is not None:
+				dump['suspicion'][channel]=detector.get_stats()
 
 		return dump
 
@@ -0,0 +1,295 @@
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2010-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+# $Id:$
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+
+"""This module hold the MigrationScheduler and StartScheduler classes."""
+
+
+import threading
+
+import core
+import logs as log
+from node import NotEnoughRamError
+
+
+class MigrationScheduler:
+
+	"""
+	This class run a migration plan on a XenCluster, with concurrent migrations.
+
+	Migrations are started in the plan's order, as soon as limits allow it:
+	  - no more than MIGRATION_MAX_PER_SRC migrations from the same node;
+	  - no more than MIGRATION_MAX_PER_DST migrations to the same node;
+	  - the ram of the vm is reserved on the destination, and given back to the source
+	    when the migration is done. A migration waiting for ram on a node also delay
+	    the next ones to this node, so the plan's order is kept.
+	  - the migrations of the same vm are done one after the other.
+
+	Example of usage :
+
+	scheduler=MigrationScheduler(cluster)
+	scheduler.add('vm1', 'node1', 'node2', 512)
+	scheduler.add('vm2', 'node1', 'node3', 1024)
+	scheduler.run()
+	"""
+
+	def __init__(self, cluster, free_ram=None):
+		"""
+		Instanciate a new MigrationScheduler on the given XenCluster.
+
+		free_ram is an optional dict with the free ram of each node. If not given, free ram
+		of nodes is fetched when run() is called. Unit: MB
+		"""
+		self.cluster=cluster
+		self.free_ram=free_ram
+		self.plan=list()
+
+	def add(self, vmname, src_hostname, dst_hostname, ram):
+		"""Append the migration of vmname, using the given amount of ram (in MB), to the plan."""
+		self.plan.append({'vm': vmname, 'src': src_hostname, 'dst': dst_hostname, 'ram': ram})
+
+	def run(self):
+		"""
+		Run all migrations of the plan, and wait for them.
+
+		This function is error-proof: if a migration fail, the others are still done,
+		but not the next migrations of the same vm.
+		Raise a MultipleError with the error of each failed vm, if any.
+		"""
+		# Import here to avoid circular import
+		from xencluster import MultipleError
+
+		if len(self.plan) == 0:
+			return
+
+		# Get free ram of destination nodes, sources only get ram back
+		free=dict()
+		for item in self.plan:
+			if item['dst'] not in free:
+				try:
+					free[item['dst']]=self.free_ram[item['dst']]
+				except (TypeError, KeyError):
+					free[item['dst']]=self.cluster.get_node(item['dst']).metrics.get_free_ram(True)
+
+		log.debug("[SCH]", "plan=", self.plan, "free=", free)
+
+		pending=list(self.plan)
+		running=list()
+		failed=dict()
+		count=dict(done=0, total=len(self.plan))
+		from_node=dict()
+		to_node=dict()
+		cond=threading.Condition()
+
+		def migrate(item):
+			try:
+				self.cluster.migrate(item['vm'], item['src'], item['dst'])
+				error=None
+			except Exception, e:
+				error=e
+
+			cond.acquire()
+			try:
+				running.remove(item)
+				from_node[item['src']]-=1
+				to_node[item['dst']]-=1
+				count['done']+=1
+
+				if error is None:
+					free[item['src']]=free.get(item['src'], 0)+item['ram']
+					log.info("[%d/%d]" % (count['done'], count['total']), item['vm'], "migrated to", item['dst'])
+				else:
+					free[item['dst']]+=item['ram']
+					failed[item['vm']]=error
+					log.warn("[%d/%d] Migration of %s to %s failed: %s" % (count['done'], count['total'], item['vm'], item['dst'], error))
+
+				cond.notify()
+			finally:
+				cond.release()
+
+		def start_ready():
+			"""Start all startable migrations, return the number of started ones."""
+			started=0
+			blocked_vms=list(item['vm'] for item in running)
+			blocked_dsts=list()
+
+			for item in list(pending):
+				# Previous migration of this vm failed
+				if item['vm'] in failed:
+					pending.remove(item)
+					count['done']+=1
+					continue
+
+				if item['vm'] in blocked_vms or item['dst'] in blocked_dsts:
+					blocked_vms.append(item['vm'])
+					continue
+
+				if from_node.get(item['src'], 0) >= core.cfg['MIGRATION_MAX_PER_SRC'] or \
+						to_node.get(item['dst'], 0) >= core.cfg['MIGRATION_MAX_PER_DST']:
+					blocked_vms.append(item['vm'])
+					continue
+
+				if free[item['dst']] < item['ram']:
+					blocked_vms.append(item['vm'])
+					blocked_dsts.append(item['dst'])
+					continue
+
+				# Reserve resources and start migration
+				free[item['dst']]-=item['ram']
+				from_node[item['src']]=from_node.get(item['src'], 0)+1
+				to_node[item['dst']]=to_node.get(item['dst'], 0)+1
+				pending.remove(item)
+				running.append(item)
+				blocked_vms.append(item['vm'])
+
+				log.info("Migrating", item['vm'], "from", item['src'], "to", item['dst'], "...")
+				thread=threading.Thread(target=migrate, args=(item,))
+				thread.setDaemon(True)
+				thread.start()
+				started+=1
+
+			return started
+
+		cond.acquire()
+		try:
+			while len(pending) > 0 or len(running) > 0:
+				if start_ready() == 0 and len(running) == 0 and len(pending) > 0:
+					# Nothing running will free ram, give up
+					for item in pending:
+						if item['vm'] not in failed:
+							failed[item['vm']]=NotEnoughRamError(item['dst'], 
+								"need "+str(item['ram'])+"M, has "+str(free[item['dst']])+"M.")
+					break
+
+				if len(running) > 0:
+					cond.wait()
+		finally:
+			cond.release()
+
+		# Raise final error after all migration attempts
+		if len(failed)>0:
+			raise MultipleError(failed)
+
+
+class StartScheduler:
+
+	"""
+	This class start VMs on a XenCluster, with concurrent starts.
+
+	The nodes are chosen beforehand, with their ram reserved, so starts only
+	have to be run in the plan's order, within START_MAX_PER_NODE concurrent
+	starts on the same node.
+
+	Example of usage :
+
+	scheduler=StartScheduler(cluster)
+	scheduler.add('vm1', 'node2')
+	scheduler.add('vm2', 'node3')
+	scheduler.run()
+	"""
+
+	def __init__(self, cluster):
+		"""Instanciate a new StartScheduler on the given XenCluster."""
+		self.cluster=cluster
+		self.plan=list()
+
+	def add(self, vmname, hostname):
+		"""Append the start of vmname on the given node to the plan."""
+		self.plan.append({'vm': vmname, 'dst': hostname})
+
+	def run(self):
+		"""
+		Run all starts of the plan, and wait for them (see XenCluster.restart_vm()).
+
+		This function is error-proof: if a start fail, the others are still done.
+		Return the list of started vms.
+		Raise a MultipleError with the error of each failed vm, if any.
+		"""
+		# Import here to avoid circular import
+		from xencluster import MultipleError
+
+		log.debug("[SCH]", "starts=", self.plan)
+
+		pending=list(self.plan)
+		running=list()
+		started=list()
+		failed=dict()
+		count=dict(done=0, total=len(self.plan))
+		to_node=dict()
+		cond=threading.Condition()
+
+		def start(item):
+			try:
+				self.cluster.restart_vm(item['vm'], item['dst'])
+				error=None
+			except Exception, e:
+				error=e
+
+			cond.acquire()
+			try:
+				running.remove(item)
+				to_node[item['dst']]-=1
+				count['done']+=1
+
+				if error is None:
+					started.append(item['vm'])
+					log.info("[%d/%d]" % (count['done'], count['total']), item['vm'], "started on", item['dst'])
+				else:
+					failed[item['vm']]=error
+					log.warn("[%d/%d] Start of %s on %s failed: %s" % (count['done'], count['total'], item['vm'], item['dst'], error))
+
+				cond.notify()
+			finally:
+				cond.release()
+
+		def start_ready():
+			for item in list(pending):
+				if to_node.get(item['dst'], 0) >= core.cfg['START_MAX_PER_NODE']:
+					continue
+
+				to_node[item['dst']]=to_node.get(item['dst'], 0)+1
+				pending.remove(item)
+				running.append(item)
+
+				log.info("Starting", item['vm'], "on", item['dst'], "...")
+				thread=threading.Thread(target=start, args=(item,))
+				thread.setDaemon(True)
+				thread.start()
+
+		cond.acquire()
+		try:
+			while len(pending) > 0 or len(running) > 0:
+				start_ready()
+				cond.wait()
+		finally:
+			cond.release()
+
+		# Raise final error after all start attempts
+		if len(failed)>0:
+			raise MultipleError(failed)
+
+		return started
+
+
+# vim: ts=4:sw=4:ai
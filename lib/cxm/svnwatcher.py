@@ -183,7 +183,8 @@ class InotifyPP(protocol.ProcessProtocol):
 		
 	def doUpdate(self):
 		def doNodeUpdate(node):
-			d=threads.deferToThread(node.run, "svn update "+ core.cfg['VMCONF_DIR'])
+			# Within the reactor, don't hold a thread per node
+			d=node.run_deferred("svn update "+ core.cfg['VMCONF_DIR'])
 			return d
 
 		# This is used to fire a mono-Failure in the parent deferred
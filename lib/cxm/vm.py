@@ -105,6 +105,10 @@ class VM:
 		"""Return the amount of ram configured on startup."""
 		return int(self.config['memory'])
 
+	def get_priority(self):
+		"""Return the start priority of the vm, from 'cxm_priority' in its configuration file. Default is 0."""
+		return int(self.config.get('cxm_priority', 0))
+
 	def set_ram(self,ram):
 		"""Set the amount of ram allocated to the vm."""
 		self.__ram=str(ram)
@@ -116,6 +120,24 @@ class VM:
 		else:
 			return int(self.metrics['VCPUs_number'])
 
+	def get_start_vcpu(self):
+		"""Return the number of vcpu configured on startup."""
+		return int(self.config.get('vcpus', 1))
+
+	def get_irq(self):
+		"""Return the number of Dom0's dynamic irq used by the vm: one per disk and per network interface, and one for the console."""
+		return len(self.config.get('disk', list()))+len(self.config.get('vif', list()))+1
+
+	def get_demand(self, started=False):
+		"""
+		Return the resources needed by the vm on a node, for the placement engine (see placement.DIMENSIONS).
+		If 'started' is True, the current ram and vcpu of the running vm are used, instead of the configured ones.
+		"""
+		if started:
+			return {'ram': self.get_ram(), 'irq': self.get_irq(), 'vms': 1, 'vcpu': self.get_vcpu()}
+		else:
+			return {'ram': self.get_start_ram(), 'irq': self.get_irq(), 'vms': 1, 'vcpu': self.get_start_vcpu()}
+
 	def set_vcpu(self, vcpu):
 		"""Set the number of vcpu allocated to the vm."""
 		self.__vcpu=str(vcpu)
@@ -0,0 +1,86 @@
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2011-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+# $Id:$
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+
+
+"""
+This module hold the cluster-wide index of running VMs, maintained by cxmd
+from the slaves' heartbeats. See LocalRPC.remote_getVMIndex().
+"""
+
+
+class VMIndex(object):
+
+	"""
+	This class is an inverted index of the cluster's status: VM -> nodes where it's running.
+	It's updated incrementally, each node's vms list is compared to the previous one.
+	"""
+
+	def __init__(self):
+		self._vms=dict()		# Node -> set of running vms
+		self._nodes=dict()		# VM -> set of nodes where it's running
+
+	def update(self, node, vms):
+		"""Set the list of vms running on the given node."""
+		new=set(vms)
+		old=self._vms.get(node, set())
+		if new == old:
+			return
+
+		for vm in old - new:
+			self._nodes[vm].discard(node)
+			if len(self._nodes[vm]) == 0:
+				del self._nodes[vm]
+		for vm in new - old:
+			self._nodes.setdefault(vm, set()).add(node)
+		self._vms[node]=new
+
+	def remove(self, node):
+		"""Forget the given node."""
+		self.update(node, [])
+		self._vms.pop(node, None)
+
+	def sync(self, status):
+		"""Update the index with a whole cluster's status (see MasterService.getStatus())."""
+		for node in self._vms.keys():
+			if node not in status:
+				self.remove(node)
+
+		for node, values in status.items():
+			self.update(node, values['vms'])
+
+	def locate(self, vm):
+		"""Return the list of nodes where the given VM is running."""
+		return list(self._nodes.get(vm, list()))
+
+	def get_duplicates(self):
+		"""Return a dict of the VMs running on more than one node, with the list of nodes."""
+		return dict([ (vm, list(nodes)) for vm, nodes in self._nodes.items() if len(nodes) > 1 ])
+
+	def get_index(self):
+		"""Return the whole index, as a dict of lists: VM -> nodes."""
+		return dict([ (vm, list(nodes)) for vm, nodes in self._nodes.items() ])
+
+
+# vim: ts=4:sw=4:ai
@@ -0,0 +1,231 @@
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2010-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+# $Id:$
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+
+"""This module hold the VMWatcher class."""
+
+import threading, time, socket
+import logs as log
+
+
+class VMWatcher(object):
+
+	"""
+	This class keep an up-to-date copy of the VM and VM_metrics records of a node.
+
+	Records are fetched once, then updated by a thread listening to XenAPI
+	events (event.register/event.next), so readers don't have to poll xend.
+	The thread use its own XenAPI session, as event.next() is blocking.
+
+	The session has a timeout (TM_EVENT): when no event comes in time, the
+	thread opens a new session and resync. Records not refreshed by an event
+	or a resync for TM_STALE seconds (xend is hung ?) are no more considered as
+	up-to-date, so readers fall back to polling.
+
+	Example of usage :
+
+	watcher=VMWatcher(node)
+	watcher.start()
+	if watcher.is_ready():
+		records=watcher.get_vm_records()
+	"""
+
+	CLASSES = ['VM', 'VM_metrics']	# Watched XenAPI classes
+	TM_RETRY = 5					# Wait 5 seconds before reconnecting after an error
+	TM_EVENT = 30					# Resync if no event within 30 seconds
+	TM_STALE = 2*TM_EVENT			# Records are outdated if not refreshed within 60 seconds
+
+	def __init__(self, node):
+		"""Instanciate a VMWatcher for the given node. Call start() to run it."""
+		self.node=node
+		self._lock=threading.Lock()
+		self._vms=dict()			# VM ref -> VM record
+		self._metrics=dict()		# VM_metrics ref -> VM_metrics record
+		self._ready=False			# True when records are in sync with xend
+		self._refreshed=0			# Date of the last event or resync
+		self._running=False
+		self._generation=0			# Run of the current thread, see _alive()
+		self._thread=None
+
+	def __repr__(self):
+		return "<VMWatcher Instance : "+ self.node.hostname +">"
+
+	def start(self):
+		"""Start the watching thread."""
+		self._lock.acquire()
+		try:
+			if self._running:
+				return
+
+			# A previous thread may still wait for an event: it will exit without touching records
+			self._running=True
+			self._generation+=1
+			self._thread=threading.Thread(target=self.run, args=(self._generation,), name="VMWatcher-"+self.node.hostname)
+		finally:
+			self._lock.release()
+
+		self._thread.setDaemon(True)
+		self._thread.start()
+
+	def stop(self):
+		"""
+		Stop watching. Records are no more considered as up-to-date.
+		The thread will exit on the next received event, or at most after TM_EVENT seconds.
+		"""
+		self._lock.acquire()
+		try:
+			self._running=False
+			self._ready=False
+		finally:
+			self._lock.release()
+
+	def _alive(self, generation):
+		"""Return True if the run of the given generation (None for the current one) is not stopped."""
+		return self._running and generation in (None, self._generation)
+
+	def is_ready(self):
+		"""Return True if the records are in sync with xend."""
+		return self._ready and self._refreshed+self.TM_STALE > time.time()
+
+	def get_vm_records(self):
+		"""Return a dict with all VM records, like VM.get_all_records()."""
+		self._lock.acquire()
+		try:
+			return dict(self._vms)
+		finally:
+			self._lock.release()
+
+	def get_vm_metrics_records(self):
+		"""Return a dict with all VM_metrics records, like VM_metrics.get_all_records()."""
+		self._lock.acquire()
+		try:
+			return dict(self._metrics)
+		finally:
+			self._lock.release()
+
+	def sync(self, server, generation=None):
+		"""Fetch all records with the given XenAPI session."""
+		dom_recs=server.xenapi.VM.get_all_records()
+		dom_metrics_recs=server.xenapi.VM_metrics.get_all_records()
+
+		self._lock.acquire()
+		try:
+			if not self._alive(generation):
+				return
+			self._vms=dom_recs
+			self._metrics=dom_metrics_recs
+			self._ready=True
+			self._refreshed=time.time()
+		finally:
+			self._lock.release()
+
+		log.debug("[EVT]", self.node.hostname, "synced", len(dom_recs), "VM records")
+
+	def process(self, server, event, generation=None):
+		"""Apply the given XenAPI event on records, using the given session if needed."""
+		ref=event['ref']
+		if event['class'] == 'VM':
+			records=self._vms
+		elif event['class'] == 'VM_metrics':
+			records=self._metrics
+		else:
+			return
+
+		if event['operation'] == 'del':
+			self._lock.acquire()
+			try:
+				if not self._alive(generation):
+					return
+				self._refreshed=time.time()
+				record=records.pop(ref, None)
+				if event['class'] == 'VM' and record is not None:
+					self._metrics.pop(record['metrics'], None)
+			finally:
+				self._lock.release()
+			return
+
+		# Some xend versions don't send the record with the event
+		record=event.get('snapshot')
+		if record is None:
+			if event['class'] == 'VM':
+				record=server.xenapi.VM.get_record(ref)
+			else:
+				record=server.xenapi.VM_metrics.get_record(ref)
+
+		# Memory and vcpus changes may not raise VM_metrics events
+		metrics=None
+		if event['class'] == 'VM':
+			metrics=server.xenapi.VM_metrics.get_record(record['metrics'])
+
+		self._lock.acquire()
+		try:
+			if not self._alive(generation):
+				return
+			self._refreshed=time.time()
+			records[ref]=record
+			if metrics is not None:
+				self._metrics[record['metrics']]=metrics
+		finally:
+			self._lock.release()
+
+	def run(self, generation=None):
+		"""Thread's main loop: (re)connect, sync and apply events until stopped or restarted."""
+		while self._alive(generation):
+			server=None
+			try:
+				try:
+					server=self.node.open_session(self.TM_EVENT)
+					server.xenapi.event.register(self.CLASSES)
+					self.sync(server, generation)
+
+					while self._alive(generation):
+						events=server.xenapi.event.next()
+						log.debug("[EVT]", self.node.hostname, "events=", events)
+						for event in events:
+							self.process(server, event, generation)
+				except socket.timeout:
+					# No event in time, or xend is hung. The pending event.next() may
+					# still eat the next events: resync with a new session.
+					log.debug("[EVT]", self.node.hostname, "no event, resyncing")
+				except Exception, e:
+					# EVENTS_LOST, xend restart, network error...
+					self._lock.acquire()
+					try:
+						if self._alive(generation):
+							self._ready=False
+					finally:
+						self._lock.release()
+
+					if self._alive(generation):
+						log.warn("Lost XenAPI events of %s, resyncing: %s" % (self.node.hostname, e))
+						time.sleep(self.TM_RETRY)
+			finally:
+				if server is not None:
+					try:
+						server.xenapi.session.logout()
+					except:
+						pass
+
+
+# vim: ts=4:sw=4:ai
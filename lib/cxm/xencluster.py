@@ -30,7 +30,8 @@ import os, socket, time
 from sets import Set
 from twisted.internet import threads, defer
 
-import core, loadbalancer
+import core, loadbalancer, parallel, placement
+from scheduler import MigrationScheduler, StartScheduler
 import logs as log
 from node import *
 from vm import VM
@@ -40,20 +41,29 @@ class XenCluster:
 
 	"""This class is used to perform action on the xen cluster."""
 
+	METRICS_MAX_AGE = 3		# Metrics from heartbeats are outdated after 3 intervals
+
 	def __init__(self, nodes):
 		"""This should be private. Use getDeferInstance() instead."""
 
 		assert type(nodes) == dict, "Param 'nodes' should be a dict."
 		self.nodes=nodes
+		self.vm_index=None
+		self.metrics=None
+		self.failover_plans=None
 		
 	@staticmethod
-	def getDeferInstance(nodeslist=None):
+	def getDeferInstance(nodeslist=None, pool=None):
 		"""Instantiate a XenCluster object and associated Nodes.
 
 		This function open SSH and XenAPI connections to all actives nodes.
-		It take a (string) list of node's hostname as optionnal argument, if not given, 
+		It take a (string) list of node's hostname as optionnal argument, if not given,
 		the list will fetched from cxm'master.
 
+		If a NodePool is given, connected nodes are borrowed from it instead of
+		opening new connections. In this case, don't call disconnect() on the
+		returned cluster.
+
 		Return a deferred that will be fired when all nodes are ready.
 		If a node is not online, the deferred will fail.
 		"""
@@ -78,7 +88,10 @@ class XenCluster:
 		def create_nodes(result):
 			ds=list()
 			for hostname in result:
-				d=threads.deferToThread(lambda x: Node(x), hostname)
+				if pool is None:
+					d=threads.deferToThread(lambda x: Node(x), hostname)
+				else:
+					d=pool.get(hostname)
 				d.addCallback(add_node, hostname)
 				ds.append(d)
 
@@ -215,26 +228,196 @@ class XenCluster:
 		"""Return True if the specified hostname is a node of the cluster."""
 		return hostname in self.nodes
 
-	def search_vm_started(self,vmname):
+	def snapshot(self, items=None):
+		"""
+		Fetch the snapshot of all nodes concurrently (see Node.get_snapshot()).
+		'items' is the list of wanted entries, all by default.
+
+		Return a dict of nodes' snapshot, indexed by hostname.
+		Raise a MultipleError if some nodes fail.
+		"""
+		nodes=self.get_nodes()
+		results=parallel.map_threads(lambda node: node.get_snapshot(items), nodes)
+
+		snapshot=dict()
+		failed=dict()
+		for node, (success, result) in zip(nodes, results):
+			if success:
+				snapshot[node.get_hostname()]=result
+			else:
+				failed[node.get_hostname()]=result
+
+		if len(failed)>0:
+			raise MultipleError(failed, "Cannot get snapshot")
+
+		return snapshot
+
+	def search_vm_started(self, vmname, snapshot=None):
 		"""Search where the specified vm hostname is running.
 
+		'snapshot' is an optional cluster's snapshot with 'vms' entries (see snapshot()).
 		Return a list of Node where the VM is running.
 		"""
+		if snapshot is None:
+			snapshot=self.snapshot(['vms'])
+
 		started=list()
 		for node in self.get_nodes():
-			if node.is_vm_started(vmname):
+			if vmname in snapshot[node.get_hostname()]['vms']:
 				started.append(node)
 
 		return started
 
-	def search_vm_autostart(self,vmname):
+	def set_vm_index(self, index):
+		"""Set the cluster's VM index, a dict VM -> list of hostnames (see Agent.getVMIndex())."""
+		self.vm_index=index
+
+	def locate_vm(self, vmname, snapshot=None):
+		"""Search where the specified vm hostname is running, using the VM index if available.
+
+		The index is maintained by cxmd from the slaves' heartbeats, so it may be
+		one heartbeat late. The nodes it gives are confirmed with XenAPI, and if one
+		of them doesn't run the VM, or if there is no index, all nodes are
+		searched (see search_vm_started(), 'snapshot' is given to it).
+		Return a list of Node where the VM is running.
+		"""
+		if self.vm_index is None:
+			return self.search_vm_started(vmname, snapshot)
+
+		try:
+			nodes=[ self.get_node(hostname) for hostname in self.vm_index.get(vmname, list()) ]
+		except NotInClusterError:
+			return self.search_vm_started(vmname, snapshot)
+
+		for node in nodes:
+			if not node.is_vm_started(vmname):
+				return self.search_vm_started(vmname, snapshot)
+
+		return nodes
+
+	def set_metrics(self, metrics):
+		"""Set the nodes' metrics received with heartbeats (see MasterService.getMetrics())."""
+		self.metrics=metrics
+
+	def get_node_metrics(self, node):
+		"""Return the metrics of the given node received with heartbeats (see set_metrics()), or None if they are outdated."""
+		try:
+			values=self.metrics[node.get_hostname()]
+			if values['timestamp']+core.cfg['HB_METRICS_INTERVAL']*XenCluster.METRICS_MAX_AGE >= time.time():
+				return values
+		except (TypeError, KeyError):
+			pass
+
+		return None
+
+	def get_capacities(self, node):
+		"""Return the free capacities of the given node, for the placement engine (see placement.DIMENSIONS).
+
+		The metrics from heartbeats are used if they are recent enough (see set_metrics()),
+		otherwise the node is queried. Vcpus are only counted if PLACEMENT_VCPU_RATIO is set.
+		"""
+		values=self.get_node_metrics(node)
+		if values is None:
+			capacities={
+				'ram': node.metrics.get_free_ram(False),
+				'irq': placement.MAX_IRQ-node.metrics.get_used_irq(),
+				'vms': core.cfg['LB_MAX_VM_PER_NODE']-node.get_vm_started(),
+			}
+		else:
+			capacities={
+				'ram': values['free_ram'],
+				'irq': placement.MAX_IRQ-values['used_irq'],
+				'vms': core.cfg['LB_MAX_VM_PER_NODE']-len(values['vms']),
+			}
+
+		if core.cfg['PLACEMENT_VCPU_RATIO'] > 0:
+			capacities['vcpu']=int(node.metrics.get_host_nr_cpus()*core.cfg['PLACEMENT_VCPU_RATIO']) - \
+				sum([ vm.get_vcpu() for vm in node.get_vms() ])
+
+		return capacities
+
+	def place_vms(self, demands, pool, plan=None, priorities=dict()):
+		"""
+		Choose the node of each VM with the placement engine (see placement.place()).
+
+		demands - (list) Tuples (VM name, dict of demands)
+		pool - (list of Node) Nodes where VMs can be placed
+		plan - (dict) Optional failover plan (see get_failover_plan()). Its capacities are used
+		       instead of querying nodes, and its placement is kept while planned nodes have room.
+		priorities - (dict) Optional priority of each VM (see VM.get_priority())
+
+		Return a tuple (placement, unplaced, capacities), with a dict VM -> hostname, the list
+		of VMs that don't fit anywhere, and the free capacities of nodes before placement.
+		"""
+		capacities=dict()
+		for node in pool:
+			try:
+				capacities[node.get_hostname()]=dict(plan['capacities'][node.get_hostname()])
+			except (TypeError, KeyError):
+				capacities[node.get_hostname()]=self.get_capacities(node)
+
+		free=dict([ (hostname, dict(values)) for hostname, values in capacities.items() ])
+		selected=dict()
+		for name, demand in demands:
+			try:
+				# Keep the planned node if it has still room for this one
+				hostname=plan['placement'][name]
+				if placement.fits(demand, free[hostname]):
+					placement.consume(demand, free[hostname])
+					selected[name]=hostname
+			except (TypeError, KeyError):
+				pass
+
+		(placed, unplaced, free)=placement.place([ item for item in demands if item[0] not in selected ],
+			[ (node.get_hostname(), free[node.get_hostname()]) for node in pool ], priorities=priorities)
+		selected.update(placed)
+
+		log.debug("[PLC]", "placement=", selected, "unplaced=", unplaced)
+		return (selected, unplaced, capacities)
+
+	def set_failover_plans(self, plans):
+		"""Set the failover plans computed by the master (see FailoverPlanner.get_plans())."""
+		self.failover_plans=plans
+
+	def get_failover_plan(self, name, vmnames):
+		"""Return the failover plan for the loss of the given node, if it's still valid.
+
+		A plan is stale if its metrics are outdated, if it doesn't place exactly the
+		given VMs, or if it uses a node that is not in this cluster instance.
+		Return None if there is no valid plan.
+		"""
+		try:
+			plan=self.failover_plans[name]
+		except (TypeError, KeyError):
+			return None
+
+		if plan['timestamp']+core.cfg['HB_METRICS_INTERVAL']*XenCluster.METRICS_MAX_AGE < time.time():
+			log.info("Failover plan for %s is outdated." % (name))
+			return None
+
+		if len(plan['unplaced']) > 0 or Set(plan['placement'].keys()) != Set(vmnames):
+			log.info("Failover plan for %s doesn't match its VMs." % (name))
+			return None
+
+		for hostname in plan['capacities'].keys():
+			if hostname not in self.nodes or hostname == name:
+				log.info("Failover plan for %s uses a lost node." % (name))
+				return None
+
+		return plan
+
+	def search_vm_autostart(self, vmname, snapshot=None):
 		"""Search where the specified vm hostname has an autostart link.
 
+		'snapshot' is an optional cluster's snapshot with 'autostart' entries (see snapshot()).
 		Return a list of Node where the autostart link is present.
 		"""
+		if snapshot is None:
+			snapshot=self.snapshot(['autostart'])
+
 		enabled=list()
 		for node in self.get_nodes():
-			if node.is_vm_autostart_enabled(vmname):
+			if vmname in snapshot[node.get_hostname()]['autostart']:
 				enabled.append(node)
 
 		return enabled
@@ -245,20 +428,38 @@ class XenCluster:
 		selected_node - (Node) Node where to activate the LVs
 		vmname - (String) hostname of the vm
 
-		Raise a RunningVmError if the VM is running.
+		LVs are deactivated on all nodes concurrently. The VM's configuration and
+		the VGs of its LVs are read once, on the selected node.
+
+		Raise a RunningVmError if the VM is running, or a MultipleError if
+		some nodes fail to deactivate the LVs.
 		"""
-		for node in self.get_nodes():
-			if node.is_vm_started(vmname):
-				raise RunningVmError(node.get_hostname(), vmname) 
-			else:
-				node.deactivate_lv(vmname)
+		lvs=VM(vmname).get_lvs()
+		if lvs:
+			vgs=selected_node.get_vgs(lvs)
+		else:
+			vgs=list()
+
+		nodes=self.get_nodes()
+		results=parallel.map_threads(lambda node: node.deactivate_lv(vmname, lvs, vgs), nodes)
 
-		selected_node.activate_lv(vmname)
+		failed=dict()
+		for node, (success, result) in zip(nodes, results):
+			if not success:
+				if isinstance(result, RunningVmError):
+					raise result
+				failed[node.get_hostname()]=result
+
+		if len(failed)>0:
+			raise MultipleError(failed, "Cannot deactivate LVs of %s" % (vmname))
+
+		selected_node.activate_lv(vmname, lvs, vgs)
 				
 	def start_vm(self, node, vmname, console):
 		"""Start the specified VM on the given node.
-		If there is not enough ram on the given node, the VM will be started 
-		on the node with the highest free ram and the autostart link will be updated accordingly.
+		If there is not enough ram on the given node, the VM will be started on the node
+		with the highest free ram where it fits (see placement.place()), and the autostart
+		link will be updated accordingly.
 
 		node - (Node) Selected host
 		vmname - (String) VM hostname 
@@ -272,15 +473,18 @@ class XenCluster:
 			# Not enough ram, switching to another node
 			old_node=node
 
-			# Get the node with the highest free ram (first fit increasing algorithm)
-			pool=self.get_nodes()
-			pool.sort(key=lambda x: x.metrics.get_free_ram(), reverse=True)
-			node=pool[0]
+			# Get the node with the highest free ram where the vm fits: first fit, over the nodes
+			# sorted by decreasing free ram
+			nodes=[ (n.get_hostname(), self.get_capacities(n)) for n in self.get_nodes() ]
+			if len(nodes)==0:
+				raise NotEnoughRamError(node.get_hostname(),"need "+str(needed_ram)+"M, has "+str(free_ram)+"M.")
+			nodes.sort(key=lambda x: x[1]['ram'], reverse=True)
+			(selected, unplaced, free)=placement.place([ (vmname, VM(vmname).get_demand()) ], nodes, "ffd")
 
 			# Last resources checks
-			free_ram=node.metrics.get_free_ram()
-			if needed_ram>free_ram:
-				raise NotEnoughRamError(node.get_hostname(),"need "+str(needed_ram)+"M, has "+str(free_ram)+"M.")
+			if len(unplaced)>0:
+				raise NotEnoughRamError(nodes[0][0],"need "+str(needed_ram)+"M, has "+str(nodes[0][1]['ram'])+"M.")
+			node=self.get_node(selected[vmname])
 
 			log.info(" -> Not enough ram, starting it on %s." % node.get_hostname())
 
@@ -354,8 +558,9 @@ class XenCluster:
 	def emergency_eject(self, ejected_node):
 		"""Migrate all running VMs on ejected_node to the others nodes.
 
-		Use best-fit decreasing algorithm to resolve bin packing problem.
-		Need Further optimizations when cluster is nearly full.
+		Nodes are chosen by the placement engine (see place_vms()), with their free ram,
+		irq and number of VMs. If the master gave a valid failover plan for this node
+		(see get_failover_plan()), its placement is used while nodes have room, without querying them.
 		"""
 
 		assert isinstance(ejected_node, Node), "Param 'ejected_node' should be a Node."
@@ -367,28 +572,28 @@ class XenCluster:
 		# Sort VMs to be ejected by used ram
 		vms=ejected_node.get_vms()
 		vms.sort(key=lambda x: x.get_ram(), reverse=True)
+
+		plan=self.get_failover_plan(ejected_node.get_hostname(), [ vm.name for vm in vms ])
+		if plan is not None:
+			log.info("Using failover plan for %s." % (ejected_node.get_hostname()))
+
+		(selected, unplaced, capacities)=self.place_vms([ (vm.name, vm.get_demand(True)) for vm in vms ], pool, plan)
+		scheduler=MigrationScheduler(self, dict([ (hostname, values['ram']) for hostname, values in capacities.items() ]))
 		
 		failed=dict()
 		for vm in vms:
-			selected_node=None
-	
-			# Sort nodes by free ram
-			pool.sort(key=lambda x: x.metrics.get_free_ram(False))
-			for node in pool:
-				if node.metrics.get_free_ram() >= vm.get_ram():
-					selected_node=node
-					break # Select first node with enough space
-
-			if selected_node is None:
+			if vm.name in unplaced:
 				# Not enough room for this one
 				failed[vm.name]=NotEnoughRamError(ejected_node.get_hostname(), "Cannot migrate "+vm.name)
 				continue  # Next !
 
-			log.info("Migrating", vm.name, "to", selected_node.get_hostname())
-			try:
-				self.migrate(vm.name,ejected_node.get_hostname(),selected_node.get_hostname())
-			except Exception, e:
-				failed[vm.name]=e
+			scheduler.add(vm.name, ejected_node.get_hostname(), selected[vm.name], vm.get_ram())
+
+		# Run migrations concurrently
+		try:
+			scheduler.run()
+		except MultipleError, e:
+			failed.update(e.value)
 
 		# Raise final error after all migration attempts
 		if len(failed)>0:
@@ -424,7 +629,7 @@ class XenCluster:
 		# Initialize loadbalancer
 		lb=loadbalancer.LoadBalancer(current_state)
 		lb.set_metrics(vm_metrics, node_metrics)
-		solution=lb.get_efficient_solution()
+		solution=lb.get_solution()
 
 		if not solution:
 			log.info("No better solution found with a minimal gain of %s%%." % core.cfg['LB_MIN_GAIN'])
@@ -440,22 +645,31 @@ class XenCluster:
 					return
 
 			# Do migrations to put the cluster in the selected state
+			# Free ram is computed from metrics, as the loadbalancer did
+			free_ram=dict()
+			for node, vms in current_state.items():
+				free_ram[node]=node_metrics[node]['ram'] - sum([ vm_metrics[vm]['ram'] for vm in vms ])
+
+			scheduler=MigrationScheduler(self, free_ram)
 			for path in solution.get_path():
-				log.info("Migrating", path['vm'], "from", path['src'], "to", path['dst'], "...")
-				self.migrate(path['vm'], path['src'], path['dst'])
+				scheduler.add(path['vm'], path['src'], path['dst'], vm_metrics[path['vm']]['ram'])
+			scheduler.run()
 
 	def check(self):
 		"""Perform a sanity check of the cluster.
 
 		Return a corresponding exit code (0=success, 0!=error)
 		"""
+		# Fetch the state of all nodes at once, ram is not checked
+		snapshot=self.snapshot(['bridges', 'autostart', 'cfg', 'lvs', 'vms'])
+
 		log.info("Checking for duplicate VM...")
 		safe=True
 
 		# Get cluster wide VM list
 		vm_by_node=dict()
-		for node in self.get_nodes():
-			vm_by_node[node.get_hostname()]=node.get_vms()
+		for node, values in snapshot.items():
+			vm_by_node[node]=values['vms']
 	
 		log.debug("vm_by_node=",vm_by_node)
 	
@@ -464,9 +678,9 @@ class XenCluster:
 		for node, vms in vm_by_node.items():
 			for vm in vms:
 				try:
-					node_by_vm[vm.name].append(node)
+					node_by_vm[vm].append(node)
 				except KeyError:
-					node_by_vm[vm.name]=[node]
+					node_by_vm[vm]=[node]
 
 		log.debug("node_by_vm=",node_by_vm)
 
@@ -477,41 +691,45 @@ class XenCluster:
 				safe=False
 
 		# Check bridges
-		if not self.check_bridges():
+		if not self.check_bridges(snapshot):
 			safe=False
 
 		# Check synchronization of configuration files
-		if not self.check_cfg():
+		if not self.check_cfg(snapshot):
 			safe=False
 
 		# Check existence of used logicals volumes
-		if not self.get_local_node().check_missing_lvs():
+		if not self.get_local_node().check_missing_lvs(snapshot[self.get_local_node().get_hostname()]):
 			safe=False
 
 		# Other checks
 		for node in self.get_nodes():
 			# Check (non)activation of LVs
-			if not node.check_activated_lvs():
+			if not node.check_activated_lvs(snapshot[node.get_hostname()]):
 				safe=False
 
 			# Check autostart link
-			if not node.check_autostart():
+			if not node.check_autostart(snapshot[node.get_hostname()]):
 				safe=False
 				
 		return safe
 
-	def check_bridges(self):
+	def check_bridges(self, snapshot=None):
 		"""Perform a check on briges configurations.
 
+		'snapshot' is an optional cluster's snapshot with 'bridges' entries (see snapshot()).
 		Return False if a bridge is missing somewhere.
 		"""
 		log.info("Checking bridges configurations...")
 		safe=True
 
+		if snapshot is None:
+			snapshot=self.snapshot(['bridges'])
+
 		# Get a dict with bridges of each nodes
 		nodes_bridges=dict()
-		for node in self.get_nodes():
-			nodes_bridges[node.get_hostname()]=node.get_bridges()
+		for node, values in snapshot.items():
+			nodes_bridges[node]=values['bridges']
 
 		log.debug("nodes_bridges=",nodes_bridges)
 
@@ -529,18 +747,22 @@ class XenCluster:
 
 		return safe
 
-	def check_cfg(self):
+	def check_cfg(self, snapshot=None):
 		"""Perform a check on configuration files.
 
+		'snapshot' is an optional cluster's snapshot with 'cfg' entries (see snapshot()).
 		Return False if a file is missing somewhere.
 		"""
 		log.info("Checking synchronization of configuration files...")
 		safe=True
 
+		if snapshot is None:
+			snapshot=self.snapshot(['cfg'])
+
 		# Get a dict with config files of each nodes
 		nodes_cfg=dict()
-		for node in self.get_nodes():
-			nodes_cfg[node.get_hostname()]=node.get_possible_vm_names()
+		for node, values in snapshot.items():
+			nodes_cfg[node]=values['cfg']
 
 		log.debug("nodes_cfg=",nodes_cfg)
 
@@ -582,15 +804,20 @@ class XenCluster:
 	# Next function are designed to be called from the daemon
 	# and report most messages via log.
 
-	def start_vms(self, vmnames):
+	def start_vms(self, vmnames, plan=None):
 		"""
-		Start the specified list of VM on the cluster, one after the other.
-		Nodes are choosen with a best-fit decreasing algorithm, so the cluster will not 
-		be balanced, but optimized for full-load.
+		Start the specified list of VM on the cluster, concurrently.
+		Nodes are chosen by the placement engine (see place_vms()), with their free ram,
+		irq and number of VMs, so the cluster will not be balanced, but optimized for full-load.
+		VMs are placed, and started, by decreasing priority (see VM.get_priority()) then by
+		decreasing size.
+		Starts are run by a StartScheduler, within START_MAX_PER_NODE concurrent starts by node.
 		This function is error-proof: if a vm start to fail, it will try to start others vms 
 		and report all errors only at the end.
 
 		vmnames - (List of String) VM hostnames 
+		plan - (dict) Optional failover plan (see get_failover_plan()). The planned node
+		       is used if it still has room for the VM.
 
 		Raise a MultipleError if one of many errors are detected.
 		"""
@@ -600,62 +827,75 @@ class XenCluster:
 		# Get nodes
 		pool=self.get_nodes()
 
-		# Sort VMs to be started by ram
+		# Sort VMs to be started by priority, then by ram
 		vms=[ VM(name) for name in vmnames ]
-		vms.sort(key=lambda x: x.get_start_ram(), reverse=True)
-		
-		failed=dict()
-		for vm in vms:
-			selected_node=None
+		vms.sort(key=lambda x: (x.get_priority(), x.get_start_ram()), reverse=True)
 
+		# Without index, check all VMs against a single snapshot
+		snapshot=None
+		if self.vm_index is None and len(vms) > 0:
+			snapshot=self.snapshot(['vms'])
+
+		stopped=list()
+		for vm in vms:
 			# Check if vm is already started somewhere
-			nodes=self.search_vm_started(vm.name)
+			nodes=self.locate_vm(vm.name, snapshot)
 			if(len(nodes)>0):
 				log.info("%s is already started on %s." % (vm.name, ", ".join([n.get_hostname() for n in nodes])))
-				continue
-	
-			# Sort nodes by free ram
-			pool.sort(key=lambda x: x.metrics.get_free_ram(False))
-			for node in pool:
-				if node.metrics.get_free_ram() >= vm.get_start_ram():
-					selected_node=node
-					break # Select first node with enough space
-
-			if selected_node is None:
+			else:
+				stopped.append(vm)
+
+		(selected, unplaced, capacities)=self.place_vms([ (vm.name, vm.get_demand()) for vm in stopped ], pool, plan,
+			dict([ (vm.name, vm.get_priority()) for vm in stopped ]))
+
+		scheduler=StartScheduler(self)
+		failed=dict()
+		for vm in stopped:
+			if vm.name in unplaced:
 				# Not enough room for this one
 				failed[vm.name]=NotEnoughRamError("this cluster", "Cannot start "+vm.name)
 				continue  # Next !
 
-			log.info("Starting", vm.name, "on", selected_node.get_hostname())
+			scheduler.add(vm.name, selected[vm.name])
 
-			# Start the vm 
-			try:
-				self.activate_vm(node,vm.name)
-
-				try:
-					selected_node.start(vm.name)
-				except SystemExit, e:
-					# SystemExit are raised by Xen when xm_create fail
-					node.deactivate_lv(vm.name)
-					failed[vm.name]=XenError(node.get_hostname(), str(e))
-				except Exception, e:
-					node.deactivate_lv(vm.name)
-					failed[vm.name]=e
-				else:
-					try:
-						selected_node.enable_vm_autostart(vm.name)
-					except Exception, e:
-						# Don't report failure as an error, autostart link is not important
-						log.warn("Cannot enable autostart for %s : %s" % (vm.name, e))
-			except Exception, e:
-				# If activation fail, don't try to deactivate, will surely fail too.
-				# If deactivation fail, don't panic right now and try to start others vm.
-				failed[vm.name]=e
+		# Run starts concurrently
+		try:
+			scheduler.run()
+		except MultipleError, e:
+			failed.update(e.value)
 				
 		# Raise final error after all start attempts
 		if len(failed)>0:
 			raise MultipleError(failed)
 
+	def restart_vm(self, vmname, hostname):
+		"""
+		Activate the LVs of the specified VM exclusively on the given node, and start it there.
+		Ram is not checked, see start_vms().
+
+		Raise an Exception if the VM cannot be started.
+		"""
+		node=self.get_node(hostname)
+
+		# If activation fail, don't try to deactivate, will surely fail too.
+		self.activate_vm(node,vmname)
+
+		try:
+			node.start(vmname)
+		except SystemExit, e:
+			# SystemExit are raised by Xen when xm_create fail
+			node.deactivate_lv(vmname)
+			raise XenError(hostname, str(e))
+		except Exception, e:
+			node.deactivate_lv(vmname)
+			raise
+
+		try:
+			node.enable_vm_autostart(vmname)
+		except Exception, e:
+			# Don't report failure as an error, autostart link is not important
+			log.warn("Cannot enable autostart for %s : %s" % (vmname, e))
+
 	def recover(self, name, vm_list, partial_failure):
 		"""
 		Try to recover a node from a failure, by migrating or re-starting vm.
@@ -718,9 +958,13 @@ class XenCluster:
 		# Remove fenced node from current cluster instance
 		if name in self.nodes.keys():
 			del self.nodes[name]
+		if self.vm_index is not None:
+			for hostnames in self.vm_index.values():
+				if name in hostnames:
+					hostnames.remove(name)
 
 		log.info("Restarting dead VM from %s on healthy nodes..." % (name))
-		self.start_vms(vm_list)
+		self.start_vms(vm_list, self.get_failover_plan(name, vm_list))
 
 		return True
 
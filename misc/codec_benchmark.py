@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2010-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+
+
+"""
+Benchmark of the UDP messages codecs.
+
+For each message and each codec, print the size of the datagram and the
+number of messages encoded and decoded per second.
+
+Usage: codec_benchmark.py [nodes vms]
+"""
+
+import sys, time
+sys.path += ["lib", "../lib"]
+
+# Don't load /etc/xen/cxm.conf
+import cxm.core
+cxm.core.load_cfg = lambda: None
+from cxm import codec
+
+DURATION=1		# Time spent on each measure, in seconds
+
+def create_messages(nb_nodes, nb_vms):
+	"""Return a list of (name, message) with the messages of a cluster of the given size."""
+	status=dict()
+	for i in range(nb_nodes):
+		vms=[ "vm%03d-%02d.example.com" % (j, i) for j in range(nb_vms) ]
+		status["node%02d.example.com" % (i)]={'timestamp': 1325845000+i, 'offset': i%3-1, 'vms': vms}
+
+	# One node has a new vm
+	delta=dict()
+	for (name, entry) in status.items():
+		delta[name]={'timestamp': entry['timestamp'], 'offset': entry['offset']}
+	delta[name]['vms']=entry['vms']+['vm-new.example.com']
+
+	return [
+		("slavehb", {'type': 'slavehb', 'data': {'cluster': 'mycluster', 'ts': 1325845000, 'vms': vms}}),
+		("masterhb full", {'type': 'masterhb', 'data': {'cluster': 'mycluster', 'state': 'normal',
+			'seq': 1, 'full': True, 'status': status}}),
+		("masterhb delta", {'type': 'masterhb', 'data': {'cluster': 'mycluster', 'state': 'normal',
+			'seq': 2, 'full': False, 'status': delta}}),
+		("voteresponse", {'type': 'voteresponse', 'data': {'cluster': 'mycluster', 'ballot': 67890, 'election': 12345}}),
+	]
+
+def rate(function, arg):
+	"""Return the number of calls per second of function(arg)."""
+	count=0
+	start=time.time()
+	while time.time()-start < DURATION:
+		for i in range(100):
+			function(arg)
+		count+=100
+	return count/(time.time()-start)
+
+def main():
+	if len(sys.argv) > 2:
+		sizes=[ (int(sys.argv[1]), int(sys.argv[2])) ]
+	else:
+		sizes=[ (4, 10), (16, 40), (64, 40) ]
+
+	print "%-8s %-16s %-8s %8s %12s %12s" % ("cluster", "message", "codec", "size", "encode/s", "decode/s")
+	for (nb_nodes, nb_vms) in sizes:
+		for (name, msg) in create_messages(nb_nodes, nb_vms):
+			for format in sorted(codec.CODECS.keys()):
+				c=codec.CODECS[format]()
+				data=c.encode(msg)
+				print "%-8s %-16s %-8s %8d %12d %12d" % ("%dx%d" % (nb_nodes, nb_vms), name, format,
+					len(data), rate(c.encode, msg), rate(codec.decode, data))
+		print
+
+if __name__ == "__main__":
+	main()
+
+# vim: ts=4:sw=4:ai
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2010-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+
+
+"""
+Benchmark of the loadbalancer's strategies on synthetic clusters.
+
+For each cluster and each time budget, print the score reached by each strategy,
+the gain and the number of migrations of the plan, and the time really used.
+
+Usage: lb_benchmark.py [nodes vms [budget ...]]
+"""
+
+import sys, time, random
+sys.path += ["lib", "../lib"]
+
+# Don't load /etc/xen/cxm.conf
+import cxm.core
+cxm.core.load_cfg = lambda: None
+from cxm import core, loadbalancer
+
+SEED=42			# Clusters are always the same
+FILL=0.85		# Ratio of used RAM on the cluster
+
+def create_cluster(nb_nodes, nb_vms, seed=SEED):
+	"""Return a random (state, vm_metrics, node_metrics) tuple, with unbalanced nodes."""
+	rand=random.Random(seed)
+
+	node_metrics=dict()
+	for i in range(nb_nodes):
+		node_metrics["node%02d" % i]={ 'ram': rand.choice([16384, 32768]) }
+
+	vm_metrics=dict()
+	for i in range(nb_vms):
+		vm_metrics["vm%03d" % i]={ 'ram': rand.choice([512, 1024, 2048, 4096]), 'cpu': rand.random()*100 }
+
+	# Fill nodes in order, so the first ones are loaded
+	state=dict([ (node, []) for node in node_metrics ])
+	free=dict([ (node, node_metrics[node]['ram']*FILL) for node in node_metrics ])
+	nodes=sorted(node_metrics.keys())
+	for vm in sorted(vm_metrics.keys()):
+		for node in nodes:
+			if free[node] >= vm_metrics[vm]['ram'] and len(state[node]) < core.cfg['LB_MAX_VM_PER_NODE']:
+				state[node].append(vm)
+				free[node]-=vm_metrics[vm]['ram']
+				break
+		else:
+			del vm_metrics[vm] # Cluster is full
+
+	return (state, vm_metrics, node_metrics)
+
+def run(cluster, strategy, budget):
+	"""Return the (score, number of migrations, elapsed time) of the given strategy."""
+	(state, vm_metrics, node_metrics)=cluster
+	lb=loadbalancer.LoadBalancer(state)
+	lb.set_metrics(vm_metrics, node_metrics)
+
+	start=time.time()
+	solution=lb.get_solution(strategy, budget)
+	elapsed=time.time()-start
+
+	if solution is None:
+		return (lb.root.score, 0, elapsed)
+	return (solution.score, len(solution.get_path()), elapsed)
+
+def main():
+	core.cfg['LB_MIN_GAIN']=10
+	core.cfg['LB_MAX_MIGRATION']=5
+
+	if len(sys.argv) > 2:
+		sizes=[ (int(sys.argv[1]), int(sys.argv[2])) ]
+	else:
+		sizes=[ (4, 20), (8, 60), (16, 150) ]
+
+	if len(sys.argv) > 3:
+		budgets=[ int(budget) for budget in sys.argv[3:] ]
+	else:
+		budgets=[ 1, 5, 15 ]
+
+	print "%-12s %-10s %6s %10s %8s %6s %8s" % ("cluster", "strategy", "budget", "score", "gain", "migr.", "time")
+	for (nb_nodes, nb_vms) in sizes:
+		cluster=create_cluster(nb_nodes, nb_vms)
+		initial=loadbalancer.LoadBalancer(cluster[0])
+		initial.set_metrics(cluster[1], cluster[2])
+		name="%dx%d" % (nb_nodes, len(cluster[1]))
+
+		for budget in budgets:
+			for strategy in sorted(loadbalancer.STRATEGIES.keys()):
+				(score, migrations, elapsed)=run(cluster, strategy, budget)
+				gain=((initial.root.score-score)*100)/initial.root.score
+				print "%-12s %-10s %6d %10.3f %7.1f%% %6d %7.2fs" % (name, strategy, budget, score, gain, migrations, elapsed)
+			print
+
+if __name__ == "__main__":
+	main()
+
+# vim: ts=4:sw=4:ai
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2010-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+
+
+"""
+Benchmark of the placement strategies.
+
+For each generated recovery and each strategy, print the number of VMs
+placed, the RAM left unplaced and the time spent.
+
+Usage: placement_benchmark.py [nodes vms]
+"""
+
+import sys, time, random
+sys.path += ["lib", "../lib"]
+
+# Don't load /etc/xen/cxm.conf
+import cxm.core
+cxm.core.load_cfg = lambda: None
+from cxm import placement
+
+SEED=42			# Same workloads on each run
+RUNS=10			# Generated recoveries per size
+
+def create_recovery(nb_nodes, nb_vms):
+	"""Return (vms, nodes, priorities) for the loss of a node, with surviving nodes nearly full."""
+	vms=list()
+	priorities=dict()
+	for i in range(nb_vms):
+		name="vm%03d.example.com" % (i)
+		vms.append((name, {'ram': random.choice([256, 512, 1024, 2048, 4096]),
+			'irq': random.randint(3, 10), 'vms': 1}))
+		priorities[name]=random.choice([0, 0, 0, 10])
+
+	# Surviving nodes can hold about the ram of the lost node
+	total=sum([ demand['ram'] for name, demand in vms ])
+	nodes=list()
+	for i in range(nb_nodes):
+		nodes.append(("node%02d.example.com" % (i), {'ram': int(total/nb_nodes*random.uniform(0.7, 1.2)),
+			'irq': random.randint(100, placement.MAX_IRQ), 'vms': random.randint(nb_vms/nb_nodes, 30)}))
+
+	return (vms, nodes, priorities)
+
+def main():
+	if len(sys.argv) > 2:
+		sizes=[ (int(sys.argv[1]), int(sys.argv[2])) ]
+	else:
+		sizes=[ (3, 8), (4, 12), (8, 40), (32, 200) ]
+
+	random.seed(SEED)
+	print "%-8s %-8s %10s %14s %10s" % ("cluster", "strategy", "placed", "unplaced ram", "time (ms)")
+	for (nb_nodes, nb_vms) in sizes:
+		recoveries=[ create_recovery(nb_nodes, nb_vms) for i in range(RUNS) ]
+		for strategy in placement.STRATEGIES:
+			placed=0
+			unplaced_ram=0
+			start=time.time()
+			for (vms, nodes, priorities) in recoveries:
+				(selected, unplaced, free)=placement.place(vms, nodes, strategy, priorities)
+				placed+=len(selected)
+				unplaced_ram+=sum([ demand['ram'] for name, demand in vms if name in unplaced ])
+			elapsed=(time.time()-start)*1000/RUNS
+
+			print "%-8s %-8s %10.1f %14.1f %10.2f" % ("%dx%d" % (nb_nodes, nb_vms), strategy,
+				float(placed)/RUNS, float(unplaced_ram)/RUNS, elapsed)
+		print
+
+if __name__ == "__main__":
+	main()
+
+# vim: ts=4:sw=4:ai
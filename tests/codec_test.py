@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2010-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+
+from cxm.codec import *
+from cxm.master import MasterService
+from cxm.messages import MessageHelper
+import cxm
+import unittest, struct, zlib
+from mocker import *
+
+class CodecTests(MockerTestCase):
+
+	def setUp(self):
+		self.msgs = [
+			{'type': 'slavehb', 'data': {'cluster': 'mycluster', 'ts': 1325845000, 'vms': ['vm1', 'vm2']}},
+			{'type': 'masterhb', 'data': {'cluster': 'mycluster', 'state': MasterService.ST_PANIC, 'seq': 300, 'full': True,
+				'status': {
+					'node1': {'timestamp': 1325845000, 'offset': -2, 'vms': ['vm1', 'vm2']},
+					'node2': {'timestamp': 0, 'offset': 0, 'vms': []},
+				}}},
+			{'type': 'masterhb', 'data': {'cluster': 'mycluster', 'state': MasterService.ST_NORMAL, 'seq': 301, 'full': False,
+				'status': {
+					'node1': {'timestamp': 1325845001, 'offset': 1},
+					'node2': {'timestamp': 1325845001, 'offset': 0, 'vms': ['vm3']},
+				}}},
+			{'type': 'slavehb', 'data': {'cluster': 'mycluster', 'ts': 1325845000, 'vms': ['vm1', 'vm2'],
+				'metrics': {'free_ram': 1024, 'available_ram': 3072, 'used_irq': 42,
+					'vms': {'vm1': {'ram': 1024, 'cpu': 12.5}, 'vm2': {'ram': 1024, 'cpu': 0}}}}},
+			{'type': 'voterequest', 'data': {'cluster': 'mycluster', 'election': 12345}},
+			{'type': 'voteresponse', 'data': {'cluster': 'mycluster', 'ballot': 67890, 'election': 12345}},
+		]
+
+	def test_encode(self):
+		for codec in [JSONCodec(), BinaryCodec()]:
+			for msg in self.msgs:
+				self.assertEquals(codec.decode(codec.encode(msg)), msg)
+
+	def test_encode__big(self):
+		msg={'type': 'slavehb', 'data': {'cluster': 'mycluster', 'ts': 1325845000,
+			'vms': [ "vm%03d.home.net" % (i) for i in range(100) ]}}
+
+		data=BinaryCodec().encode(msg)
+		self.assertTrue(len(data) < len(JSONCodec().encode(msg)))
+		self.assertEquals(BinaryCodec().decode(data), msg)
+
+	def test_encode__unicode(self):
+		msg={'type': 'slavehb', 'data': {'cluster': u'mycluster', 'ts': 1325845000, 'vms': [u'vm1']}}
+		self.assertEquals(BinaryCodec().decode(BinaryCodec().encode(msg)), msg)
+
+	def test_decode(self):
+		# Both formats are understood
+		for codec in [JSONCodec(), BinaryCodec()]:
+			self.assertEquals(decode(codec.encode(self.msgs[0])), self.msgs[0])
+
+	def test_decode__corrupted(self):
+		data=BinaryCodec().encode(self.msgs[1])
+		self.assertRaises(CodecError, decode, data[:-1]+chr((ord(data[-1])+1)%256))
+		self.assertRaises(CodecError, decode, data[:BinaryCodec.HEADER_SIZE-1])
+
+		data=JSONCodec().encode(self.msgs[1])
+		self.assertRaises(CodecError, decode, data[:-1])
+
+	def test_decode__truncated(self):
+		data=BinaryCodec().encode(self.msgs[1])[:-3]
+		data=data[:BinaryCodec.HEADER_SIZE-4]+struct.pack(">I", zlib.crc32(data[BinaryCodec.HEADER_SIZE:]) & 0xffffffff)+data[BinaryCodec.HEADER_SIZE:]
+		self.assertRaises(CodecError, decode, data)
+
+	def test_get_codec(self):
+		cxm.core.cfg['WIRE_FORMAT']="binary"
+		self.assertTrue(isinstance(get_codec(), BinaryCodec))
+		cxm.core.cfg['WIRE_FORMAT']="non-exist"
+		self.assertRaises(CodecError, get_codec)
+		cxm.core.cfg['WIRE_FORMAT']="json"
+		self.assertTrue(isinstance(get_codec(), JSONCodec))
+
+	def test_constants(self):
+		self.assertEquals(sorted(BinaryCodec.TYPES), sorted(MessageHelper.map.keys()))
+		self.assertEquals(sorted(BinaryCodec.STATES),
+			sorted([MasterService.ST_NORMAL, MasterService.ST_PANIC, MasterService.ST_RECOVERY]))
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: ts=4:sw=4:ai
@@ -25,7 +25,7 @@
 
 from cxm.diskheartbeat import *
 import cxm
-import unittest
+import unittest, tempfile, os, time
 from mocker import *
 
 class DiskHeartbeatTests(MockerTestCase):
@@ -65,6 +65,266 @@ class DiskHeartbeatTests(MockerTestCase):
 		
 		self.assertEquals(DiskHeartbeat.is_in_use(), False)
 
+class HeartbeatWriterTests(unittest.TestCase):
+
+	def setUp(self):
+		self.path=tempfile.mktemp()
+		cxm.core.cfg['HB_DISK']=self.path
+		DiskHeartbeat.format()
+		self.disk=DiskHeartbeat()
+		self.disk.make_slot("node1")
+		self.disk.make_slot("node2")
+
+	def tearDown(self):
+		os.unlink(self.path)
+
+	def test_pulse(self):
+		writer=HeartbeatWriter("node2")
+		writer.pulse()
+		self.assertEquals(writer.offset, 5*DiskHeartbeat.BS)
+		self.assertTrue(abs(self.disk.get_ts("node2")-time.time()) <= 1)
+		self.assertEquals(self.disk.get_ts("node1"), 0)
+		writer.close()
+
+	def test_pulse__moved(self):
+		writer=HeartbeatWriter("node2")
+		writer.pulse()
+
+		# Slot of node2 is now the first one
+		self.disk.erase_slot("node1")
+		self.disk.erase_slot("node2")
+		self.disk.make_slot("node2")
+
+		writer.pulses=HeartbeatWriter.REVALIDATE
+		writer.pulse()
+		self.assertEquals(writer.offset, 3*DiskHeartbeat.BS)
+		self.assertTrue(abs(self.disk.get_ts("node2")-time.time()) <= 1)
+		writer.close()
+
+	def test_pulse__noslot(self):
+		writer=HeartbeatWriter("node3")
+		self.assertRaises(DiskHeartbeatError, writer.pulse)
+		self.assertEquals(writer.fd, None)
+
+class GetAllTsTests(unittest.TestCase):
+
+	def setUp(self):
+		self.path=tempfile.mktemp()
+		cxm.core.cfg['HB_DISK']=self.path
+		DiskHeartbeat.format()
+		self.disk=DiskHeartbeat()
+
+	def tearDown(self):
+		os.unlink(self.path)
+
+	def test_get_all_ts(self):
+		self.disk.make_slot("node1")
+		self.disk.make_slot("node2")
+		self.disk.make_slot("node3")
+		self.disk.erase_slot("node2")
+		self.disk.write_ts("node3")
+
+		ts=self.disk.get_all_ts()
+		self.assertEquals(sorted(ts.keys()), ["node1", "node3"])
+		self.assertEquals(ts['node1'], 0)
+		self.assertTrue(abs(ts['node3']-time.time()) <= 1)
+		self.assertTrue(self.disk.last_scan_latency >= 0)
+
+	def test_get_all_ts__empty(self):
+		self.assertEquals(self.disk.get_all_ts(), dict())
+
+	def test_get_all_ts__badmagic(self):
+		f=open(self.path, "r+b")
+		f.write("\x00"*DiskHeartbeat.BS)
+		f.close()
+
+		self.assertRaises(DiskHeartbeatError, self.disk.get_all_ts)
+
+	def test_get_all_ts__cached(self):
+		self.disk.make_slot("node1")
+		cached=tempfile.mktemp()
+		os.system("cp %s %s" % (self.path, cached))
+		self.disk.write_ts("node1")
+
+		# Without O_DIRECT, read the old copy of the disk from the page cache
+		def fake_open(path, flags, *args):
+			if not flags & getattr(os, 'O_DIRECT', 0):
+				path=cached
+			return real_open(path, flags & ~getattr(os, 'O_DIRECT', 0), *args)
+		real_open=os.open
+		os.open=fake_open
+		try:
+			ts=self.disk.get_all_ts()
+		finally:
+			os.open=real_open
+			os.unlink(cached)
+
+		self.assertTrue(abs(ts['node1']-time.time()) <= 1)
+
+	def test_get_all_ts__short(self):
+		f=open(self.path, "r+b")
+		f.truncate(DiskHeartbeat.BS*4)
+		f.close()
+
+		self.assertRaises(DiskHeartbeatError, self.disk.get_all_ts)
+
+class DiskHeartbeatV2Tests(unittest.TestCase):
+
+	def setUp(self):
+		self.path=tempfile.mktemp()
+		cxm.core.cfg['HB_DISK']=self.path
+		DiskHeartbeat.format(2)
+		self.disk=DiskHeartbeat()
+
+	def tearDown(self):
+		os.unlink(self.path)
+
+	def test_format(self):
+		self.assertEquals(self.disk.version, 2)
+		self.assertEquals(os.path.getsize(self.path), DiskHeartbeat.BS+DiskHeartbeat.MAX_SLOT_V2*DiskHeartbeat.SECTOR)
+		self.assertEquals(DiskHeartbeat.is_in_use(), False)
+
+	def test_record(self):
+		data=DiskHeartbeat.pack_record("node1", 42, 1234567890)
+		self.assertEquals(len(data), DiskHeartbeat.SECTOR)
+		self.assertEquals(DiskHeartbeat.unpack_record(data), ("node1", 42, 1234567890))
+		self.assertEquals(DiskHeartbeat.unpack_record("\x00"*DiskHeartbeat.SECTOR), None)
+
+	def test_record__corrupted(self):
+		data=DiskHeartbeat.pack_record("node1", 42, 1234567890)
+		self.assertRaises(DiskHeartbeatError, DiskHeartbeat.unpack_record, data[:30]+"X"+data[31:])
+
+	def test_slots(self):
+		self.disk.make_slot("node1")
+		self.disk.make_slot("node2")
+		self.assertRaises(DiskHeartbeatError, self.disk.make_slot, "node2")
+		self.assertEquals(self.disk.get_nr_node(), 2)
+		self.assertEquals(self.disk.get_slot_offset("node2"), DiskHeartbeat.BS+DiskHeartbeat.SECTOR)
+
+		self.disk.write_ts("node2")
+		self.assertTrue(abs(self.disk.get_ts("node2")-time.time()) <= 1)
+
+		self.disk.erase_slot("node1")
+		self.assertEquals(self.disk.get_nr_node(), 1)
+		self.assertRaises(DiskHeartbeatError, self.disk.get_ts, "node1")
+
+		# First empty slot is reused
+		self.disk.make_slot("node3")
+		self.assertEquals(self.disk.get_slot_offset("node3"), DiskHeartbeat.BS)
+
+	def test_make_slot__full(self):
+		for i in range(DiskHeartbeat.MAX_SLOT_V2):
+			self.disk.make_slot("node%d" % (i))
+		self.assertRaises(DiskHeartbeatError, self.disk.make_slot, "node")
+
+	def test_get_all_ts(self):
+		self.disk.make_slot("node1")
+		self.disk.make_slot("node2")
+		self.disk.write_ts("node2")
+
+		ts=self.disk.get_all_ts()
+		self.assertEquals(sorted(ts.keys()), ["node1", "node2"])
+		self.assertEquals(ts['node1'], 0)
+		self.assertTrue(abs(ts['node2']-time.time()) <= 1)
+
+	def test_get_all_ts__corrupted(self):
+		self.disk.make_slot("node1")
+		self.disk.make_slot("node2")
+		self.disk.make_slot("node3")
+		self.disk.write_ts("node3")
+		self.corrupt(1)
+
+		# Only the corrupted slot is skipped
+		ts=self.disk.get_all_ts()
+		self.assertEquals(sorted(ts.keys()), ["node1", "node3"])
+		self.assertTrue(abs(ts['node3']-time.time()) <= 1)
+		self.assertEquals(self.disk.corrupted_slots, [1])
+
+	def corrupt(self, index):
+		f=open(self.path, "r+b")
+		f.seek(DiskHeartbeat.BS+index*DiskHeartbeat.SECTOR+30)
+		f.write("X")
+		f.close()
+
+	def test_slots__corrupted(self):
+		self.disk.make_slot("node1")
+		self.disk.make_slot("node2")
+		self.disk.make_slot("node3")
+		self.corrupt(0)
+
+		# Others slots are still usable
+		self.disk.write_ts("node2")
+		self.assertTrue(abs(self.disk.get_ts("node2")-time.time()) <= 1)
+		self.assertEquals(self.disk.get_slot_offset("node3"), DiskHeartbeat.BS+2*DiskHeartbeat.SECTOR)
+		self.assertEquals(self.disk.get_nr_node(), 2)
+		self.assertEquals(self.disk.corrupted_slots, [0])
+		self.disk.erase_slot("node3")
+		self.assertRaises(DiskHeartbeatError, self.disk.get_ts, "node3")
+
+		# Corrupted slot is not taken while an empty one is left
+		self.disk.make_slot("node4")
+		self.assertEquals(self.disk.get_slot_offset("node4"), DiskHeartbeat.BS+2*DiskHeartbeat.SECTOR)
+
+	def test_make_slot__corrupted(self):
+		for i in range(DiskHeartbeat.MAX_SLOT_V2):
+			self.disk.make_slot("node%d" % (i))
+		self.corrupt(5)
+
+		self.disk.make_slot("node")
+		self.assertEquals(self.disk.get_slot_offset("node"), DiskHeartbeat.BS+5*DiskHeartbeat.SECTOR)
+		self.assertEquals(self.disk.corrupted_slots, [])
+		self.assertRaises(DiskHeartbeatError, self.disk.make_slot, "node5")
+
+	def test_pulse__corrupted(self):
+		self.disk.make_slot("node1")
+		self.disk.make_slot("node2")
+		self.corrupt(0)
+
+		writer=HeartbeatWriter("node2")
+		writer.pulse()
+		self.assertEquals(writer.offset, DiskHeartbeat.BS+DiskHeartbeat.SECTOR)
+		self.assertTrue(abs(self.disk.get_ts("node2")-time.time()) <= 1)
+		writer.close()
+
+	def test_pulse(self):
+		self.disk.make_slot("node1")
+		self.disk.make_slot("node2")
+
+		writer=HeartbeatWriter("node2")
+		writer.pulse()
+		writer.pulse()
+		self.assertEquals(writer.offset, DiskHeartbeat.BS+DiskHeartbeat.SECTOR)
+		self.assertTrue(abs(self.disk.get_ts("node2")-time.time()) <= 1)
+		f=open(self.path, "rb")
+		f.seek(writer.offset)
+		self.assertEquals(DiskHeartbeat.unpack_record(f.read(DiskHeartbeat.SECTOR))[1], 2)
+		f.close()
+		self.assertEquals(self.disk.get_ts("node1"), 0)
+		writer.close()
+
+		# Sequence number is kept across handles
+		writer=HeartbeatWriter("node2")
+		writer.pulse()
+		self.assertEquals(writer.seq, 3)
+		writer.close()
+
+	def test_pulse__moved(self):
+		self.disk.make_slot("node1")
+		self.disk.make_slot("node2")
+
+		writer=HeartbeatWriter("node2")
+		writer.pulse()
+
+		self.disk.erase_slot("node1")
+		self.disk.erase_slot("node2")
+		self.disk.make_slot("node2")
+
+		writer.pulses=HeartbeatWriter.REVALIDATE
+		writer.pulse()
+		self.assertEquals(writer.offset, DiskHeartbeat.BS)
+		self.assertTrue(abs(self.disk.get_ts("node2")-time.time()) <= 1)
+		writer.close()
+
 if __name__ == "__main__":
     unittest.main()
 
@@ -91,12 +91,59 @@ class DNSCacheTests(unittest.TestCase, MockerTestCase):
 		return d
 	
 	def test_get_by_ip__notincache(self):
+		def check(result):
+			self.assertEqual(result, "good.dns.name")
+			self.assertEqual(self.dc.get_by_ip("1.1.1.1"), "good.dns.name")
+			stats=self.dc.get_stats()
+			self.assertEqual((stats['misses'], stats['lookups'], stats['hits'], stats['pending']), (1, 1, 1, 0))
+
 		ghba = self.mocker.replace(socket.gethostbyaddr)
 		ghba("1.1.1.1")
 		self.mocker.result(["good.dns.name"])
 		self.mocker.replay()
 		
+		# Resolved in background
+		self.assertRaises(cxm.dnscache.DNSCacheMiss, self.dc.get_by_ip, "1.1.1.1")
+		d=self.dc.resolve_ip("1.1.1.1")
+		d.addCallback(check)
+		return d
+
+	def test_get_by_ip__failed(self):
+		def check(result):
+			# Negative entry is cached
+			self.assertRaises(cxm.dnscache.DNSCacheMiss, self.dc.get_by_ip, "1.1.1.1")
+			stats=self.dc.get_stats()
+			self.assertEqual((stats['lookups'], stats['failures'], stats['negative_hits']), (1, 1, 1))
+
+		ghba = self.mocker.replace(socket.gethostbyaddr)
+		ghba("1.1.1.1")
+		self.mocker.throw(socket.herror("Unknown host"))
+		self.mocker.replay()
+
+		d=self.dc.resolve_ip("1.1.1.1")
+		d=self.assertFailure(d, socket.herror)
+		d.addCallback(check)
+		return d
+
+	def test_get_by_ip__expired(self):
+		def check(result):
+			self.assertEqual(result, "new.dns.name")
+			self.assertEqual(self.dc.get_by_ip("1.1.1.1"), "new.dns.name")
+
+		ghba = self.mocker.replace(socket.gethostbyaddr)
+		ghba("1.1.1.1")
+		self.mocker.result(["new.dns.name"])
+		self.mocker.replay()
+
+		self.dc._feedCache("1.1.1.1", "good.dns.name")
+		self.dc._expire["1.1.1.1"]=0
+
+		# Old name is used while refreshing
 		self.assertEqual(self.dc.get_by_ip("1.1.1.1"), "good.dns.name")
+		self.assertEqual(self.dc.get_stats()['stale_hits'], 1)
+		d=self.dc.resolve_ip("1.1.1.1")
+		d.addCallback(check)
+		return d
 
 # vim: ts=4:sw=4:ai
 
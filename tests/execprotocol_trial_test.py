@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2010-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+
+# Use Twisted's trial to run this tests
+
+from cxm.execprotocol import spawnCommand, ChannelReader
+import cxm, cxm.node
+from twisted.trial import unittest
+from mocker import *
+import os
+
+# Trial run tests in its own directory
+RUN=os.path.join(os.path.dirname(os.path.abspath(__file__)), "stubs/bin/run")
+
+class FakeChannel(object):
+
+	"""Paramiko's channel whose transport deliver the last data with the exit status."""
+
+	def __init__(self, chunks):
+		self.chunks=chunks
+		self.pending=list()
+		self.closed=False
+
+	def exit_status_ready(self):
+		# The transport's thread receive the last data and the exit status at once
+		self.pending.extend(self.chunks)
+		self.chunks=list()
+		return True
+
+	def recv_exit_status(self):
+		return 0
+
+	def recv_ready(self):
+		return len(self.pending) > 0
+
+	def recv(self, size):
+		return self.pending.pop(0)
+
+	def recv_stderr_ready(self):
+		return False
+
+	def close(self):
+		self.closed=True
+
+	def fileno(self):
+		return -1
+
+
+class ExecProtocolTrialTests(unittest.TestCase, MockerTestCase):
+
+	def setUp(self):
+		cxm.core.cfg['PATH'] = "tests/stubs/bin/"
+		cxm.core.cfg['QUIET']=True
+
+		self.node = self.mocker.mock()
+		self.node.is_local_node()
+		self.mocker.result(True)
+		self.node.hostname
+		self.mocker.result("node1")
+		self.mocker.count(0, None)
+		self.mocker.replay()
+
+	def test_spawnCommand(self):
+		def checkResult(result):
+			self.assertEqual(len(result), 10000)
+			self.assertEqual(result[-1], "Line 10000 on stdout\n")
+
+		d=spawnCommand(self.node, RUN+" big")
+		d.addCallback(checkResult)
+		return d
+
+	def test_spawnCommand__lineReceived(self):
+		lines=list()
+
+		def checkResult(result):
+			self.assertEqual(result, None)
+			self.assertEqual(lines, ["OK\n"])
+
+		d=spawnCommand(self.node, RUN+" success", lines.append)
+		d.addCallback(checkResult)
+		return d
+
+	def test_spawnCommand__error(self):
+		def checkError(failure):
+			failure.trap(cxm.node.ShellError)
+			self.assertEqual(failure.value.value, "FAILURE\n")
+			self.assertEqual(failure.value.exitcode, 2)
+
+		d=spawnCommand(self.node, RUN+" failure")
+		d.addCallbacks(lambda _: self.fail("ShellError not raised"), checkError)
+		return d
+
+	def test_spawnCommand__timeout(self):
+		def checkError(failure):
+			failure.trap(cxm.node.ShellTimeoutError)
+
+		d=spawnCommand(self.node, RUN+" sleep", None, 0.5)
+		d.addCallbacks(lambda _: self.fail("ShellTimeoutError not raised"), checkError)
+		return d
+
+
+class ChannelReaderTrialTests(unittest.TestCase):
+
+	def test_doRead__exit_with_last_data(self):
+		def checkResult(result):
+			self.assertEqual(result, ["line1\n", "last line\n"])
+			self.assertTrue(chan.closed)
+
+		chan=FakeChannel(["line1\nlast", " line\n"])
+		reader=ChannelReader("node1", chan, "cmd")
+		reader.doRead()
+		reader.deferred.addCallback(checkResult)
+		return reader.deferred
+
+
+# vim: ts=4:sw=4:ai
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2010-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+
+from cxm.failoverplan import *
+import cxm.core
+import unittest
+from mocker import *
+
+class FailoverPlanTests(MockerTestCase):
+
+	def setUp(self):
+		self.status={
+			'node1': {'timestamp': 0, 'offset': 0, 'vms': ['vm1', 'vm2']},
+			'node2': {'timestamp': 0, 'offset': 0, 'vms': ['vm3']},
+			'node3': {'timestamp': 0, 'offset': 0, 'vms': []},
+		}
+		self.metrics={
+			'node1': {'timestamp': 1000, 'free_ram': 512, 'used_irq': 100, 'vms': {'vm1': {'ram': 1024}, 'vm2': {'ram': 256}}},
+			'node2': {'timestamp': 1002, 'free_ram': 768, 'used_irq': 100, 'vms': {'vm3': {'ram': 512}}},
+			'node3': {'timestamp': 1001, 'free_ram': 1024, 'used_irq': 24, 'vms': {}},
+		}
+		self.planner=FailoverPlanner()
+		cxm.core.cfg['LB_MAX_VM_PER_NODE']=20
+		cxm.core.cfg['PLACEMENT_STRATEGY']="bfd"
+
+	def test_get_capacities(self):
+		self.assertEquals(get_capacities(self.metrics['node2']), {'ram': 768, 'irq': 924, 'vms': 19})
+
+	def test_compute(self):
+		self.assertTrue(self.planner.compute(self.status, self.metrics, 1005))
+		self.assertEquals(self.planner.timestamp, 1005)
+		self.assertEquals(self.planner.get_plan('node1'), {
+			'timestamp': 1000,
+			'vms': {'vm1': 1024, 'vm2': 256},
+			'capacities': {'node2': {'ram': 768, 'irq': 924, 'vms': 19}, 'node3': {'ram': 1024, 'irq': 1000, 'vms': 20}},
+			'placement': {'vm1': 'node3', 'vm2': 'node2'},
+			'unplaced': [],
+		})
+		self.assertEquals(self.planner.get_plan('node2')['placement'], {'vm3': 'node1'})
+		self.assertEquals(self.planner.get_plan('node3')['placement'], {})
+		self.assertEquals(self.planner.get_infeasible(), [])
+
+	def test_compute__infeasible(self):
+		# RAM sums are fine, but vm1 fits nowhere
+		self.metrics['node3']['free_ram']=900
+		self.assertEquals(self.planner.compute(self.status, self.metrics), False)
+		self.assertEquals(self.planner.get_plan('node1')['unplaced'], ['vm1'])
+		self.assertEquals(self.planner.get_infeasible(), ['node1'])
+
+	def test_compute__vm_count(self):
+		cxm.core.cfg['LB_MAX_VM_PER_NODE']=1
+		self.assertEquals(self.planner.compute(self.status, self.metrics), False)
+		self.assertEquals(self.planner.get_plan('node1')['unplaced'], ['vm2'])
+
+	def test_compute__unknown_vm(self):
+		self.status['node2']['vms'].append('vm4')
+		self.assertEquals(self.planner.compute(self.status, self.metrics), False)
+		self.assertEquals(self.planner.get_plan('node2')['unplaced'], ['vm4'])
+
+	def test_compute__no_metrics(self):
+		del self.metrics['node3']
+		self.assertEquals(self.planner.compute(self.status, self.metrics), None)
+		self.assertEquals(self.planner.get_plan('node3'), None)
+		self.assertEquals(self.planner.get_plan('node1')['capacities'].keys(), ['node2'])
+
+	def test_compute__alone(self):
+		self.assertEquals(self.planner.compute({'node1': self.status['node1']}, self.metrics), None)
+		self.assertEquals(sorted(self.planner.get_plan('node1')['unplaced']), ['vm1', 'vm2'])
+
+	def test_remove(self):
+		self.planner.compute(self.status, self.metrics)
+		self.planner.remove('node1')
+		self.assertEquals(sorted(self.planner.get_plans().keys()), ['node2', 'node3'])
+		self.planner.remove('node4')
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: ts=4:sw=4:ai
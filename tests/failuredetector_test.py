@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2010-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+
+from cxm.failuredetector import *
+import cxm
+import unittest
+from mocker import *
+
+class FailureDetectorTests(MockerTestCase):
+
+	def test_fixed(self):
+		fd=FixedDetector(9)
+		self.assertFalse(fd.is_suspected("node1", 1000))
+
+		fd.heartbeat("node1", 1000)
+		self.assertFalse(fd.is_suspected("node1", 1008.9))
+		self.assertTrue(fd.is_suspected("node1", 1009))
+
+		# Older heartbeats are ignored
+		fd.heartbeat("node1", 990)
+		self.assertTrue(fd.is_suspected("node1", 1009))
+
+		fd.remove("node1")
+		self.assertFalse(fd.is_suspected("node1", 1009))
+
+	def test_phi(self):
+		fd=PhiAccrualDetector(8, 0.25)
+		self.assertEquals(fd.phi("node1", 1000), 0)
+
+		now=1000.0
+		for i in range(50):
+			fd.heartbeat("node1", now)
+			now+=0.25
+		now-=0.25
+
+		self.assertTrue(fd.phi("node1", now+0.1) < 1)
+		self.assertFalse(fd.is_suspected("node1", now+0.5))		# One lost heartbeat
+		self.assertTrue(fd.is_suspected("node1", now+1))
+		self.assertTrue(fd.phi("node1", now+1) < fd.phi("node1", now+2))
+		self.assertTrue(fd.phi("node1", now+3600) > 1000)	# No overflow
+
+	def test_phi__jitter(self):
+		steady=PhiAccrualDetector(8, 1)
+		jittery=PhiAccrualDetector(8, 1)
+
+		now=1000.0
+		for i in range(100):
+			steady.heartbeat("node1", now)
+			jittery.heartbeat("node1", now+[0, 0.4, -0.4][i%3])
+			now+=1
+		now-=1
+
+		# A jittery node is given more time before suspicion
+		self.assertTrue(steady.is_suspected("node1", now+4))
+		self.assertFalse(jittery.is_suspected("node1", now+4))
+		self.assertTrue(jittery.is_suspected("node1", now+6))
+
+	def test_phi__window(self):
+		fd=PhiAccrualDetector(8, 1)
+		now=1000.0
+		for i in range(PhiAccrualDetector.WINDOW*2):
+			fd.heartbeat("node1", now)
+			now+=1
+
+		self.assertEquals(len(fd._history["node1"][0]), PhiAccrualDetector.WINDOW)
+		self.assertAlmostEquals(fd._history["node1"][1], PhiAccrualDetector.WINDOW)
+
+	def test_get_detector(self):
+		cxm.core.cfg['FAILURE_DETECTOR']="phi"
+		self.assertTrue(isinstance(get_detector(9, 0.25), PhiAccrualDetector))
+		cxm.core.cfg['FAILURE_DETECTOR']="non-exist"
+		self.assertRaises(FailureDetectorError, get_detector, 9, 0.25)
+		cxm.core.cfg['FAILURE_DETECTOR']="fixed"
+		self.assertTrue(isinstance(get_detector(9, 0.25), FixedDetector))
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: ts=4:sw=4:ai
@@ -65,4 +65,121 @@ class SlaveHearbeatServiceTests(unittest.TestCase, MockerTestCase):
 
 		return slavehb.startService()
 
+	def test_stopService__pending_pulse(self):
+		closed=list()
+
+		writer=self.mocker.mock()
+		writer.close()
+		self.mocker.call(lambda: closed.append(True))
+		call=self.mocker.mock()
+		call.running
+		self.mocker.result(False)
+		self.mocker.count(2)
+		hb=self.mocker.mock()
+		hb.stop()
+		self.mocker.result(defer.succeed(None))
+		self.mocker.replay()
+
+		self.patch(threads, "deferToThread", lambda f, *args: defer.succeed(f(*args)))
+		slavehb=SlaveHearbeatService(None)
+		slavehb.running=True
+		(slavehb._writer, slavehb._call, slavehb._metricsCall, slavehb._hb)=(writer, call, call, hb)
+		slavehb._pulse=defer.Deferred()
+
+		slavehb.stopService()
+		self.assertEquals(closed, [])
+
+		# Closed once the pulse is done
+		slavehb._pulse.callback(None)
+		self.assertEquals(closed, [True])
+
+	def test_collectMetrics(self):
+		summary={'ram': 1024}
+		master=self.mocker.mock()
+		master.getLocalNode().metrics.get_summary()
+		self.mocker.result(summary)
+		master.getLocalNode()
+		self.mocker.result("node")
+		self.mocker.count(2)
+		msg=self.mocker.replace("cxm.messages.MessageSlaveHB")
+		msg().forge("node", summary)
+		self.mocker.result("msg1")
+		msg().forge("node", None)
+		self.mocker.result("msg2")
+		self.mocker.replay()
+
+		self.patch(threads, "deferToThread", lambda f, *args: defer.succeed(f(*args)))
+		slavehb=SlaveHearbeatService(master)
+		slavehb.collectMetrics()
+
+		# Collected metrics are sent only once
+		self.assertEquals(slavehb.forgeSlaveHeartbeat(), "msg1")
+		self.assertEquals(slavehb.forgeSlaveHeartbeat(), "msg2")
+
+	def test_collectMetrics__failed(self):
+		master=self.mocker.mock()
+		master.getLocalNode().metrics.get_summary()
+		self.mocker.throw(Exception("xend is down"))
+		self.mocker.replay()
+
+		self.patch(threads, "deferToThread", lambda f, *args: defer.maybeDeferred(f, *args))
+		slavehb=SlaveHearbeatService(master)
+		d=slavehb.collectMetrics()
+		d.addCallback(lambda result: self.assertEquals(slavehb._metrics, None))
+		return d
+
+class MasterHearbeatServiceTests(unittest.TestCase, MockerTestCase):
+
+	def setUp(self):
+		self.status={'node1': {'timestamp': 0, 'offset': 0, 'vms': ['vm1']}}
+
+		self.master=self.mocker.mock()
+		self.master.getStatus()
+		self.mocker.call(lambda: self.status)
+		self.mocker.count(0, None)
+		self.master.getState()
+		self.mocker.result("normal")
+		self.mocker.count(0, None)
+
+		instance=self.mocker.mock()
+		instance.name
+		self.mocker.result("node-name")
+		self.mocker.count(0, None)
+
+		dns = self.mocker.replace("cxm.dnscache.DNSCache")
+		dns.getInstance()
+		self.mocker.result(instance)
+		self.mocker.count(0, None)
+		self.mocker.replay()
+
+		self.masterhb=MasterHeartbeatService(self.master)
+
+	def test_forgeMasterHeartbeat(self):
+		msg=self.masterhb.forgeMasterHeartbeat()
+		self.assertEquals((msg.seq, msg.full), (1, True))
+
+		msg=self.masterhb.forgeMasterHeartbeat()
+		self.assertEquals((msg.seq, msg.full), (2, False))
+		self.assertEquals(msg.status, {'node1': {'timestamp': 0, 'offset': 0}})
+
+		self.status={'node1': {'timestamp': 1, 'offset': 0, 'vms': ['vm1', 'vm2']}}
+		msg=self.masterhb.forgeMasterHeartbeat()
+		self.assertEquals(msg.status, self.status)
+
+		# Periodic full status
+		for i in range(MasterHeartbeatService.FULL_INTERVAL-3):
+			msg=self.masterhb.forgeMasterHeartbeat()
+			self.assertEquals(msg.full, False)
+		msg=self.masterhb.forgeMasterHeartbeat()
+		self.assertEquals((msg.seq, msg.full), (MasterHeartbeatService.FULL_INTERVAL+1, True))
+
+	def test_requestResync(self):
+		self.masterhb.forgeMasterHeartbeat()
+		self.masterhb.requestResync()
+		msg=self.masterhb.forgeMasterHeartbeat()
+		self.assertEquals((msg.seq, msg.full), (2, True))
+
+		msg=self.masterhb.forgeMasterHeartbeat()
+		self.assertEquals(msg.full, False)
+
 # vim: ts=4:sw=4:ai
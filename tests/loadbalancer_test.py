@@ -77,6 +77,55 @@ class LoadBalancerTests(unittest.TestCase):
 
 		self.assertEquals(self.lb.solutions,sol)
 
+	def test_create_layer__python(self):
+		node_metrics = {
+			'node1': { 'ram' : 4096 },
+			'node2': { 'ram' : 4096 },
+			'node3': { 'ram' : 3000 },
+		}
+		sol={0: [cxm.loadbalancer.Solution({'node1': ['vm1'], 'node3': ['vm5', 'vm6'], 'node2': ['vm2', 'vm3', 'vm4']})],
+		 1: [	cxm.loadbalancer.Solution({'node1': ['vm1', 'vm3'], 'node3': ['vm5', 'vm6'], 'node2': ['vm2', 'vm4']}),
+				cxm.loadbalancer.Solution({'node1': ['vm1', 'vm5'], 'node3': ['vm6'], 'node2': ['vm2', 'vm3', 'vm4']}),
+				cxm.loadbalancer.Solution({'node1': [], 'node3': ['vm5', 'vm6'], 'node2': ['vm2', 'vm3', 'vm4', 'vm1']}),
+				cxm.loadbalancer.Solution({'node1': ['vm1'], 'node3': ['vm6'], 'node2': ['vm2', 'vm3', 'vm4', 'vm5']}),
+				cxm.loadbalancer.Solution({'node1': ['vm1', 'vm6'], 'node3': ['vm5'], 'node2': ['vm2', 'vm3', 'vm4']}),
+				cxm.loadbalancer.Solution({'node1': ['vm1'], 'node3': ['vm5'], 'node2': ['vm2', 'vm3', 'vm4', 'vm6']}),
+				cxm.loadbalancer.Solution({'node1': ['vm1', 'vm2'], 'node3': ['vm5', 'vm6'], 'node2': ['vm3', 'vm4']}),
+				cxm.loadbalancer.Solution({'node1': ['vm1'], 'node3': ['vm5', 'vm6', 'vm2'], 'node2': ['vm3', 'vm4']}),
+				cxm.loadbalancer.Solution({'node1': ['vm1', 'vm4'], 'node3': ['vm5', 'vm6'], 'node2': ['vm2', 'vm3']})]}
+
+		map(lambda x: x.compute_score(self.vm_metrics),[ item for sublist in sol.values() for item in sublist ])
+
+		self.lb.set_metrics(self.vm_metrics,node_metrics)
+		self.lb.vectorized=False
+		self.lb.create_layer(self.lb.root,1)
+
+		self.assertEquals(self.lb.solutions,sol)
+
+	def test_score_moves(self):
+		if cxm.loadbalancer.numpy is None:
+			return # Numpy is optional
+
+		node_metrics = {
+			'node1': { 'ram' : 4096 },
+			'node2': { 'ram' : 4096 },
+			'node3': { 'ram' : 3000 },
+		}
+		self.vm_metrics['vm3']['cpu']=10.1
+		self.vm_metrics['vm5']['cpu']=0.3
+
+		self.lb.set_metrics(self.vm_metrics,node_metrics)
+		scorer=cxm.loadbalancer.VectorScorer(self.lb.root.nodes, self.vm_metrics, node_metrics)
+
+		val=list()
+		for (vm, src, dst, score, valid) in self.lb.get_moves(self.lb.root):
+			solution=self.lb.root.derive(vm, src, dst, self.vm_metrics)
+			if solution.is_constraints_ok(self.vm_metrics, node_metrics):
+				val.append((vm, src, dst, solution.score, True))
+
+		result=scorer.score_moves(self.lb.root, True, set())
+		self.assertEqual(result, val)
+
 	def test_get_efficient_solution__1mig(self):
 		cxm.core.cfg['LB_MIN_GAIN']=1
 		node_metrics = {
@@ -124,6 +173,58 @@ class LoadBalancerTests(unittest.TestCase):
 		sol=self.lb.get_efficient_solution()
 		self.assertEquals(sol,None)
 	
+	def test_get_solution__greedy(self):
+		cxm.core.cfg['LB_MIN_GAIN']=50
+		cxm.core.cfg['LB_MAX_MIGRATION']=2
+		node_metrics = {
+			'node1': { 'ram' : 4096 },
+			'node2': { 'ram' : 4096 },
+			'node3': { 'ram' : 3000 },
+		}
+
+		self.lb.set_metrics(self.vm_metrics,node_metrics)
+
+		sol=self.lb.get_solution('greedy', 0)
+		self.assertTrue(sol.score < self.lb.root.score/2)
+		self.assertTrue(sol.is_constraints_ok(self.vm_metrics,node_metrics))
+		self.assertTrue(len(sol.get_path()) <= 2)
+
+	def test_get_solution__annealing(self):
+		cxm.core.cfg['LB_MIN_GAIN']=50
+		cxm.core.cfg['LB_MAX_MIGRATION']=2
+		node_metrics = {
+			'node1': { 'ram' : 4096 },
+			'node2': { 'ram' : 4096 },
+			'node3': { 'ram' : 3000 },
+		}
+
+		self.lb.set_metrics(self.vm_metrics,node_metrics)
+
+		sol=cxm.loadbalancer.AnnealingStrategy(self.lb, 1).solve()
+		self.assertTrue(sol.score < self.lb.root.score/2)
+		self.assertTrue(sol.is_constraints_ok(self.vm_metrics,node_metrics))
+		self.assertTrue(len(sol.get_path()) <= 2)
+
+	def test_get_solution__unknown(self):
+		self.lb.set_metrics(self.vm_metrics,{})
+		self.assertRaises(cxm.loadbalancer.LoadBalancerError, self.lb.get_solution, 'unknown')
+
+	def test_get_plan(self):
+		cxm.core.cfg['LB_MAX_VM_PER_NODE']=10
+		node_metrics = {
+			'node1': { 'ram' : 4096 },
+			'node2': { 'ram' : 4096 },
+			'node3': { 'ram' : 3000 },
+		}
+		path = [{'src': 'node3', 'dst': 'node1', 'vm': 'vm6'}, {'src': 'node1', 'dst': 'node3', 'vm': 'vm1'}]
+
+		self.lb.set_metrics(self.vm_metrics,node_metrics)
+		target=cxm.loadbalancer.Solution({'node1': ['vm6'], 'node3': ['vm5', 'vm1'], 'node2': ['vm2', 'vm3', 'vm4']})
+
+		# vm1 can't go first on node3 (not enough ram)
+		sol=self.lb.get_plan(target)
+		self.assertEqual(sol.get_path(), path)
+
 
 class SolutionTests(unittest.TestCase):
 
@@ -158,6 +259,28 @@ class SolutionTests(unittest.TestCase):
 		self.assertEqual(self.s.state, state)
 		self.assertEqual(self.s.get_path(), path)
 
+	def test_derive(self):
+		metrics = {
+                'vm1': { 'ram':120, 'cpu':20},
+                'vm2': { 'ram':100, 'cpu':12}, 
+                'vm3': { 'ram':500, 'cpu':99}, 
+		}
+		state = {
+			'node1': ['vm1'],
+			'node2': ['vm2','vm3'],
+		}
+
+		self.s.compute_score(metrics)
+		val=cxm.loadbalancer.Solution(self.s.state)
+		val.migrate('vm2','node2','node1')
+		val.compute_score(metrics)
+
+		result=self.s.derive('vm2','node2','node1',metrics)
+		self.assertEqual(result.state, val.state)
+		self.assertEqual(result.score, val.score)
+		self.assertEqual(result.get_path(), val.get_path())
+		self.assertEqual(self.s.state, state)
+
 	def test_is_constraints_ok__True(self):
 		vm_metrics = {
 			'vm1': { 'ram':512 },
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2010-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+import cxm.core, cxm.lvmcache
+import unittest, time
+from mocker import *
+
+
+class LvmCacheTests(MockerTestCase):
+
+	def setUp(self):
+		cxm.core.cfg['QUIET']=True
+		cxm.core.cfg['API_DEBUG']=False
+
+		self.node=self.mocker.mock()
+		self.node.hostname
+		self.mocker.result("node1")
+		self.mocker.count(0, None)
+
+		self.cache=cxm.lvmcache.LvmCache(self.node)
+		self.lines=[
+			"  vgrack    root-test1.home.net     -wi---   4194304.00\n",
+			"  LVM_XEN   usr-test1.home.net      -wi-a-    524288.00\n",
+			"  vgrack    WOO-test1.home.net      -wi-a-   1048576.00\n",
+		]
+
+	def test_get(self):
+		# Only one scan
+		self.node.run_iter(cxm.lvmcache.LvmCache.COMMAND)
+		self.mocker.result(self.lines)
+		self.mocker.replay()
+
+		val={'vg': 'LVM_XEN', 'attr': '-wi-a-', 'size': 524288.0}
+		self.assertEqual(self.cache.get()['/dev/LVM_XEN/usr-test1.home.net'], val)
+		self.assertEqual(len(self.cache.get()), 3)
+
+	def test_get__expired(self):
+		self.node.run_iter(cxm.lvmcache.LvmCache.COMMAND)
+		self.mocker.result(self.lines)
+		self.mocker.count(2)
+		self.mocker.replay()
+
+		self.cache.get()
+		self.cache._timestamp-=cxm.lvmcache.LvmCache.LIFETIME
+		self.cache.get()
+
+	def test_invalidate(self):
+		self.node.run_iter(cxm.lvmcache.LvmCache.COMMAND)
+		self.mocker.result(self.lines)
+		self.mocker.count(2)
+		self.mocker.replay()
+
+		self.cache.get()
+		self.cache.invalidate()
+		self.cache.get()
+
+	def test_feed(self):
+		# Fed by a snapshot, no scan
+		self.mocker.replay()
+
+		self.cache.feed(self.lines)
+		self.assertEqual(self.cache.get_attrs(), {
+			'/dev/vgrack/root-test1.home.net': '-wi---',
+			'/dev/LVM_XEN/usr-test1.home.net': '-wi-a-',
+			'/dev/vgrack/WOO-test1.home.net': '-wi-a-'})
+
+	def test_get_vgs(self):
+		self.mocker.replay()
+
+		self.cache.feed(self.lines)
+		self.assertEqual(self.cache.get_vgs(['/dev/vgrack/root-test1.home.net', '/dev/LVM_XEN/usr-test1.home.net',
+			'/dev/vgrack/WOO-test1.home.net']), ['LVM_XEN', 'vgrack'])
+
+	def test_get_vgs__unknown(self):
+		# Scanned again, in case of a new LV
+		self.node.run_iter(cxm.lvmcache.LvmCache.COMMAND)
+		self.mocker.result(self.lines+["  vgnew     new.home.net            -wi---   1048576.00\n"])
+		self.mocker.replay()
+
+		self.cache.feed(self.lines)
+		self.assertEqual(self.cache.get_vgs(['/dev/vgnew/new.home.net', '/dev/vgrack/nonexist']), ['vgnew'])
+
+	def test_get_sizes(self):
+		self.mocker.replay()
+
+		self.cache.feed(self.lines)
+		self.assertEqual(self.cache.get_sizes(['/dev/vgrack/WOO-test1.home.net', '/dev/vgrack/nonexist']),
+			{'/dev/vgrack/WOO-test1.home.net': 1048576.0})
+
+
+if __name__ == "__main__":
+	unittest.main()
+
+# vim: ts=4:sw=4:ai
@@ -69,7 +69,9 @@ class MessagesTests(MockerTestCase):
 			'data': {
 				'status': dict(), 
 				'cluster': 'mycluster', 
-				'state': MasterService.ST_NORMAL 
+				'state': MasterService.ST_NORMAL,
+				'seq': 0,
+				'full': True
 			}, 
 		}
 		
@@ -83,6 +85,39 @@ class MessagesTests(MockerTestCase):
 		self.assertEquals(m.node, "node-name")
 		self.assertEquals(m.type(), 'masterhb')
 
+	def test_MessageMasterHB_forge__delta(self):
+		status = {
+			'node1': {'timestamp': 1325845000, 'offset': 0, 'vms': ['vm1', 'vm2']},
+			'node2': {'timestamp': 1325845001, 'offset': 1, 'vms': ['vm3']},
+			'node3': {'timestamp': 1325845002, 'offset': 0, 'vms': []},
+		}
+		sent = {'node1': ['vm1', 'vm2'], 'node2': ['vm4']}
+
+		dns = self.mocker.replace("cxm.dnscache.DNSCache")
+		dns.getInstance().name
+		self.mocker.result("node-name")
+		self.mocker.replay()
+
+		m=MessageMasterHB().forge(status, MasterService.ST_NORMAL, 2, sent)
+		self.assertEquals(m.value()['data']['seq'], 2)
+		self.assertEquals(m.value()['data']['full'], False)
+		self.assertEquals(m.status, {
+			'node1': {'timestamp': 1325845000, 'offset': 0},
+			'node2': {'timestamp': 1325845001, 'offset': 1, 'vms': ['vm3']},
+			'node3': {'timestamp': 1325845002, 'offset': 0, 'vms': []},
+		})
+
+		previous = {
+			'node1': {'timestamp': 1325844999, 'offset': 0, 'vms': ['vm1', 'vm2']},
+			'node2': {'timestamp': 1325844999, 'offset': 1, 'vms': ['vm4']},
+			'node4': {'timestamp': 1325844999, 'offset': 0, 'vms': ['vm5']},
+		}
+		self.assertEquals(m.apply(previous), status)
+
+		# Cannot apply a delta without the previous vms lists
+		del previous['node1']
+		self.assertRaises(MessageError, m.apply, previous)
+
 	def test_MessageVoteRequest_forge(self):
 		msg = {
 			'data': {
@@ -142,7 +177,9 @@ class MessagesTests(MockerTestCase):
 			'data': {
 				'status': dict(), 
 				'cluster': 'mycluster', 
-				'state': MasterService.ST_NORMAL 
+				'state': MasterService.ST_NORMAL,
+				'seq': 0,
+				'full': True
 			}, 
 		}
 		
@@ -200,6 +237,47 @@ class MessagesTests(MockerTestCase):
 		self.assertEquals(m.node, "node-name")
 		self.assertEquals(m.type(), 'masterhb')
 
+	def test_get__MessageMasterHB_delta(self):
+		msg = {
+			'data': {
+				'status': {'node1': {'timestamp': 1325845000, 'offset': 0}},
+				'cluster': 'mycluster', 
+				'state': MasterService.ST_NORMAL,
+				'seq': 12,
+				'full': False
+			}, 
+			'type': 'masterhb'
+		}
+
+		dns = self.mocker.replace("cxm.dnscache.DNSCache")
+		dns.getInstance().name
+		self.mocker.result("node-name")
+		self.mocker.replay()
+
+		m = MessageHelper.get(msg, None)
+		self.assertEquals(m.seq, 12)
+		self.assertEquals(m.full, False)
+
+	def test_get__MessageMasterHB_bad_full(self):
+		msg = {
+			'data': {
+				'status': {'node1': {'timestamp': 1325845000, 'offset': 0}},
+				'cluster': 'mycluster', 
+				'state': MasterService.ST_NORMAL,
+				'seq': 12,
+				'full': True
+			}, 
+			'type': 'masterhb'
+		}
+
+		dns = self.mocker.replace("cxm.dnscache.DNSCache")
+		dns.getInstance().name
+		self.mocker.result("node-name")
+		self.mocker.replay()
+
+		# A full status must have all vms lists
+		self.assertRaises(MessageError, MessageHelper.get, msg, None)
+
 	def test_get__MessageVoteRequest(self):
 		msg = {
 			'data': {
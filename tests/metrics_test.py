@@ -314,7 +314,7 @@ class MetricsTests(MockerTestCase):
 		xs.xenapi.VIF_metrics.get_all_records()
 		self.mocker.result(vif_records)
 		self.mocker.replay()
-		self.metrics.server=xs
+		self.node.server=xs
 
 		result=self.metrics.get_vms_net_io(True)
 		self.assertEqual(result, val)
@@ -339,7 +339,7 @@ class MetricsTests(MockerTestCase):
 		xs.xenapi.VM.get_all_records()
 		self.mocker.result(vm_records)
 		self.mocker.replay()
-		self.metrics.server=xs
+		self.node.server=xs
 
 		result=self.metrics.get_dom_records(True)
 		self.assertEqual(vm_records, result)
@@ -379,6 +379,28 @@ class MetricsTests(MockerTestCase):
 		self.assertEqual(result, 78)
 
 
+	def test_get_summary(self):
+		vm = self.mocker.mock()
+		vm.name
+		self.mocker.result('vm1')
+		self.mocker.count(1,None)
+		vm.get_ram()
+		self.mocker.result(512)
+		node = self.mocker.mock()
+		node.get_vms(False)
+		self.mocker.result([vm])
+		self.mocker.replay()
+
+		self.metrics.node=node
+		self.metrics.get_vms_cpu_usage=lambda nocache: {'vm1': 12.5, 'Domain-0': 3.0}
+		self.metrics.get_free_ram=lambda nocache: 1024
+		self.metrics.get_available_ram=lambda nocache: 1536
+		self.metrics.get_used_irq=lambda nocache: 42
+
+		result=self.metrics.get_summary()
+		self.assertEqual(result, {'free_ram': 1024, 'available_ram': 1536, 'used_irq': 42,
+			'vms': {'vm1': {'ram': 512, 'cpu': 12.5}}})
+
 	def test_get_vms_cpu_usage(self):
 		vm1_mocker = Mocker()
 		vm1 = vm1_mocker.mock()
@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2010-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+
+from cxm.netheartbeat import *
+from cxm.codec import JSONCodec
+from twisted.internet import defer
+import cxm
+import unittest
+from mocker import *
+
+class UDPSenderTests(MockerTestCase):
+
+	def setUp(self):
+		cxm.core.cfg['WIRE_FORMAT']="json"
+		cxm.core.cfg['UDP_PORT']=1255
+		self.value={'type': 'voterequest', 'data': {'cluster': 'mycluster', 'election': 12345}}
+
+	def tearDown(self):
+		cxm.core.cfg['HB_TRANSPORT']="broadcast"
+		cxm.core.cfg['ALLOWED_NODES']=[]
+
+	def getMsg(self):
+		msg = self.mocker.mock()
+		msg.value()
+		self.mocker.result(self.value)
+		return lambda: msg
+
+	def test_sendMessage__unicast(self):
+		cxm.core.cfg['HB_TRANSPORT']="unicast"
+		data=JSONCodec().encode(self.value)
+
+		transport = self.mocker.mock()
+		transport.socket.setsockopt(ANY, ANY, ANY)
+		transport.write(data, ("1.1.1.1", 1255))
+		transport.write(data, ("2.2.2.2", 1255))
+
+		dns = self.mocker.replace("cxm.dnscache.DNSCache")
+		dns.getInstance().get_by_name("node1")
+		self.mocker.result(defer.succeed("1.1.1.1"))
+		dns.getInstance().get_by_name("node2")
+		self.mocker.result(defer.succeed("2.2.2.2"))
+
+		getMsg=self.getMsg()
+		self.mocker.replay()
+
+		sender=UDPSender(defer.Deferred(), getMsg, getMembers=lambda: ["node1", "node2"])
+		sender.transport=transport
+		sender.startProtocol()
+		sender.sendMessage()
+
+	def test_sendMessage__unicast_allowed(self):
+		# Use ALLOWED_NODES if the list of members is unknown
+		cxm.core.cfg['HB_TRANSPORT']="unicast"
+		cxm.core.cfg['ALLOWED_NODES']=["node1"]
+		data=JSONCodec().encode(self.value)
+
+		transport = self.mocker.mock()
+		transport.socket.setsockopt(ANY, ANY, ANY)
+		transport.write(data, ("1.1.1.1", 1255))
+
+		dns = self.mocker.replace("cxm.dnscache.DNSCache")
+		dns.getInstance().get_by_name("node1")
+		self.mocker.result(defer.succeed("1.1.1.1"))
+
+		getMsg=self.getMsg()
+		self.mocker.replay()
+
+		sender=UDPSender(defer.Deferred(), getMsg, getMembers=lambda: [])
+		sender.transport=transport
+		sender.startProtocol()
+		sender.sendMessage()
+
+	def test_sendMessage__multicast(self):
+		cxm.core.cfg['HB_TRANSPORT']="multicast"
+		cxm.core.cfg['MCAST_GROUP']="239.255.12.55"
+		cxm.core.cfg['MCAST_TTL']=4
+		data=JSONCodec().encode(self.value)
+
+		transport = self.mocker.mock()
+		transport.socket.setsockopt(ANY, ANY, ANY)
+		transport.setTTL(4)
+		transport.setOutgoingInterface("10.0.0.1")
+		self.mocker.result(defer.succeed(None))
+		transport.write(data, ("239.255.12.55", 1255))
+
+		dns = self.mocker.replace("cxm.dnscache.DNSCache")
+		dns.getInstance().get_ifaddr()
+		self.mocker.result("10.0.0.1")
+
+		getMsg=self.getMsg()
+		self.mocker.replay()
+
+		d=defer.Deferred()
+		sender=UDPSender(d, getMsg)
+		sender.transport=transport
+		sender.startProtocol()
+		self.assertTrue(d.called)
+		sender.sendMessage()
+
+	def test_openSender__unknown(self):
+		cxm.core.cfg['HB_TRANSPORT']="non-exist"
+		self.assertRaises(TransportError, openSender, None)
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: ts=4:sw=4:ai
@@ -24,9 +24,40 @@
 ###########################################################################
 
 import cxm.core, cxm.node, cxm.metrics, cxm.vm
-import unittest, os, socket
+import unittest, os, socket, time, copy, threading
 from mocker import *
 
+class FakeChannel(object):
+
+	"""Paramiko's channel whose transport deliver the last data with the exit status."""
+
+	def __init__(self, chunks):
+		self.chunks=chunks
+		self.pending=list()
+		self.closed=False
+
+	def exit_status_ready(self):
+		# The transport's thread receive the last data and the exit status at once
+		self.pending.extend(self.chunks)
+		self.chunks=list()
+		return True
+
+	def recv_exit_status(self):
+		return 0
+
+	def recv_ready(self):
+		return len(self.pending) > 0
+
+	def recv(self, size):
+		return self.pending.pop(0)
+
+	def recv_stderr_ready(self):
+		return False
+
+	def close(self):
+		self.closed=True
+
+
 class NodeTests(MockerTestCase):
 
 	def setUp(self):
@@ -88,6 +119,58 @@ class NodeTests(MockerTestCase):
 		result=self.node.get_bridges()
 		self.assertEqual(result, val)
 
+	def test_run_batch(self):
+		val = { 'bridges': ['xenbr123', 'xenbr2004', 'xenbr12'], 'cfg': ['test1.home.net', 'test2.home.net', 'testcfg.home.net'] }
+
+		output=self.node.run_batch([('bridges', "find /sys/class/net/ -maxdepth 2 -name bridge"),
+			('cfg', "ls %s/* || true" % (cxm.core.cfg['VMCONF_DIR']))])
+		self.assertEqual(sorted(output.keys()), sorted(val.keys()))
+		self.assertEqual(self.node._parse_bridges(output['bridges']), val['bridges'])
+		self.assertEqual(self.node._parse_vm_names(output['cfg']), val['cfg'])
+
+	def test_run_batch__no_newline(self):
+		output=self.node.run_batch([('first', "run nonewline"), ('second', "run success"), ('third', "run nonewline")])
+		self.assertEqual(output, {'first': ["OK"], 'second': ["OK\n"], 'third': ["OK"]})
+
+	def test_get_snapshot(self):
+		val = { 'bridges': ['xenbr123', 'xenbr2004', 'xenbr12'], 'cfg': ['test1.home.net', 'test2.home.net', 'testcfg.home.net'] }
+
+		result=self.node.get_snapshot(['bridges', 'cfg'])
+		self.assertEqual(result, val)
+
+	def test_get_snapshot__lvs(self):
+		result=self.node.get_snapshot(['lvs'])
+		self.assertEqual(result['lvs']['/dev/vgrack/DUMMY'], '-wi-a-')
+
+		# LVM cache is fed by the snapshot
+		run_iter = self.mocker.replace(self.node.run_iter)
+		run_iter(ANY)
+		self.mocker.count(0)
+		self.mocker.replay()
+
+		self.assertEqual(self.node.get_vgs(['/dev/LVM_XEN/usr-test1.home.net']), ['LVM_XEN'])
+
+	def test_get_counters(self):
+		val = { 'interrupts': 28, 
+				'vbd': {'72': {'rd_req': 1931, 'wr_req': 2293}, '73': {'rd_req': 6, 'wr_req': 68}} }
+
+		result=self.node.get_counters(['interrupts'], ['72', '73'])
+		self.assertEqual(sorted(result.keys()), sorted(val.keys()))
+		self.assertEqual(len(result['interrupts']), val['interrupts'])
+		for domid in val['vbd'].keys():
+			for stat in ('rd_req', 'wr_req'):
+				self.assertEqual(sum([ int(x) for x in result['vbd'][domid][stat] ]), val['vbd'][domid][stat])
+
+	def test_get_counters__local(self):
+		# Without PATH, local files are read in-process
+		cxm.core.cfg['PATH'] = None
+		self.assertTrue(self.node.is_local_fs())
+
+		result=self.node.get_counters(['net_dev', 'diskstats', 'vlans'], ['0'])
+		self.assertEqual(sorted(result.keys()), ['diskstats', 'net_dev', 'vbd', 'vlans'])
+		self.assertEqual(open("/proc/net/dev").readlines()[0], result['net_dev'][0])
+		self.assertEqual(result['vbd']['0'], {'rd_req': [], 'wr_req': []})
+
 	def test_get_vlans(self):
 		val = ['eth1.200', 'eth2.205']
 
@@ -233,6 +316,20 @@ class NodeTests(MockerTestCase):
 
 		self.node.deactivate_lv(vmname)
 
+	def test_deactivate_lv__given_lvs(self):
+		vmname="non-exist"
+		cxm.core.cfg['NOREFRESH']=True
+
+		is_vm_started = self.mocker.replace(self.node.is_vm_started)
+		is_vm_started(vmname)
+		self.mocker.result(False)
+		run = self.mocker.replace(self.node.run)
+		run("lvchange -aln /dev/vgrack/lv1 /dev/vgrack/lv2")
+		self.mocker.replay()
+
+		# Neither the VM's configuration nor lvdisplay are read
+		self.node.deactivate_lv(vmname, ['/dev/vgrack/lv1', '/dev/vgrack/lv2'], ['vgrack'])
+
 	def test_deactivate_all_lv(self):
 		names=['test1.home.net', 'test2.home.net', 'testcfg.home.net']
 
@@ -261,6 +358,54 @@ class NodeTests(MockerTestCase):
 
 		cxm.node.main=xm
 		self.node.start(vmname)
+
+	def test_iter_ssh__exit_with_last_data(self):
+		chan=FakeChannel(["line1\nlast", " line\n"])
+
+		ssh = self.mocker.mock()
+		ssh.get_transport().open_session()
+		self.mocker.result(chan)
+		chan.exec_command=lambda cmd: None
+		self.mocker.replay()
+		self.node.ssh=ssh
+
+		self.assertEqual(list(self.node._iter_ssh("cmd", None)), ["line1\n", "last line\n"])
+		self.assertTrue(chan.closed)
+
+	def test_start__concurrent(self):
+		class FakeMain(object):
+			SERVER_LEGACY_XMLRPC="legacy"
+			server=None
+			serverType=None
+			def __init__(self):
+				self.created=list()
+			def xm_importcommand(self, cmd, args):
+				server=self.server
+				time.sleep(0.1)		# Let the other thread run
+				self.created.append((server, self.server, args[0]))
+
+		node1=copy.copy(self.node)
+		node1.get_legacy_server=lambda: "server1"
+		node2=copy.copy(self.node)
+		node2.get_legacy_server=lambda: "server2"
+
+		xm=FakeMain()
+		old_main=cxm.node.main
+		cxm.node.main=xm
+		try:
+			threads=[ threading.Thread(target=node.start, args=(name,))
+				for node, name in [(node1, "test1.home.net"), (node2, "test2.home.net")] ]
+			for thread in threads:
+				thread.start()
+			for thread in threads:
+				thread.join()
+		finally:
+			cxm.node.main=old_main
+
+		# Each VM is created on the server of its own node
+		self.assertEqual(sorted(xm.created), [
+			("server1", "server1", cxm.core.cfg['VMCONF_DIR'] + "test1.home.net"),
+			("server2", "server2", cxm.core.cfg['VMCONF_DIR'] + "test2.home.net")])
 	
 	def test_reboot_running(self):
 		vmname="test1.home.net"
@@ -499,6 +644,29 @@ class NodeTests(MockerTestCase):
 		result=self.node.get_vms_names()
 		self.assertEqual(result,['test1.home.net'])
 
+	def test_get_vms_names__watched(self):	
+		vm_records = {
+			'6ab3fd4c-d1d3-158e-d72d-3fc4831ae1e5': {
+				'name_label': 'test1.home.net',
+				'power_state': 'Running'},
+			'7efcbac8-4714-88ee-007c-0246a3cb52b8': {
+				'name_label': 'Domain-0',
+				'power_state': 'Running'}
+		}
+
+		# No API call: records come from the watcher, even without cache
+		watcher = self.mocker.mock()
+		watcher.is_ready()
+		self.mocker.result(True)
+		self.mocker.count(1, None)
+		watcher.get_vm_records()
+		self.mocker.result(vm_records)
+		self.mocker.replay()
+		self.node.watcher=watcher
+
+		result=self.node.get_vms_names(True)
+		self.assertEqual(result,['test1.home.net'])
+
 	def test_get_possible_vm_names__all(self):
 		names=['test1.home.net', 'test2.home.net', 'testcfg.home.net']
 
@@ -562,6 +730,39 @@ class NodeTests(MockerTestCase):
 	def test_run_error(self):
 		self.assertRaises(cxm.node.ShellError,self.node.run,"run failure")
 
+	def test_run__big(self):
+		result=self.node.run("run big").readlines()
+		self.assertEqual(len(result), 10000)
+		self.assertEqual(result[-1], "Line 10000 on stdout\n")
+
+	def test_run__timeout(self):
+		start=time.time()
+		self.assertRaises(cxm.node.ShellTimeoutError,self.node.run,"run sleep", 0.5)
+		self.assertTrue(time.time()-start < 5)
+
+	def test_run_iter(self):
+		result=self.node.run_iter("run big")
+		self.assertEqual(result.next(), "Line 1 on stdout\n")
+		self.assertEqual(len(list(result)), 9999)
+
+	def test_run_iter__close(self):
+		start=time.time()
+		result=self.node.run_iter("run sleep")
+		self.assertEqual(result.next(), "Sleeping\n")
+		result.close()
+
+		# Command is killed
+		self.assertRaises(cxm.node.ShellError, list, result)
+		self.assertTrue(time.time()-start < 5)
+
+	def test_run_iter__error(self):
+		try:
+			list(self.node.run_iter("run failure"))
+			self.fail("ShellError not raised")
+		except cxm.node.ShellError, e:
+			self.assertEqual(e.value, "FAILURE\n")
+			self.assertEqual(e.exitcode, 2)
+
 	def test_ping__ok(self):
 		self.assertTrue(self.node.ping(["test1.home.net", "test2.home.net", "test3.home.net"]))
 
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2011-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+# Use Twisted's trial to run this tests
+
+from cxm.nodepool import NodePool, NodePoolError
+import cxm, cxm.nodepool
+from twisted.trial import unittest
+from twisted.internet import defer
+
+
+class FakeNode(object):
+
+	def __init__(self, hostname):
+		self.hostname=hostname
+		self.watched=False
+		self.connected=True
+		self.alive=True
+
+	def watch_events(self):
+		self.watched=True
+
+	def disconnect(self):
+		self.connected=False
+
+	def is_alive(self):
+		return self.alive
+
+
+class NodePoolTrialTests(unittest.TestCase):
+
+	def setUp(self):
+		cxm.core.cfg['QUIET']=True
+
+		# Threaded calls are run by run_threads(), in order
+		self.calls=list()
+		def deferToThread(func, *args):
+			d=defer.Deferred()
+			self.calls.append((func, args, d))
+			return d
+
+		self.patch(cxm.nodepool.threads, "deferToThread", deferToThread)
+		self.patch(cxm.nodepool, "Node", FakeNode)
+		self.pool=NodePool()
+
+	def run_threads(self):
+		while len(self.calls) > 0:
+			(func, args, d)=self.calls.pop(0)
+			try:
+				result=func(*args)
+			except Exception, e:
+				d.errback(e)
+			else:
+				d.callback(result)
+
+	def get_node(self, hostname):
+		nodes=list()
+		self.pool.get(hostname).addCallback(nodes.append)
+		self.run_threads()
+		return nodes[0]
+
+	def test_get(self):
+		results=list()
+		self.pool.get("node1").addCallback(results.append)
+		self.pool.get("node1").addCallback(results.append)
+
+		# A single connection for both requests
+		self.assertEqual(len(self.calls), 1)
+		self.run_threads()
+		self.assertEqual(len(results), 2)
+		self.assertTrue(results[0] is results[1])
+		self.assertTrue(results[0].watched)
+
+		# Then taken from the pool
+		self.pool.get("node1").addCallback(results.append)
+		self.assertEqual(len(self.calls), 0)
+		self.assertTrue(results[2] is results[0])
+		self.assertEqual(self.pool.get_hostnames(), ["node1"])
+
+	def test_get__failed(self):
+		def fail(hostname):
+			raise Exception("Connection refused")
+		self.patch(cxm.nodepool, "Node", fail)
+
+		errors=list()
+		self.pool.get("node1").addErrback(errors.append)
+		self.pool.get("node1").addErrback(errors.append)
+		self.run_threads()
+		self.assertEqual(len(errors), 2)
+		self.assertEqual(self.pool.get_hostnames(), [])
+
+	def test_discard(self):
+		node=self.get_node("node1")
+
+		self.pool.discard("node1")
+		self.run_threads()
+		self.assertFalse(node.connected)
+		self.assertEqual(self.pool.get_hostnames(), [])
+
+	def test_discard__connecting(self):
+		errors=list()
+		self.pool.get("node1").addErrback(errors.append)
+		self.pool.discard("node1")
+		self.assertEqual(len(errors), 1)
+		errors[0].trap(NodePoolError)
+
+		# Connection is not pooled once opened
+		self.run_threads()
+		self.assertEqual(self.pool.get_hostnames(), [])
+
+	def test_discard__reconnect(self):
+		nodes=list()
+		self.pool.get("node1").addErrback(lambda reason: reason.trap(NodePoolError))
+		self.pool.discard("node1")
+		self.pool.get("node1").addCallback(nodes.append)
+		self.run_threads()
+
+		# Only the new connection is kept
+		self.assertEqual(len(nodes), 1)
+		self.assertTrue(nodes[0].watched)
+		self.assertEqual(self.pool.get_hostnames(), ["node1"])
+
+	def test_stop(self):
+		node1=self.get_node("node1")
+		node2=self.get_node("node2")
+
+		self.pool.stop()
+		self.run_threads()
+		self.assertFalse(node1.connected)
+		self.assertFalse(node2.connected)
+		self.assertEqual(self.pool.get_hostnames(), [])
+
+	def test_stop__connecting(self):
+		errors=list()
+		self.pool.get("node1").addErrback(errors.append)
+		self.pool.stop()
+		self.assertEqual(len(errors), 1)
+
+		# The late connection is closed, and not watched
+		(func, args, d)=self.calls.pop(0)
+		node=func(*args)
+		d.callback(node)
+		self.run_threads()
+		self.assertFalse(node.connected)
+		self.assertFalse(node.watched)
+		self.assertEqual(self.pool.get_hostnames(), [])
+
+	def test_keepalive(self):
+		node1=self.get_node("node1")
+		node2=self.get_node("node2")
+		node1.alive=False
+		self.pool._getMembers=lambda: ["node1", "node3"]
+
+		self.pool.keepalive()
+		self.run_threads()
+
+		# Dead node1 is reconnected, node2 left the cluster, node3 is new
+		self.assertFalse(node1.connected)
+		self.assertFalse(node2.connected)
+		self.assertEqual(sorted(self.pool.get_hostnames()), ["node1", "node3"])
+		self.assertFalse(self.get_node("node1") is node1)
+
+
+# vim: ts=4:sw=4:ai
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2010-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+
+from cxm.placement import *
+import cxm.core
+import unittest
+from mocker import *
+
+class PlacementTests(MockerTestCase):
+
+	def setUp(self):
+		cxm.core.cfg['PLACEMENT_STRATEGY']="bfd"
+		self.nodes=[
+			('node1', {'ram': 300, 'irq': 100, 'vms': 10}),
+			('node2', {'ram': 1024, 'irq': 100, 'vms': 10}),
+		]
+
+	def test_fits(self):
+		self.assertTrue(fits({'ram': 512, 'irq': 4}, {'ram': 512, 'irq': 10}))
+		self.assertFalse(fits({'ram': 512, 'irq': 4}, {'ram': 512, 'irq': 3}))
+		# Missing dimensions are not checked
+		self.assertTrue(fits({'ram': 512, 'vcpu': 4}, {'ram': 512}))
+		self.assertTrue(fits({'ram': 512}, {'ram': 512, 'vcpu': 0}))
+
+	def test_best_fit_decreasing(self):
+		(placement, unplaced, free)=best_fit_decreasing([('vm1', {'ram': 1024}), ('vm2', {'ram': 256})], self.nodes)
+		self.assertEquals(placement, {'vm1': 'node2', 'vm2': 'node1'})
+		self.assertEquals(unplaced, [])
+		self.assertEquals(free['node1'], {'ram': 44, 'irq': 100, 'vms': 10})
+
+		# Original capacities are not modified
+		self.assertEquals(self.nodes[0][1]['ram'], 300)
+
+	def test_best_fit_decreasing__dimensions(self):
+		# node1 is the best fit for the ram, but has no irq left
+		self.nodes[0][1]['irq']=2
+		(placement, unplaced, free)=best_fit_decreasing([('vm1', {'ram': 256, 'irq': 3, 'vms': 1})], self.nodes)
+		self.assertEquals(placement, {'vm1': 'node2'})
+
+		self.nodes[1][1]['vms']=0
+		(placement, unplaced, free)=best_fit_decreasing([('vm1', {'ram': 256, 'irq': 3, 'vms': 1})], self.nodes)
+		self.assertEquals(unplaced, ['vm1'])
+
+	def test_first_fit_decreasing(self):
+		(placement, unplaced, free)=first_fit_decreasing([('vm1', {'ram': 128}), ('vm2', {'ram': 256})], self.nodes)
+		self.assertEquals(placement, {'vm1': 'node2', 'vm2': 'node1'})
+
+	def test_priorities(self):
+		vms=[('vm1', {'ram': 1024}), ('vm2', {'ram': 800})]
+		self.assertEquals(best_fit_decreasing(vms, self.nodes)[1], ['vm2'])
+		self.assertEquals(best_fit_decreasing(vms, self.nodes, {'vm2': 10})[1], ['vm1'])
+
+	def test_exact(self):
+		# Best-fit decreasing leaves vm3 and vm4 out, while all VMs can be placed
+		nodes=[('node1', {'ram': 1000}), ('node2', {'ram': 1000})]
+		vms=[('vm1', {'ram': 500}), ('vm2', {'ram': 400}), ('vm3', {'ram': 300}), ('vm4', {'ram': 300}), ('vm5', {'ram': 300}), ('vm6', {'ram': 200})]
+		self.assertEquals(len(best_fit_decreasing(vms, nodes)[1]), 1)
+
+		(placement, unplaced, free)=exact(vms, nodes)
+		self.assertEquals(unplaced, [])
+		self.assertEquals(free, {'node1': {'ram': 0}, 'node2': {'ram': 0}})
+
+	def test_exact__priorities(self):
+		nodes=[('node1', {'ram': 1000})]
+		vms=[('vm1', {'ram': 600}), ('vm2', {'ram': 500}), ('vm3', {'ram': 500})]
+		self.assertEquals(sorted(exact(vms, nodes)[1]), ['vm1'])
+		self.assertEquals(sorted(exact(vms, nodes, {'vm1': 1})[1]), ['vm2', 'vm3'])
+
+	def test_exact__budget(self):
+		# Too big to be solved: the best-fit solution is kept
+		import cxm.placement
+		cxm.placement.EXACT_MAX_STEPS=10
+		try:
+			nodes=[ ('node%d' % (i), {'ram': 1000+i}) for i in range(3) ]
+			vms=[ ('vm%d' % (i), {'ram': 300+i*10}) for i in range(12) ]
+			(placement, unplaced, free)=exact(vms, nodes)
+			self.assertEquals(len(unplaced), len(best_fit_decreasing(vms, nodes)[1]))
+		finally:
+			cxm.placement.EXACT_MAX_STEPS=200000
+
+	def test_place(self):
+		vms=[('vm1', {'ram': 1024}), ('vm2', {'ram': 256})]
+		self.assertEquals(place(vms, self.nodes), best_fit_decreasing(vms, self.nodes))
+		self.assertEquals(place(vms, self.nodes, "ffd"), first_fit_decreasing(vms, self.nodes))
+		self.assertEquals(place(vms, self.nodes, "exact")[0], {'vm1': 'node2', 'vm2': 'node1'})
+		self.assertRaises(PlacementError, place, vms, self.nodes, "non-exist")
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: ts=4:sw=4:ai
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2010-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+
+import cxm.core, cxm.recordstore
+import unittest, time
+from mocker import *
+
+
+class RecordStoreTests(MockerTestCase):
+
+	def setUp(self):
+		cxm.core.cfg['QUIET']=True
+		cxm.core.cfg['API_DEBUG']=False
+
+		self.node=self.mocker.mock()
+		self.node.hostname
+		self.mocker.result("node1")
+		self.mocker.count(0, None)
+		self.node.is_watched()
+		self.mocker.result(False)
+		self.mocker.count(0, None)
+
+		self.store=cxm.recordstore.RecordStore(self.node)
+		self.vm_records={ 'vm-ref1': { 'name_label': 'test1.home.net' } }
+
+	def test_get(self):
+		# Only one fetch for the generation
+		self.node.server.xenapi.VM.get_all_records()
+		self.mocker.result(self.vm_records)
+		self.mocker.replay()
+
+		self.assertEqual(self.store.get('VM'), self.vm_records)
+		self.assertEqual(self.store.get('VM'), self.vm_records)
+		self.assertEqual(self.store.get('VM', True), self.vm_records)
+		self.assertEqual(self.store.generation, 1)
+
+	def test_get__nocache(self):
+		self.node.server.xenapi.VM.get_all_records()
+		self.mocker.result(self.vm_records)
+		self.mocker.count(2)
+		self.mocker.replay()
+
+		self.store.get('VM')
+		self.store._started-=cxm.recordstore.RecordStore.MIN_AGE
+		self.store.get('VM', True)
+		self.assertEqual(self.store.generation, 2)
+
+	def test_get__expired(self):
+		self.node.server.xenapi.VM.get_all_records()
+		self.mocker.result(self.vm_records)
+		self.mocker.count(2)
+		self.mocker.replay()
+
+		self.store.get('VM')
+		self.store._started-=cxm.recordstore.RecordStore.LIFETIME
+		self.store.get('VM')
+		self.assertEqual(self.store.generation, 2)
+
+	def test_invalidate(self):
+		self.node.server.xenapi.VM.get_all_records()
+		self.mocker.result(self.vm_records)
+		self.mocker.count(2)
+		self.mocker.replay()
+
+		self.store.get('VM')
+		self.store.invalidate()
+		self.store.get('VM')
+		self.assertEqual(self.store.generation, 2)
+
+	def test_view(self):
+		self.node.server.xenapi.VM.get_all_records()
+		self.mocker.result(self.vm_records)
+		self.mocker.replay()
+
+		calls=list()
+		def _get_names():
+			calls.append(True)
+			return [ rec['name_label'] for rec in self.store.get('VM').values() ]
+
+		self.assertEqual(self.store.view('names', True, _get_names), ['test1.home.net'])
+		self.assertEqual(self.store.view('names', True, _get_names), ['test1.home.net'])
+		self.assertEqual(len(calls), 1)
+
+
+if __name__ == '__main__':
+	unittest.main()
+
+# vim: ts=4:sw=4:ai
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2010-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+
+import cxm.core, cxm.scheduler, cxm.xencluster, cxm.node
+import unittest, threading, time
+from mocker import MockerTestCase
+
+
+class FakeCluster:
+
+	"""Record migrations, and check concurrency limits."""
+
+	def __init__(self, fail=[]):
+		self.lock=threading.Lock()
+		self.done=list()
+		self.fail=fail
+		self.running=dict(src=dict(), dst=dict())
+		self.max_running=dict(src=0, dst=0)
+
+	def migrate(self, vmname, src, dst):
+		self.lock.acquire()
+		for kind, hostname in (('src', src), ('dst', dst)):
+			self.running[kind][hostname]=self.running[kind].get(hostname, 0)+1
+			self.max_running[kind]=max(self.max_running[kind], self.running[kind][hostname])
+		self.lock.release()
+
+		time.sleep(0.05)
+
+		self.lock.acquire()
+		self.running['src'][src]-=1
+		self.running['dst'][dst]-=1
+		self.done.append((vmname, src, dst))
+		self.lock.release()
+
+		if vmname in self.fail:
+			raise Exception("Migration failed")
+
+	def restart_vm(self, vmname, hostname):
+		self.lock.acquire()
+		self.running['dst'][hostname]=self.running['dst'].get(hostname, 0)+1
+		self.max_running['dst']=max(self.max_running['dst'], self.running['dst'][hostname])
+		self.lock.release()
+
+		time.sleep(0.05)
+
+		self.lock.acquire()
+		self.running['dst'][hostname]-=1
+		self.done.append((vmname, hostname))
+		self.lock.release()
+
+		if vmname in self.fail:
+			raise Exception("Start failed")
+
+
+class MigrationSchedulerTests(MockerTestCase):
+
+	def setUp(self):
+		cxm.core.cfg['MIGRATION_MAX_PER_SRC']=2
+		cxm.core.cfg['MIGRATION_MAX_PER_DST']=1
+		cxm.core.cfg['QUIET']=True
+
+	def test_run(self):
+		cluster=FakeCluster()
+		scheduler=cxm.scheduler.MigrationScheduler(cluster, {'node2': 2048, 'node3': 2048, 'node4': 2048})
+		scheduler.add('vm1', 'node1', 'node2', 512)
+		scheduler.add('vm2', 'node1', 'node3', 512)
+		scheduler.add('vm3', 'node1', 'node4', 512)
+		scheduler.add('vm4', 'node1', 'node2', 512)
+		scheduler.run()
+
+		self.assertEquals(len(cluster.done), 4)
+		self.assertEquals(cluster.max_running, {'src': 2, 'dst': 1})
+
+	def test_run__ram_order(self):
+		# vm2 have to leave node2 before vm1 can get in
+		cluster=FakeCluster()
+		scheduler=cxm.scheduler.MigrationScheduler(cluster, {'node1': 0, 'node2': 256, 'node3': 1024})
+		scheduler.add('vm2', 'node2', 'node3', 512)
+		scheduler.add('vm1', 'node1', 'node2', 512)
+		scheduler.add('vm2', 'node3', 'node1', 512)
+		scheduler.run()
+
+		self.assertEquals(cluster.done, [('vm2', 'node2', 'node3'), ('vm1', 'node1', 'node2'), ('vm2', 'node3', 'node1')])
+
+	def test_run__not_enough_ram(self):
+		cluster=FakeCluster()
+		scheduler=cxm.scheduler.MigrationScheduler(cluster, {'node2': 1024})
+		scheduler.add('vm1', 'node1', 'node2', 512)
+		scheduler.add('vm2', 'node1', 'node2', 1024)
+
+		e=self.assertRaises(cxm.xencluster.MultipleError, scheduler.run)
+		self.assertEquals(e.value.keys(), ['vm2'])
+		self.assertTrue(isinstance(e.value['vm2'], cxm.node.NotEnoughRamError))
+		self.assertEquals(cluster.done, [('vm1', 'node1', 'node2')])
+
+	def test_run__error(self):
+		# Next migrations of a failed vm are skipped
+		cluster=FakeCluster(fail=['vm1'])
+		scheduler=cxm.scheduler.MigrationScheduler(cluster, {'node1': 2048, 'node2': 2048, 'node3': 2048})
+		scheduler.add('vm1', 'node1', 'node2', 512)
+		scheduler.add('vm2', 'node1', 'node3', 512)
+		scheduler.add('vm1', 'node2', 'node3', 512)
+
+		e=self.assertRaises(cxm.xencluster.MultipleError, scheduler.run)
+		self.assertEquals(e.value.keys(), ['vm1'])
+		self.assertEquals(len(cluster.done), 2)
+
+
+class StartSchedulerTests(MockerTestCase):
+
+	def setUp(self):
+		cxm.core.cfg['START_MAX_PER_NODE']=2
+		cxm.core.cfg['QUIET']=True
+
+	def test_run(self):
+		cluster=FakeCluster()
+		scheduler=cxm.scheduler.StartScheduler(cluster)
+		for i in range(5):
+			scheduler.add('vm%d' % (i), 'node1')
+		scheduler.add('vm5', 'node2')
+
+		start=time.time()
+		self.assertEquals(sorted(scheduler.run()), ['vm0', 'vm1', 'vm2', 'vm3', 'vm4', 'vm5'])
+		self.assertEquals(cluster.max_running['dst'], 2)
+		self.assertTrue(time.time()-start < 0.05*5)
+
+		# Started in plan's order
+		self.assertEquals([ vm for (vm, node) in cluster.done if node == 'node1' ][-1], 'vm4')
+
+	def test_run__error(self):
+		cluster=FakeCluster(fail=['vm1'])
+		scheduler=cxm.scheduler.StartScheduler(cluster)
+		scheduler.add('vm1', 'node1')
+		scheduler.add('vm2', 'node1')
+
+		e=self.assertRaises(cxm.xencluster.MultipleError, scheduler.run)
+		self.assertEquals(e.value.keys(), ['vm1'])
+		self.assertEquals(len(cluster.done), 2)
+
+	def test_run__empty(self):
+		self.assertEquals(cxm.scheduler.StartScheduler(FakeCluster()).run(), [])
+
+
+if __name__ == '__main__':
+	unittest.main()
+
+# vim: ts=4:sw=4:ai
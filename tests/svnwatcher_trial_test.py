@@ -164,7 +164,7 @@ class InotifyTests(unittest.TestCase):
 		def verifyCalls():
 			verify(node).run('svn delete tests/stubs/cfg/file1')
 			verify(node).run("svn --non-interactive commit -m 'svnwatcher autocommit' tests/stubs/cfg/")
-			verify(node).run('svn update tests/stubs/cfg/')
+			verify(node).run_deferred('svn update tests/stubs/cfg/')
 			verifyNoMoreInteractions(node)
 
 		reactor.callLater(0, verifyCalls)
@@ -177,7 +177,7 @@ class InotifyTests(unittest.TestCase):
 
 		def verifyCalls():
 			verify(node).run("svn --non-interactive commit -m 'svnwatcher autocommit' tests/stubs/cfg/")
-			verify(node).run('svn update tests/stubs/cfg/')
+			verify(node).run_deferred('svn update tests/stubs/cfg/')
 			verifyNoMoreInteractions(node)
 
 		reactor.callLater(0, verifyCalls)
@@ -192,7 +192,7 @@ class InotifyTests(unittest.TestCase):
 			verify(node).run('svn delete tests/stubs/cfg/file3')
 			verify(node).run('svn add tests/stubs/cfg/file2')
 			verify(node).run("svn --non-interactive commit -m 'svnwatcher autocommit' tests/stubs/cfg/")
-			verify(node).run('svn update tests/stubs/cfg/')
+			verify(node).run_deferred('svn update tests/stubs/cfg/')
 			verifyNoMoreInteractions(node)
 
 		reactor.callLater(0, verifyCalls)
@@ -238,7 +238,7 @@ class InotifyTests(unittest.TestCase):
 
 		def verifyCalls():
 			verify(node).run("svn --non-interactive commit -m 'svnwatcher autocommit' tests/stubs/cfg/")
-			verify(node).run('svn update tests/stubs/cfg/')
+			verify(node).run_deferred('svn update tests/stubs/cfg/')
 			verifyNoMoreInteractions(node)
 
 		reactor.callLater(0, verifyCalls)
@@ -252,7 +252,7 @@ class InotifyTests(unittest.TestCase):
 		def verifyCalls():
 			verify(node).run('svn delete tests/stubs/cfg/file4')
 			verify(node).run("svn --non-interactive commit -m 'svnwatcher autocommit' tests/stubs/cfg/")
-			verify(node).run('svn update tests/stubs/cfg/')
+			verify(node).run_deferred('svn update tests/stubs/cfg/')
 			verifyNoMoreInteractions(node)
 
 		reactor.callLater(0, verifyCalls)
@@ -270,11 +270,12 @@ class InotifyTests(unittest.TestCase):
 
 	def test_doUpdate__standalone(self):
 		node=mock()
+		when(node).run_deferred("svn update tests/stubs/cfg/").thenReturn(defer.succeed([]))
 		pp=InotifyPP(node)
 		d=pp.doUpdate()
 
 		def verifyCalls(dummy):
-			verify(node).run("svn update tests/stubs/cfg/")
+			verify(node).run_deferred("svn update tests/stubs/cfg/")
 			verifyNoMoreInteractions(node)
 
 		d.addCallback(verifyCalls)
@@ -290,6 +291,8 @@ class InotifyTests(unittest.TestCase):
 		cluster=mock()
 		when(cluster).get_nodes().thenReturn([n1, n2, n3])
 		when(cluster).get_local_node().thenReturn(n3)
+		when(n1).run_deferred("svn update tests/stubs/cfg/").thenReturn(defer.succeed([]))
+		when(n2).run_deferred("svn update tests/stubs/cfg/").thenReturn(defer.succeed([]))
 
 		when(cxm.xencluster.XenCluster).getDeferInstance(["node1", "node2", "node3"]).thenReturn(defer.succeed(cluster))
 
@@ -303,8 +306,8 @@ class InotifyTests(unittest.TestCase):
 			verify(cluster).get_nodes()
 			verify(cluster).get_local_node()
 			verifyNoMoreInteractions(cluster)
-			verify(n1).run("svn update tests/stubs/cfg/")
-			verify(n2).run("svn update tests/stubs/cfg/")
+			verify(n1).run_deferred("svn update tests/stubs/cfg/")
+			verify(n2).run_deferred("svn update tests/stubs/cfg/")
 
 		d.addCallback(verifyCalls)
 		return d
@@ -83,6 +83,10 @@ class VMTests(unittest.TestCase):
 		vm=cxm.vm.VM("test1.home.net")
 		self.assertEqual(vm.ram, 512)
 
+	def test_get_priority(self):
+		self.assertEqual(cxm.vm.VM("test1.home.net").get_priority(), 0)
+		self.assertEqual(cxm.vm.VM("test2.home.net").get_priority(), 10)
+
 	def test_get_vcpu_via_metrics(self):
 		vm=cxm.vm.VM("test1.home.net")
 		vm.metrics={'VCPUs_number': "5"}
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2010-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+
+
+from cxm.vmindex import *
+import unittest
+from mocker import *
+
+class VMIndexTests(MockerTestCase):
+
+	def setUp(self):
+		self.index=VMIndex()
+		self.index.update("node1", ["vm1", "vm2"])
+		self.index.update("node2", ["vm3"])
+
+	def test_locate(self):
+		self.assertEquals(self.index.locate("vm1"), ["node1"])
+		self.assertEquals(self.index.locate("vm3"), ["node2"])
+		self.assertEquals(self.index.locate("vm4"), [])
+
+	def test_update(self):
+		self.index.update("node1", ["vm2", "vm3"])
+		self.assertEquals(self.index.locate("vm1"), [])
+		self.assertEquals(sorted(self.index.locate("vm3")), ["node1", "node2"])
+		self.assertEquals(self.index.get_index(), {'vm2': ['node1'], 'vm3': ['node1', 'node2']})
+
+	def test_remove(self):
+		self.index.remove("node1")
+		self.assertEquals(self.index.get_index(), {'vm3': ['node2']})
+		self.index.remove("node3")
+
+	def test_sync(self):
+		self.index.sync({
+			'node2': {'timestamp': 0, 'offset': 0, 'vms': ['vm3', 'vm4']},
+			'node3': {'timestamp': 0, 'offset': 0, 'vms': ['vm4']},
+		})
+		self.assertEquals(self.index.locate("vm1"), [])
+		self.assertEquals(sorted(self.index.locate("vm4")), ["node2", "node3"])
+
+	def test_get_duplicates(self):
+		self.assertEquals(self.index.get_duplicates(), {})
+		self.index.update("node2", ["vm1", "vm3"])
+		self.assertEquals(self.index.get_duplicates().keys(), ["vm1"])
+		self.assertEquals(sorted(self.index.get_duplicates()["vm1"]), ["node1", "node2"])
+
+
+if __name__ == "__main__":
+    unittest.main()
+
+# vim: ts=4:sw=4:ai
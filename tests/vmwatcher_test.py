@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+# -*- coding:Utf-8 -*-
+
+# cxm - Clustered Xen Management API and tools
+# Copyleft 2010-2012 - Nicolas AGIUS <nicolas.agius@lps-it.fr>
+
+###########################################################################
+#
+# This file is part of cxm.
+#
+# cxm is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+###########################################################################
+
+import cxm.core, cxm.vmwatcher
+import unittest, socket
+from mocker import *
+
+
+class VMWatcherTests(MockerTestCase):
+
+	def setUp(self):
+		cxm.core.cfg['QUIET']=True
+		cxm.core.cfg['API_DEBUG']=False
+
+		node=self.mocker.mock()
+		node.hostname
+		self.mocker.result("node1")
+		self.mocker.count(0, None)
+
+		self.vm_records = {
+			'vm-ref1': { 'name_label': 'test1.home.net', 'metrics': 'met-ref1' },
+			'vm-ref2': { 'name_label': 'test2.home.net', 'metrics': 'met-ref2' },
+		}
+		self.metrics_records = {
+			'met-ref1': { 'memory_actual': '1073741824' },
+			'met-ref2': { 'memory_actual': '536870912' },
+		}
+
+		self.xs = self.mocker.mock()
+		self.xs.xenapi.VM.get_all_records()
+		self.mocker.result(self.vm_records)
+		self.xs.xenapi.VM_metrics.get_all_records()
+		self.mocker.result(self.metrics_records)
+
+		self.watcher=cxm.vmwatcher.VMWatcher(node)
+		self.watcher._running=True
+
+	def test_sync(self):
+		self.mocker.replay()
+
+		self.assertFalse(self.watcher.is_ready())
+		self.watcher.sync(self.xs)
+		self.assertTrue(self.watcher.is_ready())
+		self.assertEqual(self.watcher.get_vm_records(), self.vm_records)
+		self.assertEqual(self.watcher.get_vm_metrics_records(), self.metrics_records)
+
+	def test_process__mod(self):
+		record={ 'name_label': 'test1.home.net', 'metrics': 'met-ref1', 'power_state': 'Paused' }
+		metrics={ 'memory_actual': '2147483648' }
+
+		self.xs.xenapi.VM.get_record('vm-ref1')
+		self.mocker.result(record)
+		self.xs.xenapi.VM_metrics.get_record('met-ref1')
+		self.mocker.result(metrics)
+		self.mocker.replay()
+
+		self.watcher.sync(self.xs)
+		self.watcher.process(self.xs, {'class': 'VM', 'operation': 'mod', 'ref': 'vm-ref1'})
+		self.assertEqual(self.watcher.get_vm_records()['vm-ref1'], record)
+		self.assertEqual(self.watcher.get_vm_metrics_records()['met-ref1'], metrics)
+
+	def test_process__snapshot(self):
+		record={ 'name_label': 'test3.home.net', 'metrics': 'met-ref3' }
+		metrics={ 'memory_actual': '2147483648' }
+
+		self.xs.xenapi.VM_metrics.get_record('met-ref3')
+		self.mocker.result(metrics)
+		self.mocker.replay()
+
+		self.watcher.sync(self.xs)
+		self.watcher.process(self.xs, {'class': 'VM', 'operation': 'add', 'ref': 'vm-ref3', 'snapshot': record})
+		self.assertEqual(len(self.watcher.get_vm_records()), 3)
+		self.assertEqual(self.watcher.get_vm_records()['vm-ref3'], record)
+
+	def test_process__del(self):
+		self.mocker.replay()
+
+		self.watcher.sync(self.xs)
+		self.watcher.process(self.xs, {'class': 'VM', 'operation': 'del', 'ref': 'vm-ref2'})
+		self.assertEqual(self.watcher.get_vm_records().keys(), ['vm-ref1'])
+		self.assertEqual(self.watcher.get_vm_metrics_records().keys(), ['met-ref1'])
+
+	def test_stop(self):
+		self.mocker.replay()
+
+		self.watcher.sync(self.xs)
+		self.watcher.stop()
+		self.assertFalse(self.watcher.is_ready())
+
+	def test_is_ready__stale(self):
+		self.mocker.replay()
+
+		self.watcher.sync(self.xs)
+		self.watcher._refreshed-=cxm.vmwatcher.VMWatcher.TM_STALE
+		self.assertFalse(self.watcher.is_ready())
+
+	def test_sync__restarted(self):
+		self.xs.xenapi.VM.get_all_records()
+		self.mocker.result(self.vm_records)
+		self.xs.xenapi.VM_metrics.get_all_records()
+		self.mocker.result(self.metrics_records)
+		self.mocker.replay()
+
+		# Thread of a previous run, unblocked after a restart
+		self.watcher._generation=2
+		self.watcher.sync(self.xs, 1)
+		self.watcher.process(self.xs, {'class': 'VM', 'operation': 'del', 'ref': 'vm-ref2'}, 1)
+		self.assertFalse(self.watcher.is_ready())
+		self.assertEqual(self.watcher.get_vm_records(), {})
+
+		self.watcher.sync(self.xs, 2)
+		self.assertTrue(self.watcher.is_ready())
+
+	def test_run__timeout(self):
+		def stop(timeout):
+			self.watcher.stop()
+			raise Exception("stopped")
+
+		self.watcher.node.open_session(cxm.vmwatcher.VMWatcher.TM_EVENT)
+		self.mocker.result(self.xs)
+		self.xs.xenapi.event.register(cxm.vmwatcher.VMWatcher.CLASSES)
+		self.xs.xenapi.event.next()
+		self.mocker.throw(socket.timeout("timed out"))
+		self.xs.xenapi.session.logout()
+
+		# Resync with a new session, without waiting
+		self.watcher.node.open_session(cxm.vmwatcher.VMWatcher.TM_EVENT)
+		self.mocker.call(stop)
+		self.mocker.replace("time.sleep")
+		self.mocker.replay()
+
+		self.watcher.run()
+		self.assertEqual(self.watcher.get_vm_records(), self.vm_records)
+
+
+if __name__ == '__main__':
+	unittest.main()
+
+# vim: ts=4:sw=4:ai
@@ -23,8 +23,8 @@
 #
 ###########################################################################
 
-import cxm.core, cxm.xencluster, cxm.node
-import unittest, os, socket
+import cxm.core, cxm.xencluster, cxm.node, cxm.vm
+import unittest, os, socket, time
 from mocker import *
 
 class XenClusterTests(MockerTestCase):
@@ -99,42 +99,180 @@ class XenClusterTests(MockerTestCase):
 		vmname="test1.home.net"
 
 		node = self.mocker.mock()
-		node.is_vm_started(vmname)
-		self.mocker.result(True)
+		node.get_hostname()
+		self.mocker.result(socket.gethostname())
+		self.mocker.count(1,None)
+		node.get_snapshot(['vms'])
+		self.mocker.result({'vms': [vmname]})
 		self.mocker.replay()
 		self.cluster.nodes={socket.gethostname(): node}
 
 		result=self.cluster.search_vm_started(vmname)
 		self.assertEqual(len(result), 1)
 
-	def test_search_vm_autostart(self):
+	def test_locate_vm(self):
 		vmname="test1.home.net"
 
 		node = self.mocker.mock()
-		node.is_vm_autostart_enabled(vmname)
+		node.is_vm_started(vmname)
 		self.mocker.result(True)
 		self.mocker.replay()
 		self.cluster.nodes={socket.gethostname(): node}
+		self.cluster.set_vm_index({vmname: [socket.gethostname()]})
+
+		result=self.cluster.locate_vm(vmname)
+		self.assertEqual(result, [node])
+		self.assertEqual(self.cluster.locate_vm("test2.home.net"), [])
+
+	def test_locate_vm__outdated(self):
+		vmname="test1.home.net"
+
+		node = self.mocker.mock()
+		node.is_vm_started(vmname)
+		self.mocker.result(False)
+		node.get_hostname()
+		self.mocker.result(socket.gethostname())
+		self.mocker.count(1,None)
+		node.get_snapshot(['vms'])
+		self.mocker.result({'vms': []})
+		self.mocker.replay()
+		self.cluster.nodes={socket.gethostname(): node}
+		self.cluster.set_vm_index({vmname: [socket.gethostname()]})
+
+		result=self.cluster.locate_vm(vmname)
+		self.assertEqual(result, [])
+
+	def test_get_capacities(self):
+		cxm.core.cfg['HB_METRICS_INTERVAL']=10
+		cxm.core.cfg['LB_MAX_VM_PER_NODE']=20
+
+		node = self.mocker.mock()
+		node.get_hostname()
+		self.mocker.result("node1")
+		self.mocker.count(1,None)
+		node.metrics.get_free_ram(False)
+		self.mocker.result(200)
+		node.metrics.get_used_irq()
+		self.mocker.result(100)
+		node.get_vm_started()
+		self.mocker.result(2)
+		self.mocker.replay()
+
+		self.assertEqual(self.cluster.get_capacities(node), {'ram': 200, 'irq': 924, 'vms': 18})
+
+		self.cluster.set_metrics({'node1': {'timestamp': int(time.time()), 'free_ram': 100, 'used_irq': 24,
+			'vms': {'vm1': {'ram': 512, 'cpu': 0}}}})
+		self.assertEqual(self.cluster.get_capacities(node), {'ram': 100, 'irq': 1000, 'vms': 19})
+
+	def test_get_capacities__outdated(self):
+		cxm.core.cfg['HB_METRICS_INTERVAL']=10
+		cxm.core.cfg['LB_MAX_VM_PER_NODE']=20
+
+		node = self.mocker.mock()
+		node.get_hostname()
+		self.mocker.result("node1")
+		self.mocker.count(1,None)
+		node.metrics.get_free_ram(False)
+		self.mocker.result(200)
+		node.metrics.get_used_irq()
+		self.mocker.result(100)
+		node.get_vm_started()
+		self.mocker.result(2)
+		self.mocker.replay()
+
+		self.cluster.set_metrics({'node1': {'timestamp': int(time.time())-60, 'free_ram': 100, 'used_irq': 24, 'vms': {}}})
+		self.assertEqual(self.cluster.get_capacities(node), {'ram': 200, 'irq': 924, 'vms': 18})
+
+	def test_get_capacities__vcpu(self):
+		cxm.core.cfg['LB_MAX_VM_PER_NODE']=20
+		cxm.core.cfg['PLACEMENT_VCPU_RATIO']=1.5
+
+		vm = self.mocker.mock()
+		vm.get_vcpu()
+		self.mocker.result(4)
+		node = self.mocker.mock()
+		node.get_hostname()
+		self.mocker.result("node1")
+		node.metrics.get_free_ram(False)
+		self.mocker.result(200)
+		node.metrics.get_used_irq()
+		self.mocker.result(100)
+		node.get_vm_started()
+		self.mocker.result(1)
+		node.metrics.get_host_nr_cpus()
+		self.mocker.result(4)
+		node.get_vms()
+		self.mocker.result([vm])
+		self.mocker.replay()
+
+		try:
+			self.assertEqual(self.cluster.get_capacities(node), {'ram': 200, 'irq': 924, 'vms': 19, 'vcpu': 2})
+		finally:
+			cxm.core.cfg['PLACEMENT_VCPU_RATIO']=0.0
+
+	def test_get_failover_plan(self):
+		cxm.core.cfg['HB_METRICS_INTERVAL']=10
+		plan={'timestamp': int(time.time()), 'vms': {'vm1': 512, 'vm2': 128}, 'unplaced': [],
+			'capacities': {'node2': {'ram': 600}, 'node3': {'ram': 200}}, 'placement': {'vm1': 'node2', 'vm2': 'node3'}}
+		self.cluster.nodes={'node2': None, 'node3': None}
+
+		self.assertEqual(self.cluster.get_failover_plan('node1', ['vm1', 'vm2']), None)
+
+		self.cluster.set_failover_plans({'node1': plan})
+		self.assertEqual(self.cluster.get_failover_plan('node1', ['vm2', 'vm1']), plan)
+		self.assertEqual(self.cluster.get_failover_plan('node1', ['vm1', 'vm2', 'vm3']), None)
+		self.assertEqual(self.cluster.get_failover_plan('node2', []), None)
+
+	def test_get_failover_plan__stale(self):
+		cxm.core.cfg['HB_METRICS_INTERVAL']=10
+		plan={'timestamp': int(time.time()), 'vms': {'vm1': 512}, 'unplaced': [],
+			'capacities': {'node2': {'ram': 600}, 'node3': {'ram': 200}}, 'placement': {'vm1': 'node2'}}
+		self.cluster.set_failover_plans({'node1': plan})
+
+		# Lost node
+		self.cluster.nodes={'node2': None}
+		self.assertEqual(self.cluster.get_failover_plan('node1', ['vm1']), None)
+
+		# Outdated
+		self.cluster.nodes={'node2': None, 'node3': None}
+		plan['timestamp']=int(time.time())-60
+		self.assertEqual(self.cluster.get_failover_plan('node1', ['vm1']), None)
+
+		# Not feasible
+		plan['timestamp']=int(time.time())
+		plan['unplaced']=['vm2']
+		self.assertEqual(self.cluster.get_failover_plan('node1', ['vm1']), None)
+
+	def test_search_vm_autostart(self):
+		vmname="test1.home.net"
+
+		node = self.mocker.mock()
+		node.get_hostname()
+		self.mocker.result(socket.gethostname())
+		self.mocker.count(1,None)
+		node.get_snapshot(['autostart'])
+		self.mocker.result({'autostart': [vmname]})
+		self.mocker.replay()
+		self.cluster.nodes={socket.gethostname(): node}
 
 		result=self.cluster.search_vm_autostart(vmname)
 		self.assertEqual(len(result), 1)
 
 	def test_activate_vm(self):
 		vmname="test1.home.net"
+		lvs=cxm.vm.VM(vmname).get_lvs()
 
 		n1_mocker = Mocker()
 		n1 = n1_mocker.mock()
-		n1.is_vm_started(vmname)
-		n1_mocker.result(False)
-		n1.deactivate_lv(vmname)
-		n1.activate_lv(vmname)
+		n1.get_vgs(lvs)
+		n1_mocker.result(['vgrack'])
+		n1.deactivate_lv(vmname, lvs, ['vgrack'])
+		n1.activate_lv(vmname, lvs, ['vgrack'])
 		n1_mocker.replay()
 
 		n2_mocker = Mocker()
 		n2 = n2_mocker.mock()
-		n2.is_vm_started(vmname)
-		n2_mocker.result(False)
-		n2.deactivate_lv(vmname)
+		n2.deactivate_lv(vmname, lvs, ['vgrack'])
 		n2_mocker.replay()
 
 		self.cluster.nodes={'host1': n1, 'host2': n2}
@@ -147,15 +285,48 @@ class XenClusterTests(MockerTestCase):
 	def test_activate_vm__runing(self):
 		vmname="test1.home.net"
 
-		node = self.mocker.mock()
-		node.is_vm_started(vmname)
-		self.mocker.result(True)
-		node.get_hostname()
-		self.mocker.result(socket.gethostname())
+		n1 = self.mocker.mock()
+		n1.get_vgs(ANY)
+		self.mocker.result(['vgrack'])
+		n1.deactivate_lv(vmname, ANY, ['vgrack'])
+		n1.get_hostname()
+		self.mocker.result('host1')
+		self.mocker.count(0,None)
+		n2 = self.mocker.mock()
+		n2.deactivate_lv(vmname, ANY, ['vgrack'])
+		self.mocker.throw(cxm.node.RunningVmError('host2', vmname))
+		n2.get_hostname()
+		self.mocker.result('host2')
+		self.mocker.count(0,None)
 		self.mocker.replay()
-		self.cluster.nodes={socket.gethostname(): node}
+		self.cluster.nodes={'host1': n1, 'host2': n2}
 	
-		self.assertRaises(cxm.node.RunningVmError,self.cluster.activate_vm,node,vmname)
+		self.assertRaises(cxm.node.RunningVmError,self.cluster.activate_vm,n1,vmname)
+
+	def test_activate_vm__error(self):
+		vmname="test1.home.net"
+
+		n1 = self.mocker.mock()
+		n1.get_vgs(ANY)
+		self.mocker.result(['vgrack'])
+		n1.deactivate_lv(vmname, ANY, ['vgrack'])
+		self.mocker.throw(cxm.node.ShellError('host1', "lvchange failed", 5))
+		n1.get_hostname()
+		self.mocker.result('host1')
+		n2 = self.mocker.mock()
+		n2.deactivate_lv(vmname, ANY, ['vgrack'])
+		self.mocker.throw(cxm.node.ShellError('host2', "lvchange failed", 5))
+		n2.get_hostname()
+		self.mocker.result('host2')
+		self.mocker.replay()
+		self.cluster.nodes={'host1': n1, 'host2': n2}
+
+		try:
+			self.cluster.activate_vm(n1,vmname)
+		except cxm.xencluster.MultipleError, e:
+			self.assertEquals(sorted(e.value.keys()), ['host1', 'host2'])
+		else:
+			self.fail("MultipleError not raised")
 
 	def test_start_vm(self):
 		vmname="test1.home.net"
@@ -163,10 +334,10 @@ class XenClusterTests(MockerTestCase):
 		node = self.mocker.mock()
 		node.metrics.get_free_ram()
 		self.mocker.result(1024)
-		node.is_vm_started(vmname)
-		self.mocker.result(False)
-		node.deactivate_lv(vmname)
-		node.activate_lv(vmname)
+		node.get_vgs(ANY)
+		self.mocker.result(['vgrack'])
+		node.deactivate_lv(vmname, ANY, ['vgrack'])
+		node.activate_lv(vmname, ANY, ['vgrack'])
 		node.start(vmname)
 		self.mocker.replay()
 
@@ -181,26 +352,36 @@ class XenClusterTests(MockerTestCase):
 		node1 = n1_mocker.mock()
 		node1.metrics.get_free_ram()
 		n1_mocker.result(64)
+		node1.metrics.get_free_ram(False)
+		n1_mocker.result(64)
+		node1.metrics.get_used_irq()
+		n1_mocker.result(100)
+		node1.get_vm_started()
+		n1_mocker.result(2)
+		node1.get_hostname()
+		n1_mocker.result('host1')
 		n1_mocker.count(1,None)
-		node1.is_vm_started(vmname)
-		n1_mocker.result(False)
-		node1.deactivate_lv(vmname)
+		node1.deactivate_lv(vmname, ANY, ['vgrack'])
 		node1.disable_vm_autostart(vmname)
 		n1_mocker.replay()
 
 		n2_mocker = Mocker()
 		node2 = n2_mocker.mock()
-		node2.metrics.get_free_ram()
+		node2.metrics.get_free_ram(False)
 		n2_mocker.result(1024)
-		n2_mocker.count(1,None)
-		node2.is_vm_started(vmname)
-		n2_mocker.result(False)
-		node2.deactivate_lv(vmname)
-		node2.activate_lv(vmname)
+		node2.metrics.get_used_irq()
+		n2_mocker.result(100)
+		node2.get_vm_started()
+		n2_mocker.result(2)
+		node2.get_vgs(ANY)
+		n2_mocker.result(['vgrack'])
+		node2.deactivate_lv(vmname, ANY, ['vgrack'])
+		node2.activate_lv(vmname, ANY, ['vgrack'])
 		node2.start(vmname)
 		node2.enable_vm_autostart(vmname)
 		node2.get_hostname()
 		n2_mocker.result('host2')
+		n2_mocker.count(1,None)
 		n2_mocker.replay()
 
 		self.cluster.nodes={'host2': node2, 'host1': node1}
@@ -216,25 +397,45 @@ class XenClusterTests(MockerTestCase):
 		node = self.mocker.mock()
 		node.metrics.get_free_ram()
 		self.mocker.result(64)
-		self.mocker.count(1,None)
+		node.metrics.get_free_ram(False)
+		self.mocker.result(64)
+		node.metrics.get_used_irq()
+		self.mocker.result(100)
+		node.get_vm_started()
+		self.mocker.result(2)
 		node.get_hostname()
 		self.mocker.result(socket.gethostname())
+		self.mocker.count(1,None)
 		self.mocker.replay()
 
 		self.cluster.nodes={socket.gethostname(): node}
 		
 		self.assertRaises(cxm.node.NotEnoughRamError,self.cluster.start_vm,node, vmname, False)
 
+	def test_start_vm__no_node(self):
+		vmname="test1.home.net"
+
+		node = self.mocker.mock()
+		node.metrics.get_free_ram()
+		self.mocker.result(64)
+		node.get_hostname()
+		self.mocker.result(socket.gethostname())
+		self.mocker.replay()
+
+		self.cluster.nodes={}
+
+		self.assertRaises(cxm.node.NotEnoughRamError,self.cluster.start_vm,node, vmname, False)
+
 	def test_start_vm__error(self):
 		vmname="test1.home.net"
 		
 		node = self.mocker.mock()
 		node.metrics.get_free_ram()
 		self.mocker.result(1024)
-		node.is_vm_started(vmname)
-		self.mocker.result(False)
-		node.deactivate_lv(vmname)
-		node.activate_lv(vmname)
+		node.get_vgs(ANY)
+		self.mocker.result(['vgrack'])
+		node.deactivate_lv(vmname, ANY, ['vgrack'])
+		node.activate_lv(vmname, ANY, ['vgrack'])
 		node.start(vmname)
 		self.mocker.throw(Exception)
 		node.deactivate_lv(vmname)
@@ -403,39 +604,21 @@ class XenClusterTests(MockerTestCase):
 
 	def test_check(self):
 
-		vm1_mocker = Mocker()
-		vm1 = vm1_mocker.mock()
-		vm1.name
-		vm1_mocker.result('vm1')
-		vm1_mocker.count(1,None)
-		vm1_mocker.replay()
-
-		vm2_mocker = Mocker()
-		vm2 = vm2_mocker.mock()
-		vm2.name
-		vm2_mocker.result('vm2')
-		vm2_mocker.count(1,None)
-		vm2_mocker.replay()
-
-		vm3_mocker = Mocker()
-		vm3 = vm3_mocker.mock()
-		vm3.name
-		vm3_mocker.result('vm3')
-		vm3_mocker.count(1,None)
-		vm3_mocker.replay()
+		snap1={'vms': ['vm1', 'vm2'], 'bridges': [], 'cfg': [], 'lvs': {}, 'autostart': []}
+		snap2={'vms': ['vm2', 'vm3'], 'bridges': [], 'cfg': [], 'lvs': {}, 'autostart': []}
 
 		n1_mocker = Mocker()
 		n1 = n1_mocker.mock()
 		n1.get_hostname()
 		n1_mocker.result("node1")
 		n1_mocker.count(1,None)
-		n1.get_vms()
-		n1_mocker.result([vm1, vm2])
-		n1.check_missing_lvs()
+		n1.get_snapshot(['bridges', 'autostart', 'cfg', 'lvs', 'vms'])
+		n1_mocker.result(snap1)
+		n1.check_missing_lvs(snap1)
 		n1_mocker.result(True)
-		n1.check_activated_lvs()
+		n1.check_activated_lvs(snap1)
 		n1_mocker.result(True)
-		n1.check_autostart()
+		n1.check_autostart(snap1)
 		n1_mocker.result(True)
 		n1_mocker.replay()
 
@@ -444,22 +627,23 @@ class XenClusterTests(MockerTestCase):
 		n2.get_hostname()
 		n2_mocker.result('node2')
 		n2_mocker.count(1,None)
-		n2.get_vms()
-		n2_mocker.result([vm2, vm3])
-		n2.check_activated_lvs()
+		n2.get_snapshot(['bridges', 'autostart', 'cfg', 'lvs', 'vms'])
+		n2_mocker.result(snap2)
+		n2.check_activated_lvs(snap2)
 		n2_mocker.result(True)
-		n2.check_autostart()
+		n2.check_autostart(snap2)
 		n2_mocker.result(True)
 		n2_mocker.replay()
 
 		get_local_node = self.mocker.replace(self.cluster.get_local_node)
 		get_local_node()
 		self.mocker.result(n1)
+		self.mocker.count(1,None)
 		check_bridges =  self.mocker.replace(self.cluster.check_bridges)
-		check_bridges()
+		check_bridges({'node1': snap1, 'node2': snap2})
 		self.mocker.result(True)
 		check_cfg =  self.mocker.replace(self.cluster.check_cfg)
-		check_cfg()
+		check_cfg({'node1': snap1, 'node2': snap2})
 		self.mocker.result(True)
 		self.mocker.replay()
 
@@ -473,16 +657,16 @@ class XenClusterTests(MockerTestCase):
 		n1 = n1_mocker.mock()
 		n1.get_hostname()
 		n1_mocker.result("node1")
-		n1.get_bridges()
-		n1_mocker.result(['xenbr1','xenbr2','xenbr3'])
+		n1.get_snapshot(['bridges'])
+		n1_mocker.result({'bridges': ['xenbr1','xenbr2','xenbr3']})
 		n1_mocker.replay()
 
 		n2_mocker = Mocker()
 		n2 = n2_mocker.mock()
 		n2.get_hostname()
 		n2_mocker.result('node2')
-		n2.get_bridges()
-		n2_mocker.result(['xenbr4','xenbr2'])
+		n2.get_snapshot(['bridges'])
+		n2_mocker.result({'bridges': ['xenbr4','xenbr2']})
 		n2_mocker.replay()
 
 		self.cluster.nodes={'node1': n1, 'node2': n2}
@@ -495,16 +679,16 @@ class XenClusterTests(MockerTestCase):
 		n1 = n1_mocker.mock()
 		n1.get_hostname()
 		n1_mocker.result("node1")
-		n1.get_bridges()
-		n1_mocker.result(['xenbr2','xenbr1'])
+		n1.get_snapshot(['bridges'])
+		n1_mocker.result({'bridges': ['xenbr2','xenbr1']})
 		n1_mocker.replay()
 
 		n2_mocker = Mocker()
 		n2 = n2_mocker.mock()
 		n2.get_hostname()
 		n2_mocker.result('node2')
-		n2.get_bridges()
-		n2_mocker.result(['xenbr1','xenbr2'])
+		n2.get_snapshot(['bridges'])
+		n2_mocker.result({'bridges': ['xenbr1','xenbr2']})
 		n2_mocker.replay()
 
 		self.cluster.nodes={'node1': n1, 'node2': n2}
@@ -517,16 +701,16 @@ class XenClusterTests(MockerTestCase):
 		n1 = n1_mocker.mock()
 		n1.get_hostname()
 		n1_mocker.result("node1")
-		n1.get_possible_vm_names()
-		n1_mocker.result(['vm1','vm2','vm3'])
+		n1.get_snapshot(['cfg'])
+		n1_mocker.result({'cfg': ['vm1','vm2','vm3']})
 		n1_mocker.replay()
 
 		n2_mocker = Mocker()
 		n2 = n2_mocker.mock()
 		n2.get_hostname()
 		n2_mocker.result('node2')
-		n2.get_possible_vm_names()
-		n2_mocker.result(['vm4','vm2'])
+		n2.get_snapshot(['cfg'])
+		n2_mocker.result({'cfg': ['vm4','vm2']})
 		n2_mocker.replay()
 
 		self.cluster.nodes={'node1': n1, 'node2': n2}
@@ -539,16 +723,16 @@ class XenClusterTests(MockerTestCase):
 		n1 = n1_mocker.mock()
 		n1.get_hostname()
 		n1_mocker.result("node1")
-		n1.get_possible_vm_names()
-		n1_mocker.result(['vm2','vm1'])
+		n1.get_snapshot(['cfg'])
+		n1_mocker.result({'cfg': ['vm2','vm1']})
 		n1_mocker.replay()
 
 		n2_mocker = Mocker()
 		n2 = n2_mocker.mock()
 		n2.get_hostname()
 		n2_mocker.result('node2')
-		n2.get_possible_vm_names()
-		n2_mocker.result(['vm1','vm2'])
+		n2.get_snapshot(['cfg'])
+		n2_mocker.result({'cfg': ['vm1','vm2']})
 		n2_mocker.replay()
 
 		self.cluster.nodes={'node1': n1, 'node2': n2}
@@ -624,6 +808,8 @@ class XenClusterTests(MockerTestCase):
 		vm1.get_ram()
 		vm1_mocker.result(512)
 		vm1_mocker.count(1,None)
+		vm1.get_demand(True)
+		vm1_mocker.result({'ram': 512, 'irq': 3, 'vms': 1, 'vcpu': 1})
 		vm1.name
 		vm1_mocker.result('vm1')
 		vm1_mocker.count(1,None)
@@ -634,6 +820,8 @@ class XenClusterTests(MockerTestCase):
 		vm2.get_ram()
 		vm2_mocker.result(128)
 		vm2_mocker.count(1,None)
+		vm2.get_demand(True)
+		vm2_mocker.result({'ram': 128, 'irq': 3, 'vms': 1, 'vcpu': 1})
 		vm2.name
 		vm2_mocker.result('vm2')
 		vm2_mocker.count(1,None)
@@ -652,12 +840,10 @@ class XenClusterTests(MockerTestCase):
 		n2 = n2_mocker.mock()
 		n2.metrics.get_free_ram(False)
 		n2_mocker.result(150)
-		n2.metrics.get_free_ram()
-		n2_mocker.result(150)
-		n2.metrics.get_free_ram(False)
-		n2_mocker.result(150)
-		n2.metrics.get_free_ram()
-		n2_mocker.result(150)
+		n2.metrics.get_used_irq()
+		n2_mocker.result(100)
+		n2.get_vm_started()
+		n2_mocker.result(2)
 		n2.get_hostname()
 		n2_mocker.result("node2")
 		n2_mocker.count(1,None)
@@ -667,18 +853,84 @@ class XenClusterTests(MockerTestCase):
 		n3 = n3_mocker.mock()
 		n3.metrics.get_free_ram(False)
 		n3_mocker.result(520)
-		n3.metrics.get_free_ram()
-		n3_mocker.result(520)
-		n3.metrics.get_free_ram(False)
-		n3_mocker.result(8)
-		n3.metrics.get_free_ram()
-		n3_mocker.result(8)
+		n3.metrics.get_used_irq()
+		n3_mocker.result(100)
+		n3.get_vm_started()
+		n3_mocker.result(2)
+		n3.get_hostname()
+		n3_mocker.result("node3")
+		n3_mocker.count(1,None)
+		n3_mocker.replay()
+
+		self.cluster.nodes={'node1': n1, 'node2': n2, 'node3': n3}
+
+		self.cluster.emergency_eject(n1)
+
+		n1_mocker.verify()
+		n2_mocker.verify()
+		n3_mocker.verify()
+		vm1_mocker.verify()
+		vm2_mocker.verify()
+
+	def test_emergency_eject__plan(self):
+		cxm.core.cfg['HB_METRICS_INTERVAL']=10
+
+		migrate = self.mocker.replace(self.cluster.migrate)
+		migrate('vm1', 'node1', 'node2')
+		migrate('vm2', 'node1', 'node3')
+		self.mocker.replay()
+
+		vm1_mocker = Mocker()
+		vm1 = vm1_mocker.mock()
+		vm1.get_ram()
+		vm1_mocker.result(512)
+		vm1_mocker.count(1,None)
+		vm1.get_demand(True)
+		vm1_mocker.result({'ram': 512, 'irq': 3, 'vms': 1, 'vcpu': 1})
+		vm1.name
+		vm1_mocker.result('vm1')
+		vm1_mocker.count(1,None)
+		vm1_mocker.replay()
+
+		vm2_mocker = Mocker()
+		vm2 = vm2_mocker.mock()
+		vm2.get_ram()
+		vm2_mocker.result(128)
+		vm2_mocker.count(1,None)
+		vm2.get_demand(True)
+		vm2_mocker.result({'ram': 128, 'irq': 3, 'vms': 1, 'vcpu': 1})
+		vm2.name
+		vm2_mocker.result('vm2')
+		vm2_mocker.count(1,None)
+		vm2_mocker.replay()
+
+		n1_mocker = Mocker()
+		n1 = n1_mocker.mock(cxm.node.Node)
+		n1.get_vms()
+		n1_mocker.result([vm1,vm2])
+		n1.get_hostname()
+		n1_mocker.result("node1")
+		n1_mocker.count(1,None)
+		n1_mocker.replay()
+
+		# Free ram is not queried
+		n2_mocker = Mocker()
+		n2 = n2_mocker.mock()
+		n2.get_hostname()
+		n2_mocker.result("node2")
+		n2_mocker.count(1,None)
+		n2_mocker.replay()
+
+		n3_mocker = Mocker()
+		n3 = n3_mocker.mock()
 		n3.get_hostname()
 		n3_mocker.result("node3")
 		n3_mocker.count(1,None)
 		n3_mocker.replay()
 
 		self.cluster.nodes={'node1': n1, 'node2': n2, 'node3': n3}
+		self.cluster.set_failover_plans({'node1': {'timestamp': int(time.time()), 'vms': {'vm1': 512, 'vm2': 128},
+			'unplaced': [], 'capacities': {'node2': {'ram': 600}, 'node3': {'ram': 200}}, 'placement': {'vm1': 'node2', 'vm2': 'node3'}}})
 
 		self.cluster.emergency_eject(n1)
 
@@ -700,6 +952,8 @@ class XenClusterTests(MockerTestCase):
 		vm1.get_ram()
 		vm1_mocker.result(1024)
 		vm1_mocker.count(1,None)
+		vm1.get_demand(True)
+		vm1_mocker.result({'ram': 1024, 'irq': 3, 'vms': 1, 'vcpu': 1})
 		vm1.name
 		vm1_mocker.result('vm1')
 		vm1_mocker.count(1,None)
@@ -710,6 +964,8 @@ class XenClusterTests(MockerTestCase):
 		vm2.get_ram()
 		vm2_mocker.result(510)
 		vm2_mocker.count(1,None)
+		vm2.get_demand(True)
+		vm2_mocker.result({'ram': 510, 'irq': 3, 'vms': 1, 'vcpu': 1})
 		vm2.name
 		vm2_mocker.result('vm2')
 		vm2_mocker.count(1,None)
@@ -720,6 +976,8 @@ class XenClusterTests(MockerTestCase):
 		vm3.get_ram()
 		vm3_mocker.result(128)
 		vm3_mocker.count(1,None)
+		vm3.get_demand(True)
+		vm3_mocker.result({'ram': 128, 'irq': 3, 'vms': 1, 'vcpu': 1})
 		vm3.name
 		vm3_mocker.result('vm3')
 		vm3_mocker.count(1,None)
@@ -738,16 +996,10 @@ class XenClusterTests(MockerTestCase):
 		n2 = n2_mocker.mock()
 		n2.metrics.get_free_ram(False)
 		n2_mocker.result(150)
-		n2.metrics.get_free_ram()
-		n2_mocker.result(150)
-		n2.metrics.get_free_ram(False)
-		n2_mocker.result(150)
-		n2.metrics.get_free_ram()
-		n2_mocker.result(150)
-		n2.metrics.get_free_ram(False)
-		n2_mocker.result(150)
-		n2.metrics.get_free_ram()
-		n2_mocker.result(150)
+		n2.metrics.get_used_irq()
+		n2_mocker.result(100)
+		n2.get_vm_started()
+		n2_mocker.result(2)
 		n2.get_hostname()
 		n2_mocker.result("node2")
 		n2_mocker.count(1,None)
@@ -757,16 +1009,10 @@ class XenClusterTests(MockerTestCase):
 		n3 = n3_mocker.mock()
 		n3.metrics.get_free_ram(False)
 		n3_mocker.result(520)
-		n3.metrics.get_free_ram()
-		n3_mocker.result(520)
-		n3.metrics.get_free_ram(False)
-		n3_mocker.result(520)
-		n3.metrics.get_free_ram()
-		n3_mocker.result(520)
-		n3.metrics.get_free_ram(False)
-		n3_mocker.result(8)
-		n3.metrics.get_free_ram()
-		n3_mocker.result(8)
+		n3.metrics.get_used_irq()
+		n3_mocker.result(100)
+		n3.get_vm_started()
+		n3_mocker.result(2)
 		n3.get_hostname()
 		n3_mocker.result("node3")
 		n3_mocker.count(1,None)
@@ -880,12 +1126,10 @@ class XenClusterTests(MockerTestCase):
 		n1 = n1_mocker.mock()
 		n1.metrics.get_free_ram(False)
 		n1_mocker.result(150)
-		n1.metrics.get_free_ram()
-		n1_mocker.result(150)
-		n1.metrics.get_free_ram(False)
-		n1_mocker.result(150)
-		n1.metrics.get_free_ram()
-		n1_mocker.result(150)
+		n1.metrics.get_used_irq()
+		n1_mocker.result(100)
+		n1.get_vm_started()
+		n1_mocker.result(2)
 		n1.start('test2.home.net')
 		n1.enable_vm_autostart('test2.home.net')
 		n1.get_hostname()
@@ -897,10 +1141,10 @@ class XenClusterTests(MockerTestCase):
 		n2 = n2_mocker.mock()
 		n2.metrics.get_free_ram(False)
 		n2_mocker.result(200)
-		n2.metrics.get_free_ram()
-		n2_mocker.result(200)
-		n2.metrics.get_free_ram(False)
-		n2_mocker.result(200)
+		n2.metrics.get_used_irq()
+		n2_mocker.result(100)
+		n2.get_vm_started()
+		n2_mocker.result(2)
 		n2.get_hostname()
 		n2_mocker.result("node2")
 		n2_mocker.count(0,None)
@@ -910,26 +1154,20 @@ class XenClusterTests(MockerTestCase):
 		n3 = n3_mocker.mock()
 		n3.metrics.get_free_ram(False)
 		n3_mocker.result(520)
-		n3.metrics.get_free_ram()
-		n3_mocker.result(520)
+		n3.metrics.get_used_irq()
+		n3_mocker.result(100)
+		n3.get_vm_started()
+		n3_mocker.result(2)
 		n3.start('test1.home.net')
 		n3.enable_vm_autostart('test1.home.net')
-		n3.metrics.get_free_ram(False)
-		n3_mocker.result(8)
-		n3.metrics.get_free_ram()
-		n3_mocker.result(8)
 		n3.get_hostname()
 		n3_mocker.result("node3")
 		n3_mocker.count(0,None)
 		n3_mocker.replay()
 
-		search_vm_started = self.mocker.replace(self.cluster.search_vm_started)
-		search_vm_started('test1.home.net')
-		self.mocker.result([])
-		search_vm_started('test2.home.net')
-		self.mocker.result([])
-		search_vm_started('testcfg.home.net')
-		self.mocker.result([n2])
+		snapshot = self.mocker.replace(self.cluster.snapshot)
+		snapshot(['vms'])
+		self.mocker.result({'node1': {'vms': []}, 'node2': {'vms': ['testcfg.home.net']}, 'node3': {'vms': []}})
 		activate_vm = self.mocker.replace(self.cluster.activate_vm)
 		activate_vm(n3, 'test1.home.net')
 		activate_vm(n1, 'test2.home.net')
@@ -943,14 +1181,67 @@ class XenClusterTests(MockerTestCase):
 		n2_mocker.verify()
 		n3_mocker.verify()
 
-	def test_start_vms__fail_noram(self):
+	def test_start_vms__plan(self):
 
 		n1_mocker = Mocker()
 		n1 = n1_mocker.mock()
 		n1.metrics.get_free_ram(False)
 		n1_mocker.result(150)
-		n1.metrics.get_free_ram()
+		n1.metrics.get_used_irq()
+		n1_mocker.result(100)
+		n1.get_vm_started()
+		n1_mocker.result(2)
+		n1.start('test2.home.net')
+		n1.enable_vm_autostart('test2.home.net')
+		n1.get_hostname()
+		n1_mocker.result("node1")
+		n1_mocker.count(0,None)
+		n1_mocker.replay()
+
+		n2_mocker = Mocker()
+		n2 = n2_mocker.mock()
+		n2.start('test1.home.net')
+		n2.enable_vm_autostart('test1.home.net')
+		n2.get_hostname()
+		n2_mocker.result("node2")
+		n2_mocker.count(0,None)
+		n2_mocker.replay()
+
+		n3_mocker = Mocker()
+		n3 = n3_mocker.mock()
+		n3.get_hostname()
+		n3_mocker.result("node3")
+		n3_mocker.count(0,None)
+		n3_mocker.replay()
+
+		snapshot = self.mocker.replace(self.cluster.snapshot)
+		snapshot(['vms'])
+		self.mocker.result({'node1': {'vms': []}, 'node2': {'vms': []}, 'node3': {'vms': []}})
+		activate_vm = self.mocker.replace(self.cluster.activate_vm)
+		activate_vm(n2, 'test1.home.net')
+		activate_vm(n1, 'test2.home.net')
+		self.mocker.replay()
+
+		self.cluster.nodes={'node1': n1, 'node2': n2, 'node3': n3}
+
+		# test2 doesn't fit on node3 anymore, node1 has no metrics
+		self.cluster.start_vms(['test1.home.net', 'test2.home.net'], {'capacities': {'node2': {'ram': 600}, 'node3': {'ram': 100}},
+			'placement': {'test1.home.net': 'node2', 'test2.home.net': 'node3'}})
+
+		n1_mocker.verify()
+		n2_mocker.verify()
+		n3_mocker.verify()
+
+	def test_start_vms__fail_noram(self):
+
+		n1_mocker = Mocker()
+		n1 = n1_mocker.mock()
+		n1.metrics.get_free_ram(False)
 		n1_mocker.result(150)
+		n1.metrics.get_used_irq()
+		n1_mocker.result(100)
+		n1.get_vm_started()
+		n1_mocker.result(2)
 		n1.get_hostname()
 		n1_mocker.result("node1")
 		n1_mocker.count(0,None)
@@ -960,8 +1251,10 @@ class XenClusterTests(MockerTestCase):
 		n2 = n2_mocker.mock()
 		n2.metrics.get_free_ram(False)
 		n2_mocker.result(200)
-		n2.metrics.get_free_ram()
-		n2_mocker.result(200)
+		n2.metrics.get_used_irq()
+		n2_mocker.result(100)
+		n2.get_vm_started()
+		n2_mocker.result(2)
 		n2.get_hostname()
 		n2_mocker.result("node2")
 		n2_mocker.count(0,None)
@@ -971,16 +1264,18 @@ class XenClusterTests(MockerTestCase):
 		n3 = n3_mocker.mock()
 		n3.metrics.get_free_ram(False)
 		n3_mocker.result(120)
-		n3.metrics.get_free_ram()
-		n3_mocker.result(120)
+		n3.metrics.get_used_irq()
+		n3_mocker.result(100)
+		n3.get_vm_started()
+		n3_mocker.result(2)
 		n3.get_hostname()
 		n3_mocker.result("node3")
 		n3_mocker.count(0,None)
 		n3_mocker.replay()
 
-		search_vm_started = self.mocker.replace(self.cluster.search_vm_started)
-		search_vm_started('test1.home.net')
-		self.mocker.result([])
+		snapshot = self.mocker.replace(self.cluster.snapshot)
+		snapshot(['vms'])
+		self.mocker.result({'node1': {'vms': []}, 'node2': {'vms': []}, 'node3': {'vms': []}})
 		self.mocker.replay()
 
 		self.cluster.nodes={'node1': n1, 'node2': n2, 'node3': n3}
@@ -998,8 +1293,10 @@ class XenClusterTests(MockerTestCase):
 		n1 = n1_mocker.mock()
 		n1.metrics.get_free_ram(False)
 		n1_mocker.result(150)
-		n1.metrics.get_free_ram()
-		n1_mocker.result(150)
+		n1.metrics.get_used_irq()
+		n1_mocker.result(100)
+		n1.get_vm_started()
+		n1_mocker.result(2)
 		n1.get_hostname()
 		n1_mocker.result("node1")
 		n1_mocker.count(0,None)
@@ -1009,8 +1306,10 @@ class XenClusterTests(MockerTestCase):
 		n2 = n2_mocker.mock()
 		n2.metrics.get_free_ram(False)
 		n2_mocker.result(200)
-		n2.metrics.get_free_ram()
-		n2_mocker.result(200)
+		n2.metrics.get_used_irq()
+		n2_mocker.result(100)
+		n2.get_vm_started()
+		n2_mocker.result(2)
 		n2.get_hostname()
 		n2_mocker.result("node2")
 		n2_mocker.count(0,None)
@@ -1020,16 +1319,18 @@ class XenClusterTests(MockerTestCase):
 		n3 = n3_mocker.mock()
 		n3.metrics.get_free_ram(False)
 		n3_mocker.result(520)
-		n3.metrics.get_free_ram()
-		n3_mocker.result(520)
+		n3.metrics.get_used_irq()
+		n3_mocker.result(100)
+		n3.get_vm_started()
+		n3_mocker.result(2)
 		n3.get_hostname()
 		n3_mocker.result("node3")
 		n3_mocker.count(0,None)
 		n3_mocker.replay()
 
-		search_vm_started = self.mocker.replace(self.cluster.search_vm_started)
-		search_vm_started('test1.home.net')
-		self.mocker.result([])
+		snapshot = self.mocker.replace(self.cluster.snapshot)
+		snapshot(['vms'])
+		self.mocker.result({'node1': {'vms': []}, 'node2': {'vms': []}, 'node3': {'vms': []}})
 		activate_vm = self.mocker.replace(self.cluster.activate_vm)
 		activate_vm(n3, 'test1.home.net')
 		self.mocker.throw(cxm.node.ShellError('node3',"foobar",1))
@@ -1050,12 +1351,10 @@ class XenClusterTests(MockerTestCase):
 		n1 = n1_mocker.mock()
 		n1.metrics.get_free_ram(False)
 		n1_mocker.result(150)
-		n1.metrics.get_free_ram()
-		n1_mocker.result(150)
-		n1.metrics.get_free_ram(False)
-		n1_mocker.result(150)
-		n1.metrics.get_free_ram()
-		n1_mocker.result(150)
+		n1.metrics.get_used_irq()
+		n1_mocker.result(100)
+		n1.get_vm_started()
+		n1_mocker.result(2)
 		n1.start('test2.home.net')
 		n1_mocker.throw(IOError("foobar"))
 		n1.deactivate_lv('test2.home.net')
@@ -1068,10 +1367,10 @@ class XenClusterTests(MockerTestCase):
 		n2 = n2_mocker.mock()
 		n2.metrics.get_free_ram(False)
 		n2_mocker.result(200)
-		n2.metrics.get_free_ram()
-		n2_mocker.result(200)
-		n2.metrics.get_free_ram(False)
-		n2_mocker.result(200)
+		n2.metrics.get_used_irq()
+		n2_mocker.result(100)
+		n2.get_vm_started()
+		n2_mocker.result(2)
 		n2.get_hostname()
 		n2_mocker.result("node2")
 		n2_mocker.count(0,None)
@@ -1081,23 +1380,21 @@ class XenClusterTests(MockerTestCase):
 		n3 = n3_mocker.mock()
 		n3.metrics.get_free_ram(False)
 		n3_mocker.result(520)
-		n3.metrics.get_free_ram()
-		n3_mocker.result(520)
+		n3.metrics.get_used_irq()
+		n3_mocker.result(100)
+		n3.get_vm_started()
+		n3_mocker.result(2)
 		n3.start('test1.home.net')
 		n3_mocker.throw(SystemExit(1))
 		n3.deactivate_lv('test1.home.net')
-		n3.metrics.get_free_ram(False)
-		n3_mocker.result(520)
 		n3.get_hostname()
 		n3_mocker.result("node3")
 		n3_mocker.count(0,None)
 		n3_mocker.replay()
 
-		search_vm_started = self.mocker.replace(self.cluster.search_vm_started)
-		search_vm_started('test1.home.net')
-		self.mocker.result([])
-		search_vm_started('test2.home.net')
-		self.mocker.result([])
+		snapshot = self.mocker.replace(self.cluster.snapshot)
+		snapshot(['vms'])
+		self.mocker.result({'node1': {'vms': []}, 'node2': {'vms': []}, 'node3': {'vms': []}})
 		activate_vm = self.mocker.replace(self.cluster.activate_vm)
 		activate_vm(n3, 'test1.home.net')
 		activate_vm(n1, 'test2.home.net')
@@ -1117,8 +1414,10 @@ class XenClusterTests(MockerTestCase):
 		n1 = n1_mocker.mock()
 		n1.metrics.get_free_ram(False)
 		n1_mocker.result(150)
-		n1.metrics.get_free_ram()
-		n1_mocker.result(150)
+		n1.metrics.get_used_irq()
+		n1_mocker.result(100)
+		n1.get_vm_started()
+		n1_mocker.result(2)
 		n1.get_hostname()
 		n1_mocker.result("node1")
 		n1_mocker.count(0,None)
@@ -1128,8 +1427,10 @@ class XenClusterTests(MockerTestCase):
 		n2 = n2_mocker.mock()
 		n2.metrics.get_free_ram(False)
 		n2_mocker.result(200)
-		n2.metrics.get_free_ram()
-		n2_mocker.result(200)
+		n2.metrics.get_used_irq()
+		n2_mocker.result(100)
+		n2.get_vm_started()
+		n2_mocker.result(2)
 		n2.get_hostname()
 		n2_mocker.result("node2")
 		n2_mocker.count(0,None)
@@ -1139,8 +1440,10 @@ class XenClusterTests(MockerTestCase):
 		n3 = n3_mocker.mock()
 		n3.metrics.get_free_ram(False)
 		n3_mocker.result(520)
-		n3.metrics.get_free_ram()
-		n3_mocker.result(520)
+		n3.metrics.get_used_irq()
+		n3_mocker.result(100)
+		n3.get_vm_started()
+		n3_mocker.result(2)
 		n3.start('test1.home.net')
 		n3_mocker.throw(Exception())
 		n3.deactivate_lv('test1.home.net')
@@ -1150,9 +1453,9 @@ class XenClusterTests(MockerTestCase):
 		n3_mocker.count(0,None)
 		n3_mocker.replay()
 
-		search_vm_started = self.mocker.replace(self.cluster.search_vm_started)
-		search_vm_started('test1.home.net')
-		self.mocker.result([])
+		snapshot = self.mocker.replace(self.cluster.snapshot)
+		snapshot(['vms'])
+		self.mocker.result({'node1': {'vms': []}, 'node2': {'vms': []}, 'node3': {'vms': []}})
 		activate_vm = self.mocker.replace(self.cluster.activate_vm)
 		activate_vm(n3, 'test1.home.net')
 		self.mocker.replay()
@@ -1172,8 +1475,10 @@ class XenClusterTests(MockerTestCase):
 		n1 = n1_mocker.mock()
 		n1.metrics.get_free_ram(False)
 		n1_mocker.result(150)
-		n1.metrics.get_free_ram()
-		n1_mocker.result(150)
+		n1.metrics.get_used_irq()
+		n1_mocker.result(100)
+		n1.get_vm_started()
+		n1_mocker.result(2)
 		n1.get_hostname()
 		n1_mocker.result("node1")
 		n1_mocker.count(0,None)
@@ -1183,8 +1488,10 @@ class XenClusterTests(MockerTestCase):
 		n2 = n2_mocker.mock()
 		n2.metrics.get_free_ram(False)
 		n2_mocker.result(200)
-		n2.metrics.get_free_ram()
-		n2_mocker.result(200)
+		n2.metrics.get_used_irq()
+		n2_mocker.result(100)
+		n2.get_vm_started()
+		n2_mocker.result(2)
 		n2.get_hostname()
 		n2_mocker.result("node2")
 		n2_mocker.count(0,None)
@@ -1194,8 +1501,10 @@ class XenClusterTests(MockerTestCase):
 		n3 = n3_mocker.mock()
 		n3.metrics.get_free_ram(False)
 		n3_mocker.result(520)
-		n3.metrics.get_free_ram()
-		n3_mocker.result(520)
+		n3.metrics.get_used_irq()
+		n3_mocker.result(100)
+		n3.get_vm_started()
+		n3_mocker.result(2)
 		n3.start('test1.home.net')
 		n3.enable_vm_autostart('test1.home.net')
 		n3_mocker.throw(cxm.node.SSHError('node3',"foobar",1))
@@ -1204,9 +1513,9 @@ class XenClusterTests(MockerTestCase):
 		n3_mocker.count(0,None)
 		n3_mocker.replay()
 
-		search_vm_started = self.mocker.replace(self.cluster.search_vm_started)
-		search_vm_started('test1.home.net')
-		self.mocker.result([])
+		snapshot = self.mocker.replace(self.cluster.snapshot)
+		snapshot(['vms'])
+		self.mocker.result({'node1': {'vms': []}, 'node2': {'vms': []}, 'node3': {'vms': []}})
 		activate_vm = self.mocker.replace(self.cluster.activate_vm)
 		activate_vm(n3, 'test1.home.net')
 		self.mocker.replay()
@@ -1403,7 +1712,7 @@ class XenClusterTests(MockerTestCase):
 		get_local_node()
 		self.mocker.result(n2)
 		start_vms = self.mocker.replace(self.cluster.start_vms)
-		start_vms(['test1.home.net', 'test2.home.net'])
+		start_vms(['test1.home.net', 'test2.home.net'], None)
 		self.mocker.replay()
 
 		self.cluster.nodes={'node1': n1, 'node2': n2, 'node3': n3}
@@ -1436,7 +1745,7 @@ class XenClusterTests(MockerTestCase):
 		get_local_node()
 		self.mocker.result(n2)
 		start_vms = self.mocker.replace(self.cluster.start_vms)
-		start_vms([])
+		start_vms([], None)
 		self.mocker.replay()
 
 		self.cluster.nodes={'node1': n1, 'node2': n2, 'node3': n3}